@@ -1,6 +1,5 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Request, render_template, request, jsonify, send_file, Response, stream_with_context, g
 from flask_cors import CORS
-from mistralai import Mistral
 import os
 import json
 import base64
@@ -11,9 +10,33 @@ import requests
 import re
 from urllib.parse import urlparse, unquote
 from dotenv import load_dotenv
+from werkzeug.exceptions import ClientDisconnected, RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 import mimetypes
 import io
+import itertools
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+
+from database.settings_manager import SettingsManager
+from services.result_cache import ResultCache, compute_file_sha256
+from services.job_queue import JobManager, JobQueueFullError, JOB_DONE
+from services.mistral_client import MistralClientManager
+from services.file_registry import MistralFileRegistry
+from services.pdf_fallback import PageAssetsReader, extract_page_assets, iter_fallback_assets
+from services.page_renderer import PageRenderCache
+from services.markdown_links import rewrite_image_links, page_image_resolver, image_url_for_path, restored_image_resolver
+from services.timing import span, collect_timings, propagate_timings, format_server_timing
+from services.metrics import MetricsRegistry
+from services.janitor import ArtifactJanitor
+from services.fetcher import DocumentFetcher, DocumentTooLargeError
+from services.ingest import IngestedFile, content_matches_extension
+from services.upload_sessions import UploadHashMismatchError, UploadOffsetError, UploadSessionManager
+from services.batch import BatchItem, BatchManager, ITEM_FAILED, iter_zip_stream
+from services.page_stream import PageStream, publish_pages, use_page_stream
+from services.workspace import WorkspaceHeartbeat, WorkspaceManager, artifact_ref, atomic_path, atomic_write, current_workspace, use_workspace
 
 # --- Инициализация и Конфигурация ---
 load_dotenv()
@@ -37,6 +60,13 @@ except ImportError:
     PILLOW_AVAILABLE = False
     logger.warning("Pillow не установлен. Обработка изображений ограничена. Установите: pip install Pillow==10.2.0")
 
+# Опциональный быстрый сериализатор JSON для потоковых ответов
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 app = Flask(__name__)
 CORS(app) # Включаем CORS для всех маршрутов
 
@@ -46,10 +76,266 @@ app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', tempfile.gettempdi
 app.config['ALLOWED_EXTENSIONS'] = {'pdf', 'png', 'jpg', 'jpeg', 'docx'} # TODO: docx не обрабатывается OCR Mistral напрямую
 app.config['MISTRAL_API_KEY'] = os.environ.get("MISTRAL_API_KEY")
 app.config['USE_MOCK_OCR'] = os.environ.get('USE_MOCK_OCR', 'False').lower() == 'true'
+app.config['USE_STUB_OCR'] = os.environ.get('USE_STUB_OCR', 'False').lower() == 'true'
+app.config['STUB_OCR_PORT'] = int(os.environ.get('STUB_OCR_PORT', 0))
+app.config['STUB_OCR_LATENCY_MS'] = float(os.environ.get('STUB_OCR_LATENCY_MS', 0))
+app.config['STUB_OCR_PAGE_LATENCY_MS'] = float(os.environ.get('STUB_OCR_PAGE_LATENCY_MS', 0))
+app.config['STUB_OCR_ERROR_RATE'] = float(os.environ.get('STUB_OCR_ERROR_RATE', 0))
+app.config['STUB_OCR_MISSING_BASE64_RATE'] = float(os.environ.get('STUB_OCR_MISSING_BASE64_RATE', 0))
+app.config['MISTRAL_OCR_MODEL'] = os.environ.get('MISTRAL_OCR_MODEL', 'mistral-ocr-latest')
+app.config['MISTRAL_SERVER_URL'] = os.environ.get('MISTRAL_SERVER_URL') or None
+app.config['MISTRAL_POOL_SIZE'] = int(os.environ.get('MISTRAL_POOL_SIZE', 10))
+app.config['MISTRAL_INLINE_MAX_MB'] = float(os.environ.get('MISTRAL_INLINE_MAX_MB', 10))
+app.config['MISTRAL_FILE_REGISTRY_PATH'] = os.environ.get('MISTRAL_FILE_REGISTRY_PATH', os.path.join(app.config['UPLOAD_FOLDER'], 'mistral_files.db'))
+app.config['MISTRAL_FILE_TTL_HOURS'] = int(os.environ.get('MISTRAL_FILE_TTL_HOURS', 24))
+app.config['PDF_FALLBACK_WORKERS'] = int(os.environ.get('PDF_FALLBACK_WORKERS', min(4, os.cpu_count() or 1)))
+app.config['IMAGE_WRITE_WORKERS'] = int(os.environ.get('IMAGE_WRITE_WORKERS', 4))
+app.config['TIMING_ENABLED'] = os.environ.get('TIMING_ENABLED', 'True').lower() == 'true'
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', 'True').lower() == 'true'
+app.config['METRICS_DB_PATH'] = os.environ.get('METRICS_DB_PATH', os.path.join(app.config['UPLOAD_FOLDER'], 'metrics.db'))
+app.config['PAGE_RENDER_CACHE_DIR'] = os.environ.get('PAGE_RENDER_CACHE_DIR', os.path.join(app.config['UPLOAD_FOLDER'], 'page_renders'))
+app.config['PAGE_RENDER_CACHE_MAX_MB'] = int(os.environ.get('PAGE_RENDER_CACHE_MAX_MB', 512))
+app.config['PAGE_RENDER_DEFAULT_DPI'] = int(os.environ.get('PAGE_RENDER_DEFAULT_DPI', 150))
+app.config['SETTINGS_DB_PATH'] = os.environ.get('SETTINGS_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'settings.db'))
+app.config['OCR_CACHE_DIR'] = os.environ.get('OCR_CACHE_DIR', os.path.join(app.config['UPLOAD_FOLDER'], 'ocr_cache'))
+app.config['OCR_CACHE_MAX_SIZE_MB'] = int(os.environ.get('OCR_CACHE_MAX_SIZE_MB', 1024))
+app.config['OCR_JOB_WORKERS'] = int(os.environ.get('OCR_JOB_WORKERS', 4))
+app.config['OCR_JOB_MAX_PENDING'] = int(os.environ.get('OCR_JOB_MAX_PENDING', 100))
+app.config['JOB_WORKSPACE_DIR'] = os.environ.get('JOB_WORKSPACE_DIR', os.path.join(app.config['UPLOAD_FOLDER'], 'jobs'))
+# Каталог приема загрузок; на той же файловой системе, что и JOB_WORKSPACE_DIR (перенос без копирования)
+app.config['UPLOAD_SPOOL_DIR'] = os.environ.get('UPLOAD_SPOOL_DIR', os.path.join(app.config['JOB_WORKSPACE_DIR'], 'incoming'))
+app.config['UPLOAD_CHUNK_MB'] = float(os.environ.get('UPLOAD_CHUNK_MB', 8))
+app.config['UPLOAD_SESSION_TTL_HOURS'] = float(os.environ.get('UPLOAD_SESSION_TTL_HOURS', 24))
+app.config['BATCH_MAX_CONCURRENCY'] = int(os.environ.get('BATCH_MAX_CONCURRENCY', 4))
+app.config['BATCH_MAX_ITEMS'] = int(os.environ.get('BATCH_MAX_ITEMS', 500))
+app.config['URL_FETCH_POOL_SIZE'] = int(os.environ.get('URL_FETCH_POOL_SIZE', 10))
+app.config['URL_FETCH_CHUNK_KB'] = int(os.environ.get('URL_FETCH_CHUNK_KB', 1024))
+app.config['URL_FETCH_TIMEOUT'] = float(os.environ.get('URL_FETCH_TIMEOUT', 30))
+app.config['URL_FETCH_RANGE_PARTS'] = int(os.environ.get('URL_FETCH_RANGE_PARTS', 4))
+app.config['URL_FETCH_RANGE_MIN_MB'] = float(os.environ.get('URL_FETCH_RANGE_MIN_MB', 8))
+app.config['URL_FETCH_RANGE_RETRIES'] = int(os.environ.get('URL_FETCH_RANGE_RETRIES', 3))
+app.config['URL_CACHE_DIR'] = os.environ.get('URL_CACHE_DIR', os.path.join(app.config['UPLOAD_FOLDER'], 'url_cache'))
+app.config['URL_CACHE_MAX_MB'] = int(os.environ.get('URL_CACHE_MAX_MB', 1024))
+app.config['ARTIFACT_TTL_HOURS'] = float(os.environ.get('ARTIFACT_TTL_HOURS', 24))
+app.config['ARTIFACT_MAX_DISK_MB'] = int(os.environ.get('ARTIFACT_MAX_DISK_MB', 2048))
+app.config['JANITOR_INTERVAL_SECONDS'] = float(os.environ.get('JANITOR_INTERVAL_SECONDS', 300))
+app.config['JANITOR_MIN_IDLE_SECONDS'] = float(os.environ.get('JANITOR_MIN_IDLE_SECONDS', 300))
+app.config['WORKSPACE_HEARTBEAT_SECONDS'] = float(os.environ.get('WORKSPACE_HEARTBEAT_SECONDS', 30))
+
+# При запуске "python app.py" процессы пула fallback (spawn) импортируют этот модуль
+# как __mp_main__: фоновые потоки и stub-сервер в них не запускаются
+IS_POOL_WORKER_IMPORT = __name__ == '__mp_main__'
+
+# Локальный stub API Mistral: полный конвейер (клиент, upload, чанки, fallback) без сети
+stub_ocr_server = None
+if app.config['USE_STUB_OCR'] and not app.config['USE_MOCK_OCR'] and not IS_POOL_WORKER_IMPORT:
+    from services.stub_ocr import StubOCREngine, start_stub_server
+    stub_ocr_server = start_stub_server(
+        StubOCREngine(
+            latency_ms=app.config['STUB_OCR_LATENCY_MS'],
+            page_latency_ms=app.config['STUB_OCR_PAGE_LATENCY_MS'],
+            error_rate=app.config['STUB_OCR_ERROR_RATE'],
+            missing_base64_rate=app.config['STUB_OCR_MISSING_BASE64_RATE']
+        ),
+        port=app.config['STUB_OCR_PORT'],
+        storage_dir=os.path.join(app.config['UPLOAD_FOLDER'], 'stub_ocr_files')
+    )
+    app.config['MISTRAL_SERVER_URL'] = f"http://127.0.0.1:{stub_ocr_server.server_address[1]}"
+    app.config['MISTRAL_API_KEY'] = app.config['MISTRAL_API_KEY'] or 'stub'
+    logger.info(f"[STUB OCR] Используется локальный stub API Mistral: {app.config['MISTRAL_SERVER_URL']}")
 
 if not app.config['MISTRAL_API_KEY'] and not app.config['USE_MOCK_OCR']:
     logger.warning("MISTRAL_API_KEY не установлен, и USE_MOCK_OCR установлен в False. API запросы не будут работать.")
 
+# Настройки пользователя (категории performance/api и т.д.) из settings.db
+settings_manager = SettingsManager(app.config['SETTINGS_DB_PATH'])
+
+def get_app_setting(key, default=None):
+    """Читает настройку из settings.db, при ошибке БД возвращает значение по умолчанию."""
+    try:
+        return settings_manager.get_setting(key, default)
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать настройку '{key}': {e}")
+        return default
+
+_result_cache = None
+
+def get_result_cache():
+    """Возвращает кэш результатов OCR или None, если кэширование выключено настройкой cache_enabled."""
+    global _result_cache
+    if not get_app_setting('cache_enabled', True):
+        return None
+    ttl_seconds = int(get_app_setting('cache_duration_hours', 24)) * 3600
+    if _result_cache is None:
+        _result_cache = ResultCache(
+            app.config['OCR_CACHE_DIR'],
+            app.config['OCR_CACHE_MAX_SIZE_MB'] * 1024 * 1024,
+            ttl_seconds
+        )
+    _result_cache.ttl_seconds = ttl_seconds
+    return _result_cache
+
+# Фоновые OCR задачи: ограниченный пул воркеров для /jobs и синхронных маршрутов
+job_manager = JobManager(
+    max_workers=app.config['OCR_JOB_WORKERS'],
+    max_pending=app.config['OCR_JOB_MAX_PENDING']
+)
+
+# Пакетная обработка (/api/batch): элементы пакета ставятся в ту же очередь с ограничением на пакет
+batch_manager = BatchManager(job_manager)
+
+# Отдельный каталог файлов для каждой задачи: параллельные задачи не перезаписывают файлы друг друга
+workspace_manager = WorkspaceManager(app.config['JOB_WORKSPACE_DIR'], app.config['UPLOAD_FOLDER'])
+# Маркеры выполняющихся задач для фоновой очистки других процессов
+workspace_heartbeat = WorkspaceHeartbeat(app.config['WORKSPACE_HEARTBEAT_SECONDS'])
+
+# Возобновляемые загрузки (/uploads): части собираются сразу в каталоге будущей задачи
+upload_sessions = UploadSessionManager(
+    workspace_manager,
+    max_bytes=app.config['MAX_CONTENT_LENGTH'],
+    ttl_seconds=app.config['UPLOAD_SESSION_TTL_HOURS'] * 3600
+)
+
+class IngestRequest(Request):
+    """Запрос, файлы multipart которого пишутся сразу на диск с подсчетом SHA-256 и размера."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        ingested = IngestedFile(app.config['UPLOAD_SPOOL_DIR'], app.config['MAX_CONTENT_LENGTH'])
+        self.__dict__.setdefault('_ingested_files', []).append(ingested)
+        return ingested
+
+    def close(self):
+        # Прием, прерванный ошибкой разбора, не попадает в request.files - файлы закрываются здесь
+        super().close()
+        for ingested in self.__dict__.get('_ingested_files', ()):
+            ingested.close()
+
+app.request_class = IngestRequest
+
+def job_dir():
+    """Каталог файлов текущей задачи (вне задачи - UPLOAD_FOLDER)."""
+    workspace = current_workspace()
+    return workspace.path if workspace is not None else app.config['UPLOAD_FOLDER']
+
+# Загрузка документов по URL: общий пул соединений и кэш с условными запросами
+document_fetcher = DocumentFetcher(
+    max_bytes=app.config['MAX_CONTENT_LENGTH'],
+    cache_dir=app.config['URL_CACHE_DIR'],
+    cache_max_bytes=app.config['URL_CACHE_MAX_MB'] * 1024 * 1024,
+    chunk_size=app.config['URL_FETCH_CHUNK_KB'] * 1024,
+    pool_size=app.config['URL_FETCH_POOL_SIZE'],
+    timeout=app.config['URL_FETCH_TIMEOUT'],
+    range_parts=app.config['URL_FETCH_RANGE_PARTS'],
+    range_min_bytes=int(app.config['URL_FETCH_RANGE_MIN_MB'] * 1024 * 1024),
+    range_retries=app.config['URL_FETCH_RANGE_RETRIES']
+)
+
+# Общий клиент Mistral с пулом соединений (переиспользуется всеми воркерами)
+mistral_client_manager = MistralClientManager(
+    pool_size=app.config['MISTRAL_POOL_SIZE'],
+    server_url=app.config['MISTRAL_SERVER_URL']
+)
+
+# Реестр загруженных в Mistral файлов: повторная обработка документа без повторной загрузки
+mistral_file_registry = MistralFileRegistry(
+    app.config['MISTRAL_FILE_REGISTRY_PATH'],
+    ttl_seconds=app.config['MISTRAL_FILE_TTL_HOURS'] * 3600
+)
+
+def get_mistral_account():
+    """Отпечаток текущего API-ключа для реестра загруженных файлов."""
+    return MistralFileRegistry.account_fingerprint(app.config['MISTRAL_API_KEY'], app.config['MISTRAL_SERVER_URL'])
+
+# Запись декодированных изображений из ответа OCR на диск (общий пул потоков)
+image_write_executor = ThreadPoolExecutor(
+    max_workers=app.config['IMAGE_WRITE_WORKERS'],
+    thread_name_prefix='image-write'
+)
+
+# Ленивый рендер страниц PDF для режима сравнения (/pdf_page/<hash>/<page>)
+page_render_cache = PageRenderCache(
+    app.config['PAGE_RENDER_CACHE_DIR'],
+    app.config['PAGE_RENDER_CACHE_MAX_MB'] * 1024 * 1024
+)
+
+# Метрики для /metrics: общая sqlite база, поэтому значения агрегируются по всем процессам
+metrics_registry = MetricsRegistry(app.config['METRICS_DB_PATH'], enabled=app.config['METRICS_ENABLED'])
+for _name, _help in (
+    ('ocr_http_requests_total', 'HTTP requests to OCR endpoints by route and status'),
+    ('ocr_request_duration_seconds', 'End-to-end OCR endpoint latency'),
+    ('ocr_in_flight_requests', 'OCR endpoint requests currently being served'),
+    ('ocr_stage_duration_seconds', 'Per-stage OCR processing latency'),
+    ('ocr_documents_processed_total', 'Processed documents by source and cache use'),
+    ('ocr_jobs_failed_total', 'Failed OCR jobs'),
+    ('ocr_pages_processed_total', 'Processed pages'),
+    ('ocr_images_processed_total', 'Processed images'),
+    ('ocr_download_bytes_total', 'Bytes downloaded from document URLs'),
+    ('ocr_url_fetch_total', 'Document URL fetches by result (downloaded or not_modified)'),
+    ('ocr_upload_bytes_total', 'Document bytes sent to Mistral by submission mode'),
+    ('ocr_fallback_total', 'PyMuPDF fallback checks by activation'),
+    ('ocr_cache_requests_total', 'OCR result cache lookups by result'),
+    ('mistral_api_errors_total', 'Mistral API errors by operation'),
+    ('mistral_api_retries_total', 'Mistral API operations repeated after a failure'),
+    ('artifact_workspaces_removed_total', 'Job workspaces removed by the janitor by reason'),
+    ('artifact_freed_bytes_total', 'Bytes freed by the artifact janitor'),
+):
+    metrics_registry.describe(_name, _help)
+
+def is_workspace_active(workspace_id):
+    """Каталог принадлежит загрузке или незавершенной задаче либо элементу пакета этого процесса.
+
+    Выполняющиеся задачи других процессов отмечены маркером job.active (его проверяет artifact_janitor).
+    """
+    return upload_sessions.is_active(workspace_id) or batch_manager.is_active(workspace_id) or any(
+        job.metadata.get('workspace') == workspace_id and not job.finished
+        for job in job_manager.list_jobs())
+
+def record_janitor_sweep(stats):
+    """Логирует проход очистки и учитывает удаленные каталоги в метриках."""
+    if stats['expired'] or stats['evicted']:
+        logger.info(f"[JANITOR] Удалено каталогов задач: по сроку {stats['expired']}, по лимиту диска {stats['evicted']}; "
+                    f"освобождено {stats['freed_bytes'] / 1024 / 1024:.1f} МБ, занято {stats['total_bytes'] / 1024 / 1024:.1f} МБ")
+    with metrics_registry.batch() as batch:
+        if stats['expired']:
+            batch.inc('artifact_workspaces_removed_total', stats['expired'], {'reason': 'ttl'})
+        if stats['evicted']:
+            batch.inc('artifact_workspaces_removed_total', stats['evicted'], {'reason': 'quota'})
+        if stats['freed_bytes']:
+            batch.inc('artifact_freed_bytes_total', stats['freed_bytes'])
+
+# Фоновая очистка каталогов задач: срок хранения, лимит диска, вытеснение давно не отдававшихся
+artifact_janitor = ArtifactJanitor(
+    app.config['JOB_WORKSPACE_DIR'],
+    max_age_seconds=app.config['ARTIFACT_TTL_HOURS'] * 3600,
+    max_total_bytes=app.config['ARTIFACT_MAX_DISK_MB'] * 1024 * 1024,
+    interval_seconds=app.config['JANITOR_INTERVAL_SECONDS'],
+    min_idle_seconds=app.config['JANITOR_MIN_IDLE_SECONDS'],
+    # Маркер задачи другого процесса считается брошенным, если не обновлялся 4 периода
+    active_marker_max_age=app.config['WORKSPACE_HEARTBEAT_SECONDS'] * 4,
+    is_active=is_workspace_active,
+    on_sweep=record_janitor_sweep
+)
+if not IS_POOL_WORKER_IMPORT:
+    artifact_janitor.start()
+
+METRICS_ROUTES = {
+    'upload_document_route': '/upload',
+    'api_get_markdown': '/api/markdown',
+    'api_get_json': '/api/json',
+    'create_job_route': '/jobs',
+}
+
+def record_mistral_error(operation):
+    """Учитывает ошибку вызова Mistral API в метриках."""
+    metrics_registry.inc('mistral_api_errors_total', labels={'operation': operation})
+
+def get_mistral_client():
+    """Возвращает общий клиент Mistral с таймаутом из настройки api_timeout."""
+    return mistral_client_manager.get_client(
+        app.config['MISTRAL_API_KEY'],
+        timeout_seconds=int(get_app_setting('api_timeout', 30))
+    )
+
 # --- Вспомогательные функции ---
 def allowed_file(filename):
     """Проверяет, разрешено ли расширение файла."""
@@ -62,82 +348,23 @@ def get_mime_type_by_filename(filename):
     return mime_type or 'application/octet-stream'
 
 def update_markdown_image_links(page_data, page_index, include_images):
-    """Универсальная функция для обновления ссылок на изображения в markdown."""
+    """Универсальная функция для обновления ссылок на изображения в markdown.
+
+    Все ссылки страницы переписываются за один проход через таблицу соответствий
+    (id изображения API / fallback файл -> /image/<filename>).
+    """
     if not include_images:
-        logger.info(f"[MARKDOWN UPDATE] Страница {page_index}: include_images=False, пропускаем")
+        logger.debug(f"[MARKDOWN UPDATE] Страница {page_index}: include_images=False, пропускаем")
         return
         
     markdown_text = page_data.get('markdown', '')
     if not markdown_text:
-        logger.info(f"[MARKDOWN UPDATE] Страница {page_index}: нет markdown текста")
         return
-        
-    logger.info(f"[MARKDOWN UPDATE] Страница {page_index}: markdown содержит {len(markdown_text)} символов")
     
-    markdown_images = extract_images_from_markdown(markdown_text, page_index)
-    if not markdown_images:
-        logger.info(f"[MARKDOWN UPDATE] Страница {page_index}: не найдено ссылок на изображения в markdown")
-        return
-        
-    # Найдем API изображения с путями (после возможного связывания с fallback)
-    saved_api_images_for_page = [img for img in page_data.get("images", []) if img.get("path")]
-    logger.info(f"[MARKDOWN UPDATE] Страница {page_index}: найдено {len(markdown_images)} MD ссылок, {len(saved_api_images_for_page)} изображений с путями")
-    
-    # Детальная отладка найденных изображений
-    for i, img in enumerate(page_data.get("images", [])):
-        logger.info(f"[MARKDOWN UPDATE] Изображение {i}: id='{img.get('id')}', path='{img.get('path')}', coords={img.get('coordinates')}")
-    
-    temp_updated_markdown = markdown_text
-    updates_made = 0
-    for k, md_img in enumerate(markdown_images):
-        logger.info(f"[MARKDOWN UPDATE] Обрабатываем MD ссылку {k+1}: '{md_img['markdown_pattern']}'")
-        
-        if k < len(saved_api_images_for_page):
-            api_image_data = saved_api_images_for_page[k]
-            img_filename_on_disk = os.path.basename(api_image_data['path'])
-            new_url = f"/image/{img_filename_on_disk}"
-            
-            old_pattern = md_img['markdown_pattern']
-            new_pattern = f"![{md_img['alt_text']}]({new_url})"
-            
-            logger.info(f"[MARKDOWN UPDATE] Замена MD ссылки {k+1}: '{old_pattern}' -> '{new_pattern}'")
-            
-            if old_pattern in temp_updated_markdown:
-                temp_updated_markdown = temp_updated_markdown.replace(old_pattern, new_pattern, 1)
-                updates_made += 1
-                logger.info(f"[MARKDOWN UPDATE] ✅ Замена выполнена успешно")
-            else:
-                logger.warning(f"[MARKDOWN UPDATE] ❌ Паттерн '{old_pattern}' не найден в markdown!")
-        else:
-            logger.warning(f"[MARKDOWN UPDATE] Нет изображения для MD ссылки {k+1}: '{md_img['markdown_pattern']}'")
-    
-    logger.info(f"[MARKDOWN UPDATE] Страница {page_index}: выполнено {updates_made} замен из {len(markdown_images)} найденных")
-    page_data["markdown"] = temp_updated_markdown
-
-def extract_images_from_markdown(markdown_text, page_index):
-    """Извлекает ссылки на изображения из markdown текста Mistral OCR."""
-    # FIXED: Парсим markdown для извлечения ссылок на изображения
-    # Mistral OCR встраивает изображения как ![alt](img-N.jpeg) или ![alt](image_id)
-    image_pattern = r'!\[([^\]]*)\]\(([^)]+\.(jpeg|jpg|png|gif|webp))\)'
-    matches = re.findall(image_pattern, markdown_text, re.IGNORECASE)
-    
-    extracted_images = []
-    for alt_text, image_ref, ext in matches:
-        # Создаем уникальное имя файла для изображения
-        img_id = image_ref.replace('.', '_').replace('/', '_')
-        img_filename = f"page_{page_index}_extracted_{img_id}.{ext}"
-        
-        extracted_images.append({
-            'id': img_id,
-            'alt_text': alt_text,
-            'original_ref': image_ref,
-            'filename': img_filename,
-            'markdown_pattern': f'![{alt_text}]({image_ref})'
-        })
-        
-        logger.info(f"Найдено изображение в markdown: {image_ref} -> {img_filename}")
-    
-    return extracted_images
+    # API изображения с путями (после возможного связывания с fallback)
+    resolve = page_image_resolver(page_data.get("images", []), markdown_text)
+    page_data["markdown"], updates_made = rewrite_image_links(markdown_text, resolve)
+    logger.debug(f"[MARKDOWN UPDATE] Страница {page_index}: выполнено {updates_made} замен ссылок на изображения")
 
 def validate_ocr_response(ocr_response):
     """Валидация ответа OCR для выявления потенциальных проблем (согласно лучшим практикам)."""
@@ -215,35 +442,17 @@ def enhanced_base64_processing(base64_data, img_id):
         logger.error(f"Ошибка декодирования base64 для {img_id}: {e}")
         return None
 
-def save_base64_image(img_id, base64_data, upload_folder):
-    """Сохраняет base64 изображение как реальный файл (аналогично Next.js приложению)."""
-    try:
-        # Определяем MIME тип из base64 данных
-        if base64_data.startswith('data:'):
-            # Формат: data:image/jpeg;base64,/9j/4AAQSkZJRgABAQAAAQ...
-            header, data = base64_data.split(',', 1)
-            mime_type = header.split(';')[0].split(':')[1]
-            extension = mime_type.split('/')[1]
-        else:
-            # Просто base64 без заголовка
-            data = base64_data
-            extension = 'jpeg'  # По умолчанию
-            
-        # Создаем уникальное имя файла
-        filename = f"{img_id}-{os.urandom(4).hex()}.{extension}"
-        file_path = os.path.join(upload_folder, filename)
-        
-        # Декодируем и сохраняем
-        image_data = base64.b64decode(data)
-        with open(file_path, 'wb') as f:
-            f.write(image_data)
-            
-        logger.info(f"Изображение сохранено: {file_path} ({len(image_data)} байт)")
-        return file_path
-        
-    except Exception as e:
-        logger.error(f"Ошибка сохранения base64 изображения {img_id}: {e}")
-        return None
+IMAGE_MIME_TYPES = {'png': 'image/png', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'webp': 'image/webp', 'svg': 'image/svg+xml'}
+
+def write_image_file(img_path, img_data):
+    """Записывает декодированное изображение на диск (выполняется в image_write_executor)."""
+    atomic_write(img_path, img_data)
+
+def image_payload_to_data_url(base64_data, mime_type='image/png'):
+    """Возвращает data URL для строки base64 из ответа API без повторного кодирования."""
+    if base64_data.startswith('data:'):
+        return base64_data
+    return f"data:{mime_type};base64,{base64_data}"
 
 def create_svg_placeholder(filename, image_id, width, height):
     """Создает и сохраняет SVG-плейсхолдер для изображения без данных."""
@@ -265,100 +474,10 @@ def create_svg_placeholder(filename, image_id, width, height):
             (Base64 данные недоступны в API)
         </text>
     </svg>'''
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(filename))
-    with open(filepath, "w", encoding="utf-8") as f:
-        f.write(svg_content)
+    filepath = os.path.join(job_dir(), secure_filename(filename))
+    atomic_write(filepath, svg_content)
     return filepath
 
-def extract_pdf_pages_as_images(pdf_path, dpi=200):
-    """Конвертирует страницы PDF в изображения для сравнения с результатами OCR."""
-    if not PYMUPDF_AVAILABLE:
-        logger.warning("PyMuPDF недоступен. Установите: pip install PyMuPDF==1.23.26")
-        return []
-    
-    try:
-        doc = fitz.open(pdf_path)
-        page_images = []
-        
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            # Создаем изображение страницы с высоким разрешением
-            mat = fitz.Matrix(dpi/72, dpi/72)  # Матрица масштабирования
-            pix = page.get_pixmap(matrix=mat)
-            
-            # Сохраняем как PNG
-            img_filename = f"pdf_page_{page_num}.png"
-            img_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(img_filename))
-            pix.save(img_path)
-            
-            page_images.append({
-                'page_num': page_num,
-                'image_path': img_path,
-                'width': pix.width,
-                'height': pix.height
-            })
-            logger.info(f"Конвертирована страница {page_num}: {img_path} ({pix.width}x{pix.height})")
-        
-        doc.close()
-        return page_images
-    except Exception as e:
-        logger.error(f"Ошибка конвертации PDF в изображения: {e}")
-        return []
-
-def extract_images_from_pdf(pdf_path):
-    """Извлекает встроенные изображения напрямую из PDF (как fallback для Mistral OCR)."""
-    if not PYMUPDF_AVAILABLE:
-        logger.warning("PyMuPDF недоступен. Установите: pip install PyMuPDF==1.23.26")
-        return []
-    
-    try:
-        doc = fitz.open(pdf_path)
-        extracted_images = []
-        
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            image_list = page.get_images()
-            
-            for img_index, img in enumerate(image_list):
-                # Получаем изображение
-                xref = img[0]
-                pix = fitz.Pixmap(doc, xref)
-                
-                if pix.n - pix.alpha < 4:  # Проверяем что это не CMYK
-                    # Сохраняем изображение
-                    img_filename = f"extracted_page_{page_num}_img_{img_index}.png"
-                    img_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(img_filename))
-                    
-                    if pix.alpha:
-                        pix = fitz.Pixmap(fitz.csRGB, pix)
-                    
-                    pix.save(img_path)
-                    
-                    # Получаем координаты изображения на странице
-                    rects = page.get_image_rects(xref)
-                    bbox = rects[0] if rects else page.rect
-                    
-                    extracted_images.append({
-                        'page_num': page_num,
-                        'image_index': img_index,
-                        'image_path': img_path,
-                        'width': pix.width,
-                        'height': pix.height,
-                        'bbox': {
-                            'x0': bbox.x0, 'y0': bbox.y0,
-                            'x1': bbox.x1, 'y1': bbox.y1
-                        }
-                    })
-                    logger.info(f"Извлечено изображение: страница {page_num}, индекс {img_index}")
-                
-                pix = None  # Освобождаем память
-        
-        doc.close()
-        return extracted_images
-    except Exception as e:
-        logger.error(f"Ошибка извлечения изображений из PDF: {e}")
-        return []
-
 def handle_google_drive_url(url):
     """Преобразует URL Google Drive в прямой URL для скачивания."""
     parsed_url = urlparse(url)
@@ -376,28 +495,21 @@ def handle_google_drive_url(url):
     return url
 
 def download_file_from_url(url, save_path):
-    """Загружает файл по URL и сохраняет его локально."""
+    """Загружает файл по URL и сохраняет его локально.
+
+    Возвращает FetchResult: SHA-256 считается во время загрузки, при ответе 304
+    файл берется из кэша URL без повторной загрузки.
+    """
     try:
         url = handle_google_drive_url(url)
-        response = requests.get(url, stream=True, timeout=30) # 30 секунд таймаут
-        response.raise_for_status()
-
-        # Проверка Content-Type (если возможно)
-        content_type = response.headers.get('Content-Type', '').lower()
         # TODO: Добавить более строгую проверку MIME-типов на основе ALLOWED_EXTENSIONS
         # Например, application/pdf, image/jpeg, image/png
-        # if not any(allowed_mime in content_type for allowed_mime in ['pdf', 'jpeg', 'png']):
-        #     raise ValueError(f"Неподдерживаемый тип контента: {content_type}")
-
-        # Проверка размера файла (если Content-Length доступен)
-        content_length = response.headers.get('Content-Length')
-        if content_length and int(content_length) > app.config['MAX_CONTENT_LENGTH']:
-            raise ValueError(f"Файл слишком большой. Максимальный размер: {app.config['MAX_CONTENT_LENGTH'] // (1024*1024)}MB")
-
-        with open(save_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        return save_path
+        fetched = document_fetcher.fetch(url, save_path)
+        if fetched.not_modified:
+            logger.info(f"[URL CACHE] Документ не изменился (304), используется сохраненная копия: {url}")
+        return fetched
+    except DocumentTooLargeError:
+        raise ValueError(f"Файл слишком большой. Максимальный размер: {app.config['MAX_CONTENT_LENGTH'] // (1024*1024)}MB")
     except requests.exceptions.RequestException as e:
         logger.error(f"Ошибка загрузки файла по URL {url}: {e}")
         raise ValueError(f"Не удалось загрузить файл: {e}")
@@ -418,7 +530,7 @@ def mock_ocr_processing(file_path, include_images=True):
         # FIXED: Создаем реальный файл изображения для демо-режима
         # Применяем secure_filename здесь, чтобы имя файла было "чистым" с самого начала
         secured_demo_img_filename = secure_filename(demo_img_filename)
-        demo_img_path = os.path.join(app.config['UPLOAD_FOLDER'], secured_demo_img_filename)
+        demo_img_path = os.path.join(job_dir(), secured_demo_img_filename)
         logger.info(f"[MOCK_OCR] Планируемый путь к демо-изображению: {demo_img_path}")
         
         # Создаем простое демо-изображение (красный квадрат 100x100)
@@ -430,8 +542,7 @@ def mock_ocr_processing(file_path, include_images=True):
             
             # Декодируем и сохраняем изображение
             img_data = base64.b64decode(demo_img_b64_data)
-            with open(demo_img_path, "wb") as img_file:
-                img_file.write(img_data)
+            atomic_write(demo_img_path, img_data)
             logger.info(f"[MOCK_OCR] Демо-изображение успешно записано в: {demo_img_path}")
             
             demo_images.append({
@@ -470,8 +581,8 @@ def mock_ocr_processing(file_path, include_images=True):
     mock_json_filename = f"mock_ocr_{os.urandom(8).hex()}.json"
 
     # Создание пустых файлов для имитации
-    open(os.path.join(app.config['UPLOAD_FOLDER'], mock_md_filename), 'w').close()
-    open(os.path.join(app.config['UPLOAD_FOLDER'], mock_json_filename), 'w').close()
+    open(os.path.join(job_dir(), mock_md_filename), 'w').close()
+    open(os.path.join(job_dir(), mock_json_filename), 'w').close()
 
     return {
         "document_url": f"mock_url_for_{base_filename}",
@@ -480,232 +591,633 @@ def mock_ocr_processing(file_path, include_images=True):
         "json_file": mock_json_filename
     }
 
-def mistral_ocr_processing(file_path, include_images=True):
-    """Обрабатывает документ с помощью Mistral OCR API."""
-    if not app.config['MISTRAL_API_KEY']:
-        raise ValueError("API-ключ Mistral не установлен.")
+def get_registered_signed_url(client, document_hash):
+    """Возвращает подписанный URL для ранее загруженного документа или None."""
+    if not document_hash:
+        return None
+    account = get_mistral_account()
+    file_id = mistral_file_registry.lookup(document_hash, account)
+    if not file_id:
+        return None
+    try:
+        with span('signed_url'):
+            signed_url = client.files.get_signed_url(file_id=file_id)
+        logger.info(f"[FILE REGISTRY] Повторно используется загруженный файл {file_id}")
+        return signed_url
+    except Exception as e:
+        # Файл мог быть удален в Mistral - забываем запись и загружаем заново
+        logger.warning(f"[FILE REGISTRY] Файл {file_id} недоступен, загружаем повторно: {e}")
+        record_mistral_error('get_signed_url')
+        metrics_registry.inc('mistral_api_retries_total', labels={'operation': 'files_upload'})
+        mistral_file_registry.forget(document_hash, account)
+        return None
 
-    client = Mistral(api_key=app.config['MISTRAL_API_KEY'])
+@contextmanager
+def open_source_file(file_path, source_file=None):
+    """Файл документа для чтения: открытый при приеме (source_file, с начала) или открытый по пути."""
+    if source_file is not None:
+        source_file.seek(0)
+        yield source_file
+        return
+    with open(file_path, "rb") as f:
+        yield f
+
+def upload_and_ocr(client, file_path, include_images=True, document_hash=None, source_file=None):
+    """Загружает файл в Mistral, получает подписанный URL и выполняет OCR.
+
+    Если передан document_hash и файл с таким содержимым уже загружен, загрузка пропускается.
+    source_file - файл, открытый при приеме загрузки (читается вместо повторного открытия).
+    Возвращает (ocr_response, document_url).
+    """
     mime_type = get_mime_type_by_filename(file_path)
 
+    signed_url = get_registered_signed_url(client, document_hash)
+    if signed_url is None:
+        try:
+            with open_source_file(file_path, source_file) as f, span('files_upload'):
+                uploaded_file = client.files.upload(
+                    file={"file_name": os.path.basename(file_path), "content": f, "mime_type": mime_type},
+                    purpose="ocr"
+                )
+            metrics_registry.inc('ocr_upload_bytes_total', os.path.getsize(file_path), {'mode': 'upload'})
+        except Exception as e:
+            logger.error(f"Ошибка загрузки файла в Mistral API: {e}")
+            record_mistral_error('files_upload')
+            raise ValueError(f"Ошибка взаимодействия с Mistral API при загрузке файла: {e}")
+
+        with span('signed_url'):
+            signed_url = client.files.get_signed_url(file_id=uploaded_file.id)
+        if document_hash:
+            mistral_file_registry.remember(document_hash, get_mistral_account(), uploaded_file.id)
+
     try:
-        with open(file_path, "rb") as f:
-            uploaded_file = client.files.upload(
-                file={"file_name": os.path.basename(file_path), "content": f, "mime_type": mime_type},
-                purpose="ocr"
+        with span('ocr_process'):
+            ocr_response = client.ocr.process(
+                model=app.config['MISTRAL_OCR_MODEL'],
+                document={"type": "document_url", "document_url": signed_url.url},
+                include_image_base64=include_images
             )
     except Exception as e:
-        logger.error(f"Ошибка загрузки файла в Mistral API: {e}")
-        raise ValueError(f"Ошибка взаимодействия с Mistral API при загрузке файла: {e}")
+        logger.error(f"Ошибка OCR обработки в Mistral API: {e}")
+        record_mistral_error('ocr_process')
+        raise ValueError(f"Ошибка взаимодействия с Mistral API при OCR обработке: {e}")
+    return ocr_response, signed_url.url
+
+INLINE_IMAGE_MIME_TYPES = {'image/png', 'image/jpeg'}
+
+def should_submit_inline(file_path):
+    """Малые PDF и PNG/JPEG отправляются в ocr.process напрямую как data URL."""
+    max_bytes = app.config['MISTRAL_INLINE_MAX_MB'] * 1024 * 1024
+    if max_bytes <= 0:
+        return False
+    mime_type = get_mime_type_by_filename(file_path)
+    if mime_type != 'application/pdf' and mime_type not in INLINE_IMAGE_MIME_TYPES:
+        return False
+    return os.path.getsize(file_path) <= max_bytes
 
-    signed_url = client.files.get_signed_url(file_id=uploaded_file.id)
+def inline_ocr(client, file_path, include_images=True, source_file=None):
+    """Выполняет OCR одним запросом, передавая документ как base64 data URL.
+
+    Пропускает files.upload и files.get_signed_url. Возвращает (ocr_response, None).
+    """
+    mime_type = get_mime_type_by_filename(file_path)
+    with open_source_file(file_path, source_file) as f:
+        data_url = f"data:{mime_type};base64,{base64.b64encode(f.read()).decode('ascii')}"
+
+    metrics_registry.inc('ocr_upload_bytes_total', os.path.getsize(file_path), {'mode': 'inline'})
+
+    if mime_type in INLINE_IMAGE_MIME_TYPES:
+        document = {"type": "image_url", "image_url": data_url}
+    else:
+        document = {"type": "document_url", "document_url": data_url}
 
     try:
-        ocr_response = client.ocr.process(
-            model="mistral-ocr-latest",
-            document={"type": "document_url", "document_url": signed_url.url},
-            include_image_base64=include_images
-        )
-        # ENHANCED: Валидация ответа согласно лучшим практикам
-        validation_result = validate_ocr_response(ocr_response)
-        logger.info(f"Получен ответ от Mistral OCR API. Страниц: {len(ocr_response.pages)}")
-        logger.info(f"Результаты валидации: {validation_result['valid_images']}/{validation_result['total_images']} изображений валидны ({validation_result['success_rate']:.1f}%)")
-        
-        for i, page in enumerate(ocr_response.pages):
-            logger.info(f"Страница {i}: изображений в API ответе: {len(page.images) if page.images else 0}")
-            if page.images:
-                for j, img in enumerate(page.images):
-                    img_id = getattr(img, 'id', 'unknown')
-                    # Детальное логирование структуры изображения
-                    img_attrs = []
-                    for attr in ['id', 'image_base64', 'top_left_x', 'top_left_y', 'bottom_right_x', 'bottom_right_y']:
-                        if hasattr(img, attr):
-                            value = getattr(img, attr)
-                            if attr == 'image_base64':
-                                value_str = f"length={len(value) if value else 0}"
-                            else:
-                                value_str = str(value)
-                            img_attrs.append(f"{attr}={value_str}")
-                    logger.info(f"  Изображение {j}: {', '.join(img_attrs)}")
+        with span('ocr_process'):
+            ocr_response = client.ocr.process(
+                model=app.config['MISTRAL_OCR_MODEL'],
+                document=document,
+                include_image_base64=include_images
+            )
     except Exception as e:
         logger.error(f"Ошибка OCR обработки в Mistral API: {e}")
+        record_mistral_error('ocr_process')
         raise ValueError(f"Ошибка взаимодействия с Mistral API при OCR обработке: {e}")
+    return ocr_response, None
+
+def submit_document_for_ocr(client, file_path, include_images=True, document_hash=None, register=True,
+                            source_file=None):
+    """Выбирает способ отправки документа: inline (data URL) или upload + signed URL.
+
+    register=False - временный файл (часть документа): без подсчета SHA-256 и без записи
+    в реестр загруженных файлов, повторно он отправлен не будет.
+    """
+    if should_submit_inline(file_path):
+        logger.info(f"[INLINE] Документ {os.path.basename(file_path)} отправляется в ocr.process напрямую")
+        return inline_ocr(client, file_path, include_images, source_file)
+    if not register:
+        return upload_and_ocr(client, file_path, include_images)
+    return upload_and_ocr(client, file_path, include_images, document_hash or compute_file_sha256(file_path),
+                          source_file=source_file)
+
+def get_pdf_page_count(pdf_path):
+    """Возвращает количество страниц PDF или 0, если PyMuPDF недоступен или файл не читается."""
+    if not PYMUPDF_AVAILABLE:
+        return 0
+    try:
+        with fitz.open(pdf_path) as doc:
+            return len(doc)
+    except Exception as e:
+        logger.warning(f"Не удалось определить количество страниц PDF {pdf_path}: {e}")
+        return 0
+
+def split_pdf_into_chunks(pdf_path, chunk_size):
+    """Разбивает PDF на части по chunk_size страниц. Возвращает список (первая_страница, путь)."""
+    chunks = []
+    chunk_prefix = f"chunk_{os.urandom(4).hex()}"
+    with fitz.open(pdf_path) as src:
+        for start in range(0, len(src), chunk_size):
+            end = min(start + chunk_size, len(src)) - 1
+            chunk_path = os.path.join(job_dir(), f"{chunk_prefix}_{start}_{end}.pdf")
+            with fitz.open() as chunk_doc:
+                chunk_doc.insert_pdf(src, from_page=start, to_page=end)
+                chunk_doc.save(chunk_path)
+            chunks.append((start, chunk_path))
+    return chunks
+
+MARKDOWN_IMAGE_REF_RE = re.compile(r'!\[([^\]]*)\]\(([^)]+)\)')
+
+def renumber_chunk_page(page, start_page, image_counter):
+    """Переносит страницу части документа в нумерацию всего документа.
+
+    Индекс страницы сдвигается на начало части, id изображений перенумеровываются (img-N.ext)
+    сквозным счетчиком, ссылки в markdown переписываются на новые id.
+    Возвращает (новая страница, следующее значение счетчика изображений).
+    """
+    id_map = {}
+    new_images = []
+    for img in page.images or []:
+        old_id = getattr(img, 'id', None) or f"img-{image_counter}"
+        new_id = f"img-{image_counter}{os.path.splitext(old_id)[1]}"
+        image_counter += 1
+        id_map[old_id] = new_id
+        new_images.append(img.model_copy(update={'id': new_id}))
+
+    markdown = page.markdown or ''
+    if id_map:
+        markdown = MARKDOWN_IMAGE_REF_RE.sub(
+            lambda m: f"![{id_map.get(m.group(1), m.group(1))}]({id_map.get(m.group(2), m.group(2))})",
+            markdown
+        )
+    return page.model_copy(update={
+        'index': start_page + page.index,
+        'markdown': markdown,
+        'images': new_images
+    }), image_counter
+
+def merge_chunk_pages(chunk_responses):
+    """Объединяет страницы OCR-ответов частей документа в исходном порядке.
+
+    chunk_responses - список (первая_страница, ocr_response); см. renumber_chunk_page.
+    """
+    merged_pages = []
+    image_counter = 0
+    for start_page, ocr_response in chunk_responses:
+        for page in ocr_response.pages:
+            page, image_counter = renumber_chunk_page(page, start_page, image_counter)
+            merged_pages.append(page)
+    return merged_pages
+
+def iter_ocr_pdf_chunks(client, file_path, include_images, chunk_size, concurrency):
+    """OCR PDF по частям: части обрабатываются параллельно (не более concurrency одновременно).
+
+    Генератор (ocr_response части в нумерации всего документа, document_url части) по порядку
+    частей: очередная часть отдается, как только готова она и все предыдущие, пока следующие
+    еще обрабатываются.
+    """
+    with span('chunk_split'):
+        chunks = split_pdf_into_chunks(file_path, chunk_size)
+    logger.info(f"[CHUNKS] Документ разбит на {len(chunks)} частей по {chunk_size} страниц, параллельность {concurrency}")
+    executor = ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(chunks))))
+    submit_chunk = propagate_timings(
+        lambda chunk_path: submit_document_for_ocr(client, chunk_path, include_images, register=False)
+    )
+    futures = [executor.submit(submit_chunk, chunk_path) for _, chunk_path in chunks]
+    try:
+        image_counter = 0
+        for (start_page, _), future in zip(chunks, futures):
+            ocr_response, document_url = future.result()
+            pages = []
+            for page in ocr_response.pages:
+                page, image_counter = renumber_chunk_page(page, start_page, image_counter)
+                pages.append(page)
+            yield ocr_response.model_copy(update={'pages': pages}), document_url
+    finally:
+        # Обработка прервана - части, которые еще не отправлены, не нужны
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+        for _, chunk_path in chunks:
+            safe_remove_file(chunk_path)
+
+def should_process_in_chunks(file_path):
+    """Режим частей включается настройкой parallel_processing для PDF длиннее одной части."""
+    if not (file_path.lower().endswith('.pdf') and PYMUPDF_AVAILABLE):
+        return False
+    if not get_app_setting('parallel_processing', False):
+        return False
+    chunk_size = int(get_app_setting('chunk_size_pages', 20))
+    return chunk_size > 0 and get_pdf_page_count(file_path) > chunk_size
+
+def iter_ocr_parts(client, file_path, include_images, document_hash=None, source_file=None):
+    """Ответы OCR документа по порядку: весь документ одним ответом или по частям PDF."""
+    if should_process_in_chunks(file_path):
+        yield from iter_ocr_pdf_chunks(
+            client, file_path, include_images,
+            chunk_size=int(get_app_setting('chunk_size_pages', 20)),
+            concurrency=int(get_app_setting('chunk_concurrency', 4))
+        )
+    else:
+        yield submit_document_for_ocr(client, file_path, include_images, document_hash, source_file=source_file)
 
-    processed_pages = []
-    for page in ocr_response.pages:
-        page_data = {"index": page.index, "markdown": page.markdown, "images": []}
-        
-        # FIXED: Извлекаем изображения из API ответа (независимо от настройки include_images)
-        # Если API нашел изображения, они должны обрабатываться для fallback
+def log_ocr_response(ocr_response):
+    """Валидация ответа API и подробный лог изображений страниц."""
+    # ENHANCED: Валидация ответа согласно лучшим практикам
+    validation_result = validate_ocr_response(ocr_response)
+    logger.info(f"Получен ответ от Mistral OCR API. Страниц: {len(ocr_response.pages)}")
+    logger.info(f"Результаты валидации: {validation_result['valid_images']}/{validation_result['total_images']} изображений валидны ({validation_result['success_rate']:.1f}%)")
+
+    for i, page in enumerate(ocr_response.pages):
+        logger.info(f"Страница {i}: изображений в API ответе: {len(page.images) if page.images else 0}")
         if page.images:
-            logger.info(f"Обрабатываем {len(page.images)} изображений из API base64")
-            for img in page.images:
-                try:
-                    # FIXED: Правильная обработка base64 изображений с защитой от None
-                    base64_data = getattr(img, 'image_base64', None)
-                    img_id = getattr(img, 'id', f'img_{len(page_data["images"])}')
-                    
-                    if not base64_data:
-                        logger.warning(f"Изображение {img_id} не содержит base64 данных - добавляем для fallback обработки")
-                        # Добавляем изображение БЕЗ base64 данных для fallback обработки
-                        coordinates = {
-                            'top_left_x': getattr(img, 'top_left_x', 0),
-                            'top_left_y': getattr(img, 'top_left_y', 0),
-                            'bottom_right_x': getattr(img, 'bottom_right_x', 600),
-                            'bottom_right_y': getattr(img, 'bottom_right_y', 400)
-                        }
-                        
-                        page_data["images"].append({
-                            "id": img_id,
-                            "path": None,  # Пока нет пути - будет добавлен fallback логикой
-                            "image_base64": None,  # Пустые данные
-                            "coordinates": coordinates,
-                            "width": coordinates['bottom_right_x'] - coordinates['top_left_x'],
-                            "height": coordinates['bottom_right_y'] - coordinates['top_left_y'],
-                            "alt_text": f"Изображение {img_id}"
-                        })
-                        continue
-                    
-                    # ENHANCED: Используем улучшенную обработку base64 согласно лучшим практикам
-                    processed_img = enhanced_base64_processing(base64_data, img_id)
-                    if not processed_img:
-                        logger.warning(f"Не удалось обработать base64 данные для {img_id}, создаем placeholder")
-                        # Fallback к созданию placeholder
-                        coordinates = {
-                            'top_left_x': getattr(img, 'top_left_x', 0),
-                            'top_left_y': getattr(img, 'top_left_y', 0),
-                            'bottom_right_x': getattr(img, 'bottom_right_x', 600),
-                            'bottom_right_y': getattr(img, 'bottom_right_y', 400)
-                        }
-                        width = coordinates['bottom_right_x'] - coordinates['top_left_x']
-                        height = coordinates['bottom_right_y'] - coordinates['top_left_y']
-                        placeholder_filename = f"placeholder_{page.index}_{img_id}.svg"
-                        img_path = create_svg_placeholder(placeholder_filename, img_id, width if width > 0 else 600, height if height > 0 else 400)
-                    else:
-                        img_filename = f"page_{page.index}_img_{img_id}.{processed_img['format']}"
-                        img_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(img_filename))
-                        with open(img_path, "wb") as img_file:
-                            img_file.write(processed_img['data'])
-                        logger.info(f"Сохранено изображение: {img_filename} ({processed_img['size']} байт)")
-                    
-                    page_data["images"].append({
-                        "id": img_id, 
-                        "path": img_path,
-                        "image_base64": getattr(img, 'image_base64', None)
-                    })
-                    logger.info(f"Сохранено base64 изображение: {img_filename}")
-                except Exception as e:
-                    img_id = getattr(img, 'id', 'unknown')
-                    logger.error(f"Ошибка сохранения base64 изображения {img_id}: {e}")
-                    # Добавляем изображение в список даже если не удалось сохранить файл
+            for j, img in enumerate(page.images):
+                # Детальное логирование структуры изображения
+                img_attrs = []
+                for attr in ['id', 'image_base64', 'top_left_x', 'top_left_y', 'bottom_right_x', 'bottom_right_y']:
+                    if hasattr(img, attr):
+                        value = getattr(img, attr)
+                        if attr == 'image_base64':
+                            value_str = f"length={len(value) if value else 0}"
+                        else:
+                            value_str = str(value)
+                        img_attrs.append(f"{attr}={value_str}")
+                logger.info(f"  Изображение {j}: {', '.join(img_attrs)}")
+
+def api_page_dimensions(page):
+    """Размеры рендера страницы в API - нужны для перевода координат изображений в пространство PDF."""
+    dimensions = getattr(page, 'dimensions', None)
+    if dimensions is None:
+        return None
+    return {"dpi": dimensions.dpi, "width": dimensions.width, "height": dimensions.height}
+
+def api_image_coordinates(img):
+    """Координаты изображения API (значения по умолчанию - если API их не вернул)."""
+    return {
+        'top_left_x': getattr(img, 'top_left_x', 0),
+        'top_left_y': getattr(img, 'top_left_y', 0),
+        'bottom_right_x': getattr(img, 'bottom_right_x', 600),
+        'bottom_right_y': getattr(img, 'bottom_right_y', 400)
+    }
+
+def api_fallback_targets(page):
+    """Изображения страницы API без base64 - цели fallback извлечения из PDF (None, если таких нет)."""
+    images = [
+        {'id': getattr(img, 'id', f'img_{j}'), 'coordinates': api_image_coordinates(img)}
+        for j, img in enumerate(page.images or []) if not getattr(img, 'image_base64', None)
+    ]
+    if not images:
+        return None
+    return {'dimensions': api_page_dimensions(page), 'images': images}
+
+def process_api_page(page, keep_image_payloads):
+    """Страница ответа API: изображения base64 декодируются и записываются на диск.
+
+    Изображения без данных (или с ошибкой записи) остаются без пути - для fallback.
+    """
+    page_data = {"index": page.index, "markdown": page.markdown, "images": []}
+    dimensions = api_page_dimensions(page)
+    if dimensions is not None:
+        page_data["dimensions"] = dimensions
+
+    pending_writes = []
+    # FIXED: Извлекаем изображения из API ответа (независимо от настройки include_images)
+    # Если API нашел изображения, они должны обрабатываться для fallback
+    if page.images:
+        logger.info(f"Обрабатываем {len(page.images)} изображений из API base64")
+        for img in page.images:
+            try:
+                # FIXED: Правильная обработка base64 изображений с защитой от None
+                base64_data = getattr(img, 'image_base64', None)
+                img_id = getattr(img, 'id', f'img_{len(page_data["images"])}')
+                coordinates = api_image_coordinates(img)
+
+                if not base64_data:
+                    logger.warning(f"Изображение {img_id} не содержит base64 данных - добавляем для fallback обработки")
+                    # Добавляем изображение БЕЗ base64 данных для fallback обработки
                     page_data["images"].append({
                         "id": img_id,
-                        "path": None,
-                        "image_base64": getattr(img, 'image_base64', None)
+                        "path": None,  # Пока нет пути - будет добавлен fallback логикой
+                        "image_base64": None,  # Пустые данные
+                        "coordinates": coordinates,
+                        "width": coordinates['bottom_right_x'] - coordinates['top_left_x'],
+                        "height": coordinates['bottom_right_y'] - coordinates['top_left_y'],
+                        "alt_text": f"Изображение {img_id}"
                     })
-        
-        processed_pages.append(page_data)
+                    continue
+
+                # ENHANCED: Декодируем base64 один раз; запись на диск - в пуле потоков
+                with span('image_decode'):
+                    processed_img = enhanced_base64_processing(base64_data, img_id)
+                image_entry = {
+                    "id": img_id,
+                    "path": None,
+                    # Исходная строка API (без копирования) нужна только для embedded вывода
+                    "image_base64": base64_data if keep_image_payloads else None,
+                    "coordinates": coordinates
+                }
+                if not processed_img:
+                    logger.warning(f"Не удалось обработать base64 данные для {img_id}, создаем placeholder")
+                    # Fallback к созданию placeholder
+                    width = coordinates['bottom_right_x'] - coordinates['top_left_x']
+                    height = coordinates['bottom_right_y'] - coordinates['top_left_y']
+                    placeholder_filename = f"placeholder_{page.index}_{img_id}.svg"
+                    image_entry["path"] = create_svg_placeholder(placeholder_filename, img_id, width if width > 0 else 600, height if height > 0 else 400)
+                    image_entry["image_base64"] = None
+                else:
+                    img_filename = f"page_{page.index}_img_{img_id}.{processed_img['format']}"
+                    image_entry["path"] = os.path.join(job_dir(), secure_filename(img_filename))
+                    image_entry["mime_type"] = IMAGE_MIME_TYPES.get(processed_img['format'], 'image/png')
+                    pending_writes.append((
+                        image_write_executor.submit(write_image_file, image_entry["path"], processed_img['data']),
+                        image_entry
+                    ))
+                    processed_img = None  # Байты освобождаются сразу после записи
+                page_data["images"].append(image_entry)
+            except Exception as e:
+                img_id = getattr(img, 'id', 'unknown')
+                logger.error(f"Ошибка сохранения base64 изображения {img_id}: {e}")
+                # Добавляем изображение в список даже если не удалось сохранить файл
+                page_data["images"].append({
+                    "id": img_id,
+                    "path": None,
+                    "image_base64": getattr(img, 'image_base64', None) if keep_image_payloads else None
+                })
+
+    # Дожидаемся записи изображений страницы (параллельно); при ошибке изображение уходит в fallback
+    for future, image_entry in pending_writes:
+        try:
+            with span('image_write'):
+                future.result()
+            logger.info(f"Сохранено изображение: {os.path.basename(image_entry['path'])}")
+        except Exception as e:
+            logger.error(f"Ошибка записи изображения {image_entry['id']}: {e}")
+            image_entry["path"] = None
+            image_entry["image_base64"] = None
+    return page_data
+
+def link_fallback_assets(page_data, page_num, page_assets, include_images):
+    """Связывает изображения API без файла с изображениями, извлеченными из PDF."""
+    # Добавляем извлеченные изображения для этой страницы
+    page_extracted = page_assets['images']
+    if page_extracted:
+        page_data.setdefault('fallback_images', []).extend(page_extracted)
+        logger.info(f"Добавлено {len(page_extracted)} fallback изображений для страницы {page_num}")
+
+    # ENHANCED: Связываем пустые API изображения с fallback изображениями (по координатам)
+    for api_img in page_data['images']:
+        if api_img.get('path'):
+            continue
+        fallback_img = page_assets['matches'].get(api_img['id'])
+        if fallback_img:
+            api_img['path'] = fallback_img['image_path']
+            logger.info(f"Связали API изображение '{api_img['id']}' с fallback файлом: {fallback_img['image_path']}")
+        else:
+            logger.warning(f"Не найдено изображение PDF для API изображения '{api_img['id']}' на странице {page_num}")
+
+    # ENHANCED: Обновляем markdown ссылки после связывания с fallback изображениями
+    if page_assets['matches']:
+        update_markdown_image_links(page_data, page_num, include_images)
+
+def mistral_ocr_processing(file_path, include_images=True, document_hash=None, keep_image_payloads=False,
+                           source_file=None):
+    """Обрабатывает документ с помощью Mistral OCR API.
+
+    Страницы обрабатываются по одной (изображения, fallback, ссылки в markdown), и каждая
+    публикуется в потоковый ответ сразу после своей обработки. Fallback извлечение для всех
+    страниц ответа (части) запускается заранее в пуле процессов и идет параллельно.
+    keep_image_payloads - сохранить строки base64 из ответа в результате (нужно для embedded вывода).
+    source_file - файл, открытый при приеме загрузки (отправляется в Mistral без повторного открытия).
+    """
+    if not app.config['MISTRAL_API_KEY']:
+        raise ValueError("API-ключ Mistral не установлен.")
 
+    client = get_mistral_client()
     # ENHANCED: Fallback извлечение изображений из PDF если API нашел изображения но не вернул base64
-    # Проверяем есть ли изображения с пустыми base64 данными
-    images_with_empty_base64 = 0
+    can_fallback = file_path.lower().endswith('.pdf') and PYMUPDF_AVAILABLE
+
+    processed_pages = []
+    document_url = None
     total_images_found = 0
-    logger.info(f"[FALLBACK DEBUG] Начинаем проверку processed_pages, всего страниц: {len(processed_pages)}")
-    
-    for page_idx, page_data in enumerate(processed_pages):
-        if page_data.get('images'):
-            page_images = len(page_data['images'])
-            total_images_found += page_images
-            logger.info(f"[FALLBACK DEBUG] Страница {page_idx}: найдено {page_images} изображений")
-            
-            for img_idx, img_info in enumerate(page_data['images']):
-                base64_data = img_info.get('image_base64')
-                img_id = img_info.get('id', 'unknown')
-                
-                logger.info(f"[FALLBACK DEBUG] Страница {page_idx}, изображение {img_idx}: id={img_id}, image_base64={'пустое' if not base64_data else 'есть'}")
-                
-                if not base64_data:  # ИСПРАВЛЕНО: проверяем правильное поле
-                    images_with_empty_base64 += 1
-    
-    logger.info(f"[FALLBACK DEBUG] Итого найдено изображений: {total_images_found}, с пустыми base64: {images_with_empty_base64}")
-    
-    needs_fallback = (file_path.lower().endswith('.pdf') and 
-                     images_with_empty_base64 > 0 and 
-                     PYMUPDF_AVAILABLE)
-    
-    if needs_fallback:
-        logger.info(f"Проверка fallback: найдено {images_with_empty_base64} изображений с пустыми base64")
-        logger.info(f"Fallback условия: PyMuPDF={PYMUPDF_AVAILABLE}, Pillow={PILLOW_AVAILABLE}")
-        logger.info("Выполняем fallback извлечение изображений из PDF")
-            
-    if needs_fallback:
-        
-        # Извлекаем страницы PDF как изображения для сравнения
-        pdf_page_images = extract_pdf_pages_as_images(file_path)
-        
-        # Извлекаем встроенные изображения напрямую из PDF
-        pdf_extracted_images = extract_images_from_pdf(file_path)
-        
-        # Добавляем информацию о страницах PDF к результату
-        for i, page_data in enumerate(processed_pages):
-            # Добавляем изображение страницы PDF
-            if i < len(pdf_page_images):
-                page_img = pdf_page_images[i]
-                page_data['pdf_page_image'] = {
-                    'path': page_img['image_path'],
-                    'width': page_img['width'],
-                    'height': page_img['height']
-                }
-            
-            # Добавляем извлеченные изображения для этой страницы
-            page_extracted = [img for img in pdf_extracted_images if img['page_num'] == i]
-            if page_extracted:
-                if 'fallback_images' not in page_data:
-                    page_data['fallback_images'] = []
-                page_data['fallback_images'].extend(page_extracted)
-                logger.info(f"Добавлено {len(page_extracted)} fallback изображений для страницы {i}")
-                
-                # ENHANCED: Связываем пустые API изображения с fallback изображениями
-                api_images_with_empty_base64 = [img for img in page_data['images'] if not img.get('image_base64')]
-                if api_images_with_empty_base64:
-                    logger.info(f"Найдено {len(api_images_with_empty_base64)} API изображений с пустыми base64 на странице {i}")
-                    
-                    # Сопоставляем API изображения с fallback изображениями (по порядку)
-                    for j, api_img in enumerate(api_images_with_empty_base64):
-                        if j < len(page_extracted):
-                            fallback_img = page_extracted[j]
-                            # Обновляем путь API изображения на fallback изображение
-                            api_img['path'] = fallback_img['image_path']
-                            logger.info(f"Связали API изображение '{api_img['id']}' с fallback файлом: {fallback_img['image_path']}")
-                        else:
-                            logger.warning(f"Недостаточно fallback изображений для API изображения '{api_img['id']}' на странице {i}")
-                    
-                    # ENHANCED: Обновляем markdown ссылки после связывания с fallback изображениями
-                    update_markdown_image_links(page_data, i, include_images)
-    
-    # ФИНАЛЬНОЕ ОБНОВЛЕНИЕ: Обновляем markdown ссылки для всех страниц (включая те, где не было fallback)
-    for i, page_data in enumerate(processed_pages):
-        # ИСПРАВЛЕНИЕ: Обновляем markdown если есть изображения, независимо от include_images
-        has_images_with_paths = any(img.get("path") for img in page_data.get("images", []))
-        should_update_markdown = include_images or has_images_with_paths
-        logger.info(f"[FINAL MARKDOWN] Страница {i}: include_images={include_images}, has_images_with_paths={has_images_with_paths}, should_update={should_update_markdown}")
-        update_markdown_image_links(page_data, i, should_update_markdown)
+    images_with_empty_base64 = 0
+    fallback_page_numbers = []
+    with closing(iter_ocr_parts(client, file_path, include_images, document_hash, source_file)) as ocr_parts:
+        for part_index, (ocr_response, part_url) in enumerate(ocr_parts):
+            if part_index == 0:
+                document_url = part_url
+            log_ocr_response(ocr_response)
+            first_page = len(processed_pages)
+            api_pages = list(ocr_response.pages)
+            # Ответ API больше не нужен: страницы освобождаются по мере обработки
+            ocr_response = None
+
+            # Рендер страниц и встроенные изображения - только для затронутых страниц
+            # Для каждой затронутой страницы передаем координаты изображений API без base64:
+            # по ним выбираются и декодируются только соответствующие xref
+            page_targets = {}
+            if can_fallback:
+                for offset, page in enumerate(api_pages):
+                    targets = api_fallback_targets(page)
+                    if targets:
+                        page_targets[first_page + offset] = targets
+            prefetched = PageAssetsReader(iter_fallback_assets(
+                file_path, page_targets, job_dir(), max_workers=app.config['PDF_FALLBACK_WORKERS']
+            )) if page_targets else None
+
+            try:
+                for offset in range(len(api_pages)):
+                    i = first_page + offset
+                    page_data = process_api_page(api_pages[offset], keep_image_payloads)
+                    api_pages[offset] = None  # base64 строки страницы больше не нужны
+                    processed_pages.append(page_data)
+
+                    missing = [img for img in page_data['images'] if not img.get('path')]
+                    total_images_found += len(page_data['images'])
+                    images_with_empty_base64 += len(missing)
+                    if missing and can_fallback:
+                        fallback_page_numbers.append(i)
+                        with span('pdf_fallback'):
+                            target_ids = {img['id'] for img in page_targets.get(i, {}).get('images', [])}
+                            if all(img['id'] in target_ids for img in missing):
+                                page_assets = prefetched.get(i)
+                            else:
+                                # Изображение без файла из-за ошибки записи - извлекаем страницу здесь
+                                page_assets = extract_page_assets(file_path, {i: {
+                                    'dimensions': page_data.get('dimensions'),
+                                    'images': [{'id': img['id'], 'coordinates': img.get('coordinates')} for img in missing]
+                                }}, job_dir()).get(i)
+                        if page_assets:
+                            link_fallback_assets(page_data, i, page_assets, include_images)
+
+                    # ИСПРАВЛЕНИЕ: Обновляем markdown если есть изображения, независимо от include_images
+                    has_images_with_paths = any(img.get("path") for img in page_data.get("images", []))
+                    should_update_markdown = include_images or has_images_with_paths
+                    logger.info(f"[FINAL MARKDOWN] Страница {i}: include_images={include_images}, has_images_with_paths={has_images_with_paths}, should_update={should_update_markdown}")
+                    with span('markdown_rewrite'):
+                        update_markdown_image_links(page_data, i, should_update_markdown)
+                    # Страница готова - потоковый ответ может отдать ее, не дожидаясь остальных
+                    publish_pages(processed_pages)
+            finally:
+                if prefetched is not None:
+                    prefetched.close()
+
+    logger.info(f"[FALLBACK] Итого найдено изображений: {total_images_found}, с пустыми base64: {images_with_empty_base64} на страницах {fallback_page_numbers}")
+    metrics_registry.inc('ocr_fallback_total', labels={'activated': 'true' if fallback_page_numbers else 'false'})
+
+    return {"document_url": document_url, "pages": processed_pages}
+
+
+def get_ocr_model_name():
+    """Имя модели/движка OCR, которое входит в ключ кэша результатов."""
+    if app.config['USE_MOCK_OCR']:
+        return 'mock'
+    if app.config['USE_STUB_OCR']:
+        return 'stub'
+    return app.config['MISTRAL_OCR_MODEL']
+
+def iter_result_artifact_refs(ocr_result):
+    """Перечисляет ссылки на файлы результата как пары (контейнер, ключ)."""
+    for key in ('markdown_file', 'json_file'):
+        if ocr_result.get(key):
+            yield ocr_result, key
+    for page in ocr_result.get('pages', []):
+        for img in page.get('images', []):
+            if img.get('path'):
+                yield img, 'path'
+        if page.get('pdf_page_image', {}).get('path'):
+            yield page['pdf_page_image'], 'path'
+        for fb_img in page.get('fallback_images', []):
+            if fb_img.get('image_path'):
+                yield fb_img, 'image_path'
+
+def store_result_in_cache(cache, cache_key, ocr_result):
+    """Сохраняет результат и его файлы в кэш (пути сохраняются как имена файлов)."""
+    artifact_paths = []
+    cached_result = json.loads(json.dumps(ocr_result))
+    for container, key in iter_result_artifact_refs(cached_result):
+        path = container[key]
+        if not os.path.isabs(path):
+            path = workspace_manager.resolve(path) or path
+        artifact_paths.append(path)
+        container[key] = os.path.basename(path)
+    try:
+        if cache.put(cache_key, cached_result, artifact_paths):
+            logger.info(f"[CACHE] Результат сохранен в кэш: {cache_key[:12]}")
+    except Exception as e:
+        logger.warning(f"[CACHE] Не удалось сохранить результат в кэш: {e}")
+
+def load_result_from_cache(cache, cache_key, export_format="embedded"):
+    """Восстанавливает результат из кэша, копируя артефакты в каталог текущей задачи.
 
-    return {"document_url": signed_url.url, "pages": processed_pages}
+    Ссылки /image/... в markdown страниц указывают на каталог исходной задачи, который
+    может быть уже удален, - они переписываются на восстановленные копии, и файл
+    Markdown формируется заново из переписанных страниц.
+    """
+    entry = cache.get(cache_key)
+    if entry is None:
+        return None
+    ocr_result = entry['result']
+    artifacts = entry['artifacts']
+    restored_paths = {}
+    markdown_path = None
+    for container, key in iter_result_artifact_refs(ocr_result):
+        filename = container[key]
+        target_path = os.path.join(job_dir(), filename)
+        if filename in artifacts and not os.path.exists(target_path):
+            with atomic_path(target_path) as tmp_path:
+                shutil.copyfile(artifacts[filename], tmp_path)
+        # markdown_file/json_file в результате - это ссылки для /download, остальное - полные пути
+        if key in ('markdown_file', 'json_file'):
+            container[key] = artifact_ref(target_path)
+            if key == 'markdown_file':
+                markdown_path = target_path
+        else:
+            container[key] = target_path
+            restored_paths[filename] = target_path
 
+    resolve = restored_image_resolver(restored_paths)
+    for page in ocr_result.get('pages', []):
+        if page.get('markdown'):
+            page['markdown'], _ = rewrite_image_links(page['markdown'], resolve)
+    # Во встроенном формате изображения записаны в файл как base64 - ссылок на каталог нет
+    if markdown_path and export_format != "embedded":
+        write_markdown_file(markdown_path, iter_markdown_document(ocr_result.get('pages', []), page_markdown_with_header))
+    logger.info(f"[CACHE] Результат взят из кэша: {cache_key[:12]}")
+    return ocr_result
+
+def attach_page_render_urls(ocr_result, document_hash):
+    """Добавляет к страницам PDF ссылки на ленивый рендер вместо заранее созданных PNG."""
+    for i, page_data in enumerate(ocr_result.get('pages', [])):
+        page_data['pdf_page_image'] = {
+            'url': f"/pdf_page/{document_hash}/{i}",
+            'page_num': i
+        }
 
-def process_ocr_document(file_path, include_images=True, export_format="embedded"):
+def process_ocr_document(file_path, include_images=True, export_format="embedded", document_hash=None,
+                         source_file=None):
     """Выбирает метод обработки OCR (моковый или реальный) и сохраняет результаты."""
     try:
+        is_renderable_pdf = file_path.lower().endswith('.pdf') and PYMUPDF_AVAILABLE
+        cache = get_result_cache()
+        if document_hash is None and (is_renderable_pdf or cache is not None):
+            with span('hash'):
+                document_hash = compute_file_sha256(file_path)
+
+        if is_renderable_pdf:
+            # Исходный PDF сохраняется для рендера страниц по запросу режима сравнения
+            try:
+                page_render_cache.register_document(document_hash, file_path)
+            except Exception as e:
+                logger.warning(f"Не удалось сохранить PDF для рендера страниц: {e}")
+
+        cache_key = None
+        if cache is not None:
+            cache_key = ResultCache.make_key(document_hash, include_images, export_format, get_ocr_model_name())
+            with span('cache_lookup'):
+                cached_result = load_result_from_cache(cache, cache_key, export_format)
+            metrics_registry.inc('ocr_cache_requests_total', labels={'result': 'miss' if cached_result is None else 'hit'})
+            if cached_result is not None:
+                cached_result['from_cache'] = True
+                publish_pages(cached_result.get('pages', []))
+                return cached_result
+
         if app.config['USE_MOCK_OCR']:
-            ocr_result = mock_ocr_processing(file_path, include_images)
+            with span('ocr_mock'):
+                ocr_result = mock_ocr_processing(file_path, include_images)
         else:
-            ocr_result = mistral_ocr_processing(file_path, include_images)
+            ocr_result = mistral_ocr_processing(
+                file_path, include_images, document_hash,
+                keep_image_payloads=(export_format == "embedded"), source_file=source_file
+            )
+
+        if is_renderable_pdf:
+            attach_page_render_urls(ocr_result, document_hash)
+        # Страницы, не опубликованные при обработке (моковый режим), - до сохранения файлов
+        publish_pages(ocr_result.get('pages', []))
 
         # Сохранение результатов в файлы происходит после получения данных от OCR
-        markdown_filename, json_filename = save_results_to_files(
-            ocr_result, app.config['UPLOAD_FOLDER'], include_images, export_format
-        )
+        with span('save_results'):
+            markdown_filename, json_filename = save_results_to_files(
+                ocr_result, job_dir(), include_images, export_format
+            )
         ocr_result["markdown_file"] = markdown_filename
         ocr_result["json_file"] = json_filename
 
@@ -726,6 +1238,10 @@ def process_ocr_document(file_path, include_images=True, export_format="embedded
             }
             logger.info(f"Обработка завершена: {total_images} изображений, fallback использован на {fallback_pages} страницах")
 
+        if cache is not None:
+            with span('cache_store'):
+                store_result_in_cache(cache, cache_key, ocr_result)
+        ocr_result['from_cache'] = False
         return ocr_result
 
     except ValueError as e: # Ошибки, связанные с API ключом или взаимодействием с API
@@ -735,44 +1251,81 @@ def process_ocr_document(file_path, include_images=True, export_format="embedded
         raise ValueError(f"Внутренняя ошибка сервера при OCR обработке: {e}")
 
 
-def create_embedded_markdown(result_data):
-    """Создает markdown с встроенными base64 изображениями"""
-    markdown_content_pages = []
-    for page in result_data.get('pages', []):
-        page_markdown = f"# Страница {page.get('index', 0) + 1}\n\n{page.get('markdown', '')}"
-        
-        # Встраиваем изображения как base64
+MARKDOWN_PAGE_SEPARATOR = "\n\n---\n\n"
+
+def page_markdown_with_header(page):
+    """Markdown страницы с заголовком (ссылки на изображения не меняются)."""
+    return f"# Страница {page.get('index', 0) + 1}\n\n{page.get('markdown', '')}"
+
+def image_data_url(img_info):
+    """data URL изображения: строка из ответа API, иначе файл с диска. None - если данных нет."""
+    if img_info.get('image_base64'):
+        # Строка из ответа API уже закодирована - используем ее без чтения с диска
+        return image_payload_to_data_url(img_info['image_base64'], img_info.get('mime_type', 'image/png'))
+    img_path = img_info.get('path')
+    if img_path and os.path.exists(img_path):
+        # Fallback изображения и placeholder есть только на диске
+        with open(img_path, "rb") as image_file:
+            image_data_b64 = base64.b64encode(image_file.read()).decode('utf-8')
+        ext = os.path.splitext(img_path)[1].lower().lstrip('.')
+        return f"data:{IMAGE_MIME_TYPES.get(ext, 'image/png')};base64,{image_data_b64}"
+    return None
+
+def embedded_page_markdown(page):
+    """Markdown страницы с изображениями, встроенными как base64."""
+    page_markdown = page_markdown_with_header(page)
+    # Ссылки, которые update_markdown_image_links записал в markdown
+    images_by_url = {
+        image_url_for_path(img_info['path']): img_info
+        for img_info in page.get('images', []) if img_info.get('path')
+    }
+    if not images_by_url:
+        return page_markdown
+    data_urls = {}
+
+    def resolve(ref):
+        img_info = images_by_url.get(ref)
+        if img_info is None:
+            return None
+        if ref not in data_urls:
+            try:
+                data_urls[ref] = image_data_url(img_info)
+            except Exception as e:
+                logger.error(f"Ошибка встраивания изображения {img_info.get('path')}: {e}")
+                data_urls[ref] = None
+        return data_urls[ref]
+
+    page_markdown, embedded = rewrite_image_links(page_markdown, resolve)
+    logger.debug(f"Встроено {embedded} изображений страницы {page.get('index', 0) + 1} как base64")
+    return page_markdown
+
+def api_page_markdown(page, include_images):
+    """Markdown страницы для /api/markdown: изображения добавляются после текста как base64."""
+    page_md = page_markdown_with_header(page)
+    if include_images:
         for img_info in page.get('images', []):
-            img_path = img_info.get('path')
-            img_url = img_info.get('url', '')
-            
-            if img_path and os.path.exists(img_path):
-                try:
-                    with open(img_path, "rb") as image_file:
-                        image_data_b64 = base64.b64encode(image_file.read()).decode('utf-8')
-                    
-                    # Определяем формат изображения
-                    ext = os.path.splitext(img_path)[1].lower()
-                    if ext in ['.png']:
-                        mime_type = 'image/png'
-                    elif ext in ['.jpg', '.jpeg']:
-                        mime_type = 'image/jpeg'
-                    else:
-                        mime_type = 'image/png'  # По умолчанию
-                    
-                    data_url = f"data:{mime_type};base64,{image_data_b64}"
-                    
-                    # Заменяем URL на data URL в markdown
-                    if img_url in page_markdown:
-                        page_markdown = page_markdown.replace(img_url, data_url)
-                        logger.info(f"Встроено изображение {img_info.get('id')} как base64")
-                    
-                except Exception as e:
-                    logger.error(f"Ошибка встраивания изображения {img_path}: {e}")
-        
-        markdown_content_pages.append(page_markdown)
-    
-    return "\n\n---\n\n".join(markdown_content_pages)
+            try:
+                data_url = image_data_url(img_info)
+            except Exception as e:
+                logger.error(f"Ошибка встраивания изображения {img_info.get('path')}: {e}")
+                continue
+            if data_url:
+                page_md += f"\n\n![image]({data_url})\n\n"
+    return page_md
+
+def iter_markdown_document(pages, render_page):
+    """Генератор Markdown документа: страницы отдаются по одной, память не растет с их числом."""
+    for i, page in enumerate(pages):
+        if i:
+            yield MARKDOWN_PAGE_SEPARATOR
+        yield render_page(page)
+
+def write_markdown_file(filepath, markdown_chunks):
+    """Записывает Markdown на диск по частям (файл появляется целиком после записи)."""
+    with atomic_path(filepath) as tmp_path:
+        with open(tmp_path, "w", encoding="utf-8") as md_file:
+            for chunk in markdown_chunks:
+                md_file.write(chunk)
 
 def cleanup_temp_files(ocr_result):
     """Удаляет временные файлы после встраивания изображений в markdown"""
@@ -811,19 +1364,15 @@ def save_results_to_files(result_data, upload_folder, include_images=True, expor
     try:
         # Выбираем способ создания markdown в зависимости от формата экспорта
         if export_format == "embedded":
-            markdown_content = create_embedded_markdown(result_data)
-            logger.info("Создан embedded markdown с встроенными base64 изображениями")
+            render_page = embedded_page_markdown
         else:
             # Стандартный markdown с ссылками (для совместимости)
-            markdown_content_pages = []
-            for page in result_data.get('pages', []):
-                page_markdown = f"# Страница {page.get('index', 0) + 1}\n\n{page.get('markdown', '')}"
-                markdown_content_pages.append(page_markdown)
-            markdown_content = "\n\n---\n\n".join(markdown_content_pages)
+            render_page = page_markdown_with_header
         markdown_filename = f"document_ocr_{os.urandom(8).hex()}.md"
         markdown_filepath = os.path.join(upload_folder, secure_filename(markdown_filename))
-        with open(markdown_filepath, "w", encoding="utf-8") as md_file:
-            md_file.write(markdown_content)
+        write_markdown_file(markdown_filepath, iter_markdown_document(result_data.get('pages', []), render_page))
+        if export_format == "embedded":
+            logger.info("Создан embedded markdown с встроенными base64 изображениями")
 
         # JSON
         json_filename = f"document_ocr_{os.urandom(8).hex()}.json"
@@ -837,10 +1386,12 @@ def save_results_to_files(result_data, upload_folder, include_images=True, expor
                 page_copy['images'] = [{'id': img.get('id'), 'path': img.get('path')} for img in page['images']]
             json_to_save['pages'].append(page_copy)
 
-        with open(json_filepath, "w", encoding="utf-8") as json_file:
-            json.dump(json_to_save, json_file, indent=2, ensure_ascii=False)
+        with atomic_path(json_filepath) as tmp_path:
+            with open(tmp_path, "w", encoding="utf-8") as json_file:
+                json.dump(json_to_save, json_file, indent=2, ensure_ascii=False)
 
-        return markdown_filename, json_filename
+        # Ссылки вида <workspace_id>/<имя> для маршрута /download
+        return artifact_ref(markdown_filepath), artifact_ref(json_filepath)
     except Exception as e:
         logger.error(f"Ошибка сохранения результатов в файлы: {e}\n{traceback.format_exc()}")
         raise ValueError("Ошибка при сохранении результатов OCR.")
@@ -851,143 +1402,401 @@ def index():
     """Главная страница."""
     return render_template('index.html')
 
-@app.route('/upload', methods=['POST'])
-def upload_document_route():
-    """Обрабатывает загрузку документа (файл или URL)."""
-    filepath_to_process = None
+def build_url_source_path(url, prefix, default_name, workspace):
+    """Генерирует путь в каталоге задачи для содержимого, скачиваемого по URL."""
+    # Используем unquote для декодирования URL, чтобы получить имя файла, если оно есть
+    original_filename = os.path.basename(unquote(urlparse(url).path)) or default_name
+    temp_filename = secure_filename(f"{prefix}_{os.urandom(4).hex()}_{original_filename}")
+    return workspace.file_path(temp_filename)
+
+def cleanup_source_file(filepath_to_process):
+    """Удаляет исходный загруженный файл (PDF/изображение или временный файл по URL)."""
+    if filepath_to_process and os.path.exists(filepath_to_process):
+        try:
+            # Не удаляем файлы изображений, так как они нужны для отображения/скачивания
+            # Файлы изображений и результаты (md, json) имеют уникальные имена и управляются отдельно
+            # Проверяем, является ли файл результатом OCR (md, json, png), чтобы не удалить их случайно
+            if not (filepath_to_process.endswith(('.md', '.json')) or filepath_to_process.startswith(os.path.join(app.config['UPLOAD_FOLDER'], 'page_'))):
+                os.unlink(filepath_to_process)
+                logger.info(f"Удален временный файл: {filepath_to_process}")
+        except Exception as cleanup_err:
+            logger.warning(f"Ошибка очистки файла {filepath_to_process}: {cleanup_err}")
+
+def add_image_urls(result):
+    """Добавляет к изображениям URL для фронтенда (/image/<workspace_id>/<filename>)."""
+    total_images = 0
+    for page_idx, page in enumerate(result.get('pages', [])):
+        for img_idx, img_info in enumerate(page.get('images') or []):
+            total_images += 1
+            if img_info.get('path'):
+                img_info['url'] = image_url_for_path(img_info['path'])
+            else:
+                logger.warning(f"[UPLOAD_ROUTE] Изображение {img_idx} на странице {page_idx} не имеет 'path'. Данные: {json.dumps(img_info)}")
+        for fb_img in page.get('fallback_images') or []:
+            if fb_img.get('image_path'):
+                fb_img['url'] = image_url_for_path(fb_img['image_path'])
+    return total_images
+
+def run_ocr_job(workspace, filepath_to_process, include_images=True, export_format="embedded", url=None,
+                document_hash=None, page_stream=None, source_file=None):
+    """Тело фоновой задачи: скачивание по URL (если задан), OCR и очистка в каталоге задачи.
+
+    Все файлы задачи создаются в workspace; по завершении выполняется его хук очистки
+    (исходный файл удаляется, при ошибке - весь каталог). document_hash - SHA-256
+    загруженного файла, посчитанный при приеме (файл не перечитывается для хэширования),
+    source_file - открытый при приеме файл (закрывается хуком очистки каталога).
+    Замеры этапов (если TIMING_ENABLED) добавляются в processing_info['timings'] в мс.
+    page_stream - PageStream потокового ответа: готовые страницы публикуются в него
+    по мере обработки, по завершении задачи он закрывается.
+    """
+    succeeded = False
+    with use_workspace(workspace), workspace_heartbeat.hold(workspace), use_page_stream(page_stream), collect_timings(app.config['TIMING_ENABLED'] or app.config['METRICS_ENABLED']) as timings:
+        try:
+            with span('total'):
+                if url:
+                    with span('download'):
+                        fetched = download_file_from_url(url, filepath_to_process)
+                    # Хэш посчитан во время загрузки - файл не перечитывается
+                    document_hash = fetched.sha256
+                    with metrics_registry.batch() as batch:
+                        batch.inc('ocr_download_bytes_total', fetched.downloaded_bytes)
+                        batch.inc('ocr_url_fetch_total', labels={'result': 'not_modified' if fetched.not_modified else 'downloaded'})
+                if not os.path.exists(filepath_to_process):
+                    raise ValueError("Ошибка подготовки файла для обработки")
+
+                result = process_ocr_document(filepath_to_process, include_images=include_images,
+                                              export_format=export_format, document_hash=document_hash,
+                                              source_file=source_file)
+                total_images = add_image_urls(result)
+            logger.info(f"Обработка завершена. Всего изображений: {total_images}")
+            record_job_metrics(result, total_images, timings, source='url' if url else 'file')
+            if timings is not None and app.config['TIMING_ENABLED']:
+                result.setdefault('processing_info', {})['timings'] = timings.to_dict()
+            succeeded = True
+            return result
+        except Exception:
+            metrics_registry.inc('ocr_jobs_failed_total')
+            raise
+        finally:
+            workspace.cleanup(keep_results=succeeded)
+
+def record_job_metrics(result, total_images, timings, source):
+    """Записывает метрики завершенной задачи одной транзакцией."""
+    with metrics_registry.batch() as batch:
+        batch.inc('ocr_documents_processed_total', labels={
+            'source': source, 'from_cache': 'true' if result.get('from_cache') else 'false'
+        })
+        batch.inc('ocr_pages_processed_total', len(result.get('pages', [])))
+        batch.inc('ocr_images_processed_total', total_images)
+        if timings is not None:
+            for stage, duration_ms in timings.to_dict().items():
+                batch.observe('ocr_stage_duration_seconds', duration_ms / 1000, {'stage': stage})
+
+def add_server_timing(response, job):
+    """Добавляет к ответу заголовок Server-Timing: ожидание в очереди и этапы задачи."""
+    if not app.config['TIMING_ENABLED'] or not isinstance(job.result, dict):
+        return response
+    timings = {}
+    if job.started_at is not None:
+        timings['queue'] = round((job.started_at - job.created_at) * 1000, 1)
+    timings.update(job.result.get('processing_info', {}).get('timings', {}))
+    header = format_server_timing(timings)
+    if header:
+        response.headers['Server-Timing'] = header
+    return response
+
+def job_error_response(error, internal_message="Внутренняя ошибка сервера."):
+    """Преобразует ошибку задачи в JSON-ответ с подходящим HTTP-статусом."""
+    if isinstance(error, JobQueueFullError):
+        return jsonify({"status": "error", "message": str(error)}), 503
+    if isinstance(error, ValueError): # Ожидаемые ошибки (URL, файл, API)
+        logger.warning(f"Ошибка обработки запроса: {error}")
+        return jsonify({"status": "error", "message": str(error)}), 400 if "URL" in str(error) or "файл" in str(error) else 500
+    logger.error(f"Непредвиденная ошибка задачи: {error}\n{''.join(traceback.format_exception(error))}")
+    return jsonify({"status": "error", "message": internal_message}), 500
+
+def submit_job_from_request():
+    """Разбирает форму загрузки и ставит OCR задачу в очередь.
+
+    Возвращает (job, None) или (None, error_response).
+    """
     try:
         processing_type = request.form.get('processing_type', 'file')
-        
-        if processing_type == 'url':
-            url = request.form.get('document')
-            if not url:
-                return jsonify({"status": "error", "message": "URL не указан"}), 400
-            
-            # Генерируем временное имя файла для скачанного содержимого
-            # Используем unquote для декодирования URL, чтобы получить имя файла, если оно есть
-            original_filename = os.path.basename(unquote(urlparse(url).path)) or "downloaded_file.tmp"
-            temp_filename = secure_filename(f"url_upload_{os.urandom(4).hex()}_{original_filename}")
-            filepath_to_process = os.path.join(app.config['UPLOAD_FOLDER'], temp_filename)
-            download_file_from_url(url, filepath_to_process)
-
-        elif processing_type == 'file':
-            if 'document' not in request.files:
-                return jsonify({"status": "error", "message": "Файл не загружен"}), 400
-            file = request.files['document']
-            if file.filename == '':
-                return jsonify({"status": "error", "message": "Не выбран файл"}), 400
-            if not allowed_file(file.filename):
-                return jsonify({"status": "error", "message": "Недопустимый тип файла"}), 400
-
-            filename = secure_filename(file.filename)
-            filepath_to_process = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath_to_process)
-        else:
-            return jsonify({"status": "error", "message": "Неверный тип обработки"}), 400
-
-        if not filepath_to_process or not os.path.exists(filepath_to_process):
-             return jsonify({"status": "error", "message": "Ошибка подготовки файла для обработки"}), 500
-
-        # Обработка документа
-        # Параметр include_images извлекается из формы, по умолчанию True
-        include_images_str = request.form.get('include_images', 'true').lower()
-        include_images = include_images_str == 'true'
-        
-        # НОВОЕ: Добавляем параметр формата экспорта (по умолчанию embedded для решения проблемы пользователя)
-        export_format = request.form.get('export_format', 'embedded')
-        logger.info(f"Используется формат экспорта: {export_format}")
-
-        result = process_ocr_document(filepath_to_process, include_images=include_images, export_format=export_format)
+    except (DocumentTooLargeError, RequestEntityTooLarge):
+        # Content-Length больше лимита или прием прерван на первом блоке сверх лимита (chunked)
+        return None, (jsonify({"status": "error", "message": f"Файл слишком большой. Максимальный размер: {app.config['MAX_CONTENT_LENGTH'] // (1024*1024)}MB"}), 413)
+    url = None
+    workspace = None
+    document_hash = None
+    source_file = None
+
+    if processing_type == 'url':
+        url = request.form.get('document')
+        if not url:
+            return None, (jsonify({"status": "error", "message": "URL не указан"}), 400)
+        workspace = workspace_manager.create()
+        filepath_to_process = build_url_source_path(url, 'url_upload', "downloaded_file.tmp", workspace)
+
+    elif processing_type == 'file':
+        if 'document' not in request.files:
+            return None, (jsonify({"status": "error", "message": "Файл не загружен"}), 400)
+        file = request.files['document']
+        if file.filename == '':
+            return None, (jsonify({"status": "error", "message": "Не выбран файл"}), 400)
+        if not allowed_file(file.filename):
+            return None, (jsonify({"status": "error", "message": "Недопустимый тип файла"}), 400)
+        ingested = file.stream if isinstance(file.stream, IngestedFile) else None
+        if ingested is not None and not content_matches_extension(file.filename, ingested.detected_type):
+            return None, (jsonify({"status": "error", "message": "Содержимое файла не соответствует его расширению"}), 400)
+
+        workspace = workspace_manager.create()
+        # Исходное имя безопасно: каталог задачи не пересекается с другими загрузками
+        filepath_to_process = workspace.file_path(file.filename)
+        # Файл запроса нужно сохранить до ответа - поток запроса недоступен из фоновой задачи.
+        # Принятый файл уже на диске и захэширован: он переносится в каталог задачи без копирования,
+        # а открытый файл передается задаче для загрузки в Mistral
+        try:
+            if ingested is not None:
+                source_file = ingested.claim(filepath_to_process)
+                document_hash = ingested.sha256
+                workspace.add_cleanup(source_file.close)
+            else:
+                file.save(filepath_to_process)
+        except Exception:
+            workspace.remove()
+            raise
+    else:
+        return None, (jsonify({"status": "error", "message": "Неверный тип обработки"}), 400)
+
+    # Параметр include_images извлекается из формы, по умолчанию True
+    include_images = request.form.get('include_images', 'true').lower() == 'true'
+    # Формат экспорта (по умолчанию embedded)
+    export_format = request.form.get('export_format', 'embedded')
+    logger.info(f"Используется формат экспорта: {export_format}")
+
+    workspace.add_cleanup(cleanup_source_file, filepath_to_process)
+    try:
+        job = job_manager.submit(
+            run_ocr_job, workspace, filepath_to_process, include_images, export_format, url=url,
+            document_hash=document_hash, source_file=source_file,
+            metadata={'processing_type': processing_type, 'export_format': export_format,
+                      'workspace': workspace.id}
+        )
+    except JobQueueFullError as e:
+        workspace.cleanup(keep_results=False)
+        return None, job_error_response(e)
+    return job, None
+
+@app.route('/jobs', methods=['POST'])
+def create_job_route():
+    """Ставит документ (файл или URL) в очередь OCR и сразу возвращает id задачи."""
+    try:
+        job, error_response = submit_job_from_request()
+    except Exception as e:
+        return job_error_response(e)
+    if error_response:
+        return error_response
+    return jsonify({
+        "status": "success",
+        "job_id": job.id,
+        "job": job.to_dict(),
+        "status_url": f"/jobs/{job.id}"
+    }), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job_route(job_id):
+    """Возвращает статус задачи и результат, если обработка завершена."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Задача не найдена"}), 404
+
+    response = {"status": "success", "job": job.to_dict()}
+    if job.state == JOB_DONE:
+        response["data"] = job.result
+    return jsonify(response)
+
+# --- Возобновляемая загрузка частями ---
+def upload_session_response(session, status=200, **extra):
+    """Ответ с состоянием сессии загрузки; заголовок Upload-Offset - число принятых байтов."""
+    response = jsonify({"status": "success" if status < 400 else "error", "upload": session.to_dict(), **extra})
+    response.status_code = status
+    response.headers['Upload-Offset'] = str(session.offset)
+    return response
+
+def parse_bool(value, default=True):
+    """Булево значение из JSON (true/false) или формы ('true'/'false')."""
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() == 'true'
+
+@app.route('/uploads', methods=['POST'])
+def create_upload_route():
+    """Создает сессию загрузки: имя, размер и (желательно) SHA-256 файла, параметры обработки."""
+    params = request.get_json(silent=True) or {}
+    filename = params.get('filename') or ''
+    if not allowed_file(filename):
+        return jsonify({"status": "error", "message": "Недопустимый тип файла"}), 400
+    try:
+        size = int(params.get('size'))
+    except (TypeError, ValueError):
+        size = 0
+    if size <= 0:
+        return jsonify({"status": "error", "message": "Не указан размер файла"}), 400
+    try:
+        session = upload_sessions.create(filename, size, params.get('sha256'), options={
+            'include_images': parse_bool(params.get('include_images')),
+            'export_format': params.get('export_format') or 'embedded',
+        })
+    except DocumentTooLargeError:
+        return jsonify({"status": "error", "message": f"Файл слишком большой. Максимальный размер: {app.config['MAX_CONTENT_LENGTH'] // (1024*1024)}MB"}), 413
+    logger.info(f"[UPLOAD] Сессия {session.id}: {filename}, {size} байт")
+    return upload_session_response(
+        session, 201,
+        upload_url=f"/uploads/{session.id}",
+        chunk_size=int(app.config['UPLOAD_CHUNK_MB'] * 1024 * 1024)
+    )
 
-        # FIXED: Улучшенная обработка путей к изображениям для фронтенда
-        total_images = 0
-        for page_idx, page in enumerate(result.get('pages', [])):
-            if page.get('images'):
-                logger.info(f"[UPLOAD_ROUTE] Обработка изображений для страницы {page_idx}")
-                for img_idx, img_info in enumerate(page['images']):
-                    total_images += 1
-                    logger.info(f"[UPLOAD_ROUTE] Изображение {img_idx} на странице {page_idx}: исходные данные: {json.dumps(img_info)}")
-                    if img_info.get('path'):
-                        original_path = img_info['path']
-                        logger.info(f"[UPLOAD_ROUTE] Наличие пути к изображению: {original_path}")
-
-                        base_name = os.path.basename(original_path)
-                        logger.info(f"[UPLOAD_ROUTE] Имя файла из пути: {base_name}")
-
-                        secured_img_filename = secure_filename(base_name)
-                        logger.info(f"[UPLOAD_ROUTE] Имя файла после secure_filename: {secured_img_filename}")
-
-                        img_info['url'] = f"/image/{secured_img_filename}"
-                        logger.info(f"[UPLOAD_ROUTE] Сгенерированный URL для изображения: {img_info['url']}")
-                    else:
-                        logger.warning(f"[UPLOAD_ROUTE] Изображение {img_idx} на странице {page_idx} не имеет 'path'. Данные: {json.dumps(img_info)}")
-        
-        logger.info(f"Обработка завершена. Всего изображений: {total_images}. Финальные данные для ответа: {json.dumps(result, indent=2)}")
-        return jsonify({"status": "success", "data": result})
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def get_upload_route(upload_id):
+    """Состояние сессии: сколько байтов принято (с этого смещения клиент продолжает загрузку)."""
+    session = upload_sessions.get(upload_id)
+    if session is None:
+        return jsonify({"status": "error", "message": "Сессия загрузки не найдена"}), 404
+    return upload_session_response(session)
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def put_upload_chunk_route(upload_id):
+    """Принимает часть файла; смещение - заголовок Upload-Offset (или параметр offset)."""
+    session = upload_sessions.get(upload_id)
+    if session is None:
+        return jsonify({"status": "error", "message": "Сессия загрузки не найдена"}), 404
+    try:
+        offset = int(request.headers.get('Upload-Offset', request.args.get('offset', '')))
+    except ValueError:
+        return jsonify({"status": "error", "message": "Не указано смещение части"}), 400
+    try:
+        session.write_chunk(offset, request.stream)
+    except UploadOffsetError as e:
+        return upload_session_response(session, 409, message=str(e))
+    except ValueError as e:
+        return upload_session_response(session, 400, message=str(e))
+    except ClientDisconnected:
+        # Принятые до обрыва байты учтены в offset - клиент продолжит с него
+        logger.warning(f"[UPLOAD] Обрыв соединения в сессии {upload_id} на смещении {session.offset}")
+        return upload_session_response(session, 400, message="Часть получена не полностью")
+    return upload_session_response(session)
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+def delete_upload_route(upload_id):
+    """Отменяет сессию загрузки и удаляет принятые данные."""
+    if upload_sessions.get(upload_id) is None:
+        return jsonify({"status": "error", "message": "Сессия загрузки не найдена"}), 404
+    upload_sessions.discard(upload_id)
+    return jsonify({"status": "success"})
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload_route(upload_id):
+    """Проверяет размер (и SHA-256, если передан) собранного файла и ставит OCR задачу в очередь.
+
+    Ответ как у POST /jobs (202 и id задачи); с wait=true - как у /upload (результат обработки).
+    """
+    session = upload_sessions.get(upload_id)
+    if session is None:
+        return jsonify({"status": "error", "message": "Сессия загрузки не найдена"}), 404
+    params = request.get_json(silent=True) or {}
+    try:
+        filepath_to_process = session.finalize(params.get('sha256'))
+    except UploadOffsetError as e:
+        return upload_session_response(session, 409, message=str(e))
+    except UploadHashMismatchError as e:
+        # Данные повреждены - продолжать эту загрузку бессмысленно
+        upload_sessions.discard(upload_id)
+        logger.warning(f"[UPLOAD] Сессия {upload_id}: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 422
+    except ValueError as e:
+        return upload_session_response(session, 400, message=str(e))
+    if not content_matches_extension(session.filename, session.detected_type()):
+        upload_sessions.discard(upload_id)
+        return jsonify({"status": "error", "message": "Содержимое файла не соответствует его расширению"}), 400
+
+    workspace = session.workspace
+    export_format = session.options['export_format']
+    workspace.add_cleanup(cleanup_source_file, filepath_to_process)
+    try:
+        job = job_manager.submit(
+            run_ocr_job, workspace, filepath_to_process, session.options['include_images'], export_format,
+            document_hash=session.sha256,
+            metadata={'processing_type': 'file', 'export_format': export_format,
+                      'workspace': workspace.id, 'upload_id': upload_id}
+        )
+    except JobQueueFullError as e:
+        # Файл остается в сессии: завершение можно повторить без повторной загрузки
+        session.reopen()
+        return job_error_response(e)
+    upload_sessions.finish(upload_id)
+    logger.info(f"[UPLOAD] Сессия {upload_id} завершена, задача {job.id}")
+
+    if not parse_bool(params.get('wait', request.args.get('wait')), default=False):
+        return jsonify({
+            "status": "success",
+            "job_id": job.id,
+            "job": job.to_dict(),
+            "status_url": f"/jobs/{job.id}"
+        }), 202
+    job.wait()
+    if job.error is not None:
+        return job_error_response(job.error)
+    return add_server_timing(jsonify({"status": "success", "data": job.result}), job)
 
-    except ValueError as e: # Ожидаемые ошибки (URL, файл, API)
-        logger.warning(f"Ошибка обработки запроса: {e}")
-        return jsonify({"status": "error", "message": str(e)}), 400 if "URL" in str(e) or "файл" in str(e) else 500
+@app.route('/upload', methods=['POST'])
+def upload_document_route():
+    """Обрабатывает загрузку документа (файл или URL) синхронно поверх очереди задач."""
+    try:
+        job, error_response = submit_job_from_request()
+        if error_response:
+            return error_response
+        job.wait()
+        if job.error is not None:
+            return job_error_response(job.error)
+        return add_server_timing(jsonify({"status": "success", "data": job.result}), job)
     except Exception as e:
-        logger.error(f"Непредвиденная ошибка при загрузке: {e}\n{traceback.format_exc()}")
-        return jsonify({"status": "error", "message": "Внутренняя ошибка сервера."}), 500
-    finally:
-        # Очистка временных файлов (загруженных по URL или оригинальных файлов)
-        if filepath_to_process and os.path.exists(filepath_to_process):
-            try:
-                # Не удаляем файлы изображений, так как они нужны для отображения/скачивания
-                # Удаляем только исходный загруженный PDF/DOCX/etc. или временный файл по URL
-                # Файлы изображений и результаты (md, json) имеют уникальные имена и управляются отдельно
-                # (например, могут быть удалены по расписанию или при следующем запросе, если это необходимо)
-
-                # Проверяем, является ли файл результатом OCR (md, json, png), чтобы не удалить их случайно
-                # Это простая проверка, можно улучшить
-                if not (filepath_to_process.endswith(('.md', '.json')) or filepath_to_process.startswith(os.path.join(app.config['UPLOAD_FOLDER'], 'page_'))):
-                     os.unlink(filepath_to_process)
-                     logger.info(f"Удален временный файл: {filepath_to_process}")
-            except Exception as cleanup_err:
-                logger.warning(f"Ошибка очистки файла {filepath_to_process}: {cleanup_err}")
+        return job_error_response(e)
 
 
-@app.route('/download/<filetype>/<filename>')
+@app.route('/download/<filetype>/<path:filename>')
 def download_file_route(filetype, filename):
-    """Отдает на скачивание Markdown или JSON файл."""
+    """Отдает на скачивание Markdown или JSON файл (ссылка <workspace_id>/<filename>)."""
     if filetype not in ['markdown', 'json']:
         return jsonify({"status": "error", "message": "Неверный тип файла для скачивания"}), 400
 
-    secure_fname = secure_filename(filename)
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], secure_fname)
+    filepath = workspace_manager.resolve(filename)
 
-    if not os.path.exists(filepath):
+    if filepath is None or not os.path.exists(filepath):
         logger.warning(f"Запрошенный для скачивания файл не найден: {filepath}")
         return jsonify({"status": "error", "message": "Файл не найден"}), 404
 
+    artifact_janitor.touch(filepath)  # Время отдачи - для вытеснения давно не использованных задач
     mimetype = 'text/markdown' if filetype == 'markdown' else 'application/json'
     download_name = f"document_ocr.{'md' if filetype == 'markdown' else 'json'}"
 
     return send_file(filepath, mimetype=mimetype, as_attachment=True, download_name=download_name)
 
-@app.route('/image/<filename>')
+@app.route('/image/<path:filename>')
 def serve_image_route(filename):
-    """Отдает изображение."""
+    """Отдает изображение (ссылка <workspace_id>/<filename> или имя файла в UPLOAD_FOLDER)."""
     # FIXED: Изображения теперь корректно создаются в демо-режиме
     logger.info(f"[SERVE_IMAGE] Запрос на обслуживание изображения. Получен filename: '{filename}'")
-    
-    # Важно: filename из URL уже должен быть "защищенным", если он был правильно создан в /upload
-    # Повторное применение secure_filename здесь не должно ничего менять, если имя уже безопасное.
-    # Однако, если по какой-то причине имя в URL не было защищено, это его защитит.
-    # Для отладки посмотрим, меняет ли что-то secure_filename.
-    s_filename_check = secure_filename(filename)
-    if s_filename_check != filename:
-        logger.warning(f"[SERVE_IMAGE] Имя файла '{filename}' было изменено secure_filename на '{s_filename_check}'. Это может указывать на проблему в URL.")
-
-    # Используем s_filename_check для построения пути, так как это гарантированно безопасное имя.
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], s_filename_check)
-    logger.info(f"[SERVE_IMAGE] UPLOAD_FOLDER: {app.config['UPLOAD_FOLDER']}")
+
+    # Ссылка разрешается только в каталог задачи или UPLOAD_FOLDER; небезопасные имена отклоняются
+    filepath = workspace_manager.resolve(filename)
+    if filepath is None:
+        logger.warning(f"[SERVE_IMAGE] Недопустимая ссылка на изображение: '{filename}'")
     logger.info(f"[SERVE_IMAGE] Полный путь к файлу для обслуживания: {filepath}")
 
     # Проверяем существование файла
-    if not os.path.exists(filepath):
+    if filepath is None or not os.path.exists(filepath):
         logger.warning(f"[SERVE_IMAGE] Файл НЕ НАЙДЕН по пути: {filepath}")
         # Создаем простое placeholder изображение если файл не найден
         from flask import Response
@@ -998,6 +1807,8 @@ def serve_image_route(filename):
         </svg>'''.format(filename)
         return Response(svg_content, mimetype='image/svg+xml')
 
+    artifact_janitor.touch(filepath)  # Время отдачи - для вытеснения давно не использованных задач
+
     # Определяем MIME-тип изображения
     mime_type, _ = mimetypes.guess_type(filepath)
     mime_type = mime_type or 'image/png' # По умолчанию png
@@ -1007,6 +1818,46 @@ def serve_image_route(filename):
 # УДАЛЕН: catch-all роут который блокировал корректное отображение реальных изображений
 # Теперь полагаемся на корректные markdown ссылки вида /image/<filename>
 
+@app.before_request
+def start_request_metrics():
+    """Отмечает начало запроса к OCR эндпоинту (in-flight gauge и время)."""
+    route = METRICS_ROUTES.get(request.endpoint)
+    if route is None or not app.config['METRICS_ENABLED']:
+        return
+    g.metrics_route = route
+    g.metrics_started = time.perf_counter()
+    # Gauge пишется в базу сразу: /metrics в другом процессе сервера видит выполняющийся запрос
+    metrics_registry.gauge_add('ocr_in_flight_requests', 1, {'route': route})
+
+@app.after_request
+def record_request_metrics(response):
+    """Запоминает статус и длительность ответа OCR эндпоинта (запись - в finish_request_metrics)."""
+    if g.get('metrics_route') is not None:
+        g.metrics_status = response.status_code
+        g.metrics_duration = time.perf_counter() - g.metrics_started
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    """Записывает метрики запроса одной транзакцией (после завершения потокового ответа)."""
+    route = g.pop('metrics_route', None)
+    if route is None:
+        return
+    labels = {'route': route}
+    metrics_registry.local_gauge_add('ocr_in_flight_requests', -1, labels)
+    with metrics_registry.batch() as batch:
+        batch.local_gauge('ocr_in_flight_requests', labels)
+        batch.inc('ocr_http_requests_total', labels={'route': route, 'status': str(g.get('metrics_status', 500))})
+        batch.observe('ocr_request_duration_seconds',
+                      g.get('metrics_duration', time.perf_counter() - g.metrics_started), labels)
+
+@app.route('/metrics')
+def metrics_route():
+    """Метрики в текстовом формате Prometheus (агрегированы по всем процессам)."""
+    if not app.config['METRICS_ENABLED']:
+        return jsonify({"status": "error", "message": "Метрики отключены"}), 404
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 # --- API Эндпоинты (для потенциального GUI) ---
 @app.route('/api/status', methods=['GET'])
 def api_status():
@@ -1018,7 +1869,7 @@ def api_status():
         return jsonify({"status": "error", "message": "API-ключ Mistral не настроен."}), 503
 
     try:
-        client = Mistral(api_key=app.config['MISTRAL_API_KEY'])
+        client = get_mistral_client()
         # Пример простого запроса для проверки работоспособности, например, список моделей
         # В данном случае, просто инициализация клиента считается достаточной для базовой проверки
         # client.models.list() # Раскомментировать для реальной проверки API
@@ -1028,89 +1879,133 @@ def api_status():
         return jsonify({"status": "error", "message": f"Ошибка подключения к Mistral API: {e}"}), 503
 
 
-def process_api_request(url, output_format, include_images):
+def api_page_json(page, include_images):
+    """Страница для /api/json: текст и URL изображений (через /image эндпоинт)."""
+    api_page_data = {"index": page.get("index"), "markdown": page.get("markdown")}
+    if include_images and page.get('images'):
+        api_page_data["images"] = []
+        for img_info in page['images']:
+            # Предоставляем URL для доступа к изображению через /image эндпоинт
+            api_img_obj = {"id": img_info.get("id")}
+            if img_info.get('path'):
+                api_img_obj['url'] = image_url_for_path(img_info['path'])
+            api_page_data["images"].append(api_img_obj)
+    return api_page_data
+
+def dumps_ndjson_line(obj):
+    """Сериализует объект в строку NDJSON (orjson, если установлен)."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj) + b"\n"
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode('utf-8')
+
+def iter_ndjson_document(job, api_pages, internal_message):
+    """Генератор NDJSON: объект {"type": "page", ...} на каждую страницу по мере готовности в задаче,
+    затем {"type": "summary", ...} после ее завершения (со status "error", если задача упала)."""
+    page_count = 0
+    image_count = 0
+    for api_page_data in api_pages:
+        page_count += 1
+        image_count += len(api_page_data.get("images", []))
+        yield dumps_ndjson_line({"type": "page", **api_page_data})
+    job.wait()
+    summary = {"type": "summary", "status": "success", "page_count": page_count, "image_count": image_count}
+    if job.error is not None:
+        summary["status"] = "error"
+        summary["message"] = str(job.error) if isinstance(job.error, ValueError) else internal_message
+        logger.warning(f"Потоковый ответ прерван ошибкой задачи после {page_count} страниц: {job.error}")
+    else:
+        summary["source_document_url"] = job.result.get("document_url")
+    yield dumps_ndjson_line(summary)
+
+def iter_streamed_markdown(job, page_chunks):
+    """Markdown по страницам по мере готовности в задаче; ошибка после начала ответа только логируется."""
+    yield from iter_markdown_document(page_chunks, lambda page_markdown: page_markdown)
+    job.wait()
+    if job.error is not None:
+        logger.warning(f"Потоковый ответ Markdown прерван ошибкой задачи: {job.error}")
+
+def stream_api_response(job, page_stream, output_format, internal_message):
+    """Потоковый ответ /api/markdown и /api/json из страниц, публикуемых задачей.
+
+    Ответ начинается с первой готовой страницы. Если задача завершилась ошибкой раньше
+    (например, документ не скачался), возвращается обычный ответ с ошибкой и кодом статуса.
+    """
+    pages = iter(page_stream)
+    first_page = next(pages, None)
+    if first_page is None:
+        job.wait()
+        if job.error is not None:
+            return job_error_response(job.error, internal_message)
+        pages = iter(())
+    else:
+        pages = itertools.chain([first_page], pages)
+    if output_format == 'markdown':
+        return Response(stream_with_context(iter_streamed_markdown(job, pages)), mimetype='text/markdown; charset=utf-8')
+    return Response(stream_with_context(iter_ndjson_document(job, pages, internal_message)), mimetype='application/x-ndjson')
+
+def wants_streaming_response(mimetype):
+    """Клиент запросил потоковый ответ: ?stream=1 или Accept с заданным типом."""
+    if request.args.get('stream', '').lower() in ('1', 'true'):
+        return True
+    return request.accept_mimetypes.best_match(['application/json', mimetype]) == mimetype
+
+def process_api_request(url, output_format, include_images, stream=False):
     """Общая логика для /api/markdown и /api/json эндпоинтов."""
     if not url:
         return jsonify({"status": "error", "message": "Параметр 'url' обязателен."}), 400
 
-    temp_dir = app.config['UPLOAD_FOLDER']
-    # Генерируем временное имя файла для скачанного содержимого
-    original_filename = os.path.basename(unquote(urlparse(url).path)) or "api_downloaded_file.tmp"
-    temp_filename = secure_filename(f"api_upload_{os.urandom(4).hex()}_{original_filename}")
-    filepath_to_process = os.path.join(temp_dir, temp_filename)
+    # Генерируем временное имя файла для скачанного содержимого в каталоге задачи
+    workspace = workspace_manager.create()
+    filepath_to_process = build_url_source_path(url, 'api_upload', "api_downloaded_file.tmp", workspace)
+    workspace.add_cleanup(cleanup_source_file, filepath_to_process)
+    internal_message = "Внутренняя ошибка сервера при обработке API запроса."
+
+    page_stream = None
+    if stream:
+        # Страницы преобразуются в формат ответа в задаче сразу по готовности
+        render_page = api_page_markdown if output_format == 'markdown' else api_page_json
+        page_stream = PageStream(lambda page: render_page(page, include_images))
+
+    try:
+        job = job_manager.submit(run_ocr_job, workspace, filepath_to_process, include_images, url=url,
+                                 page_stream=page_stream,
+                                 metadata={'processing_type': 'api', 'output_format': output_format,
+                                           'workspace': workspace.id})
+    except JobQueueFullError as e:
+        workspace.cleanup(keep_results=False)
+        return job_error_response(e, internal_message)
 
     try:
-        download_file_from_url(url, filepath_to_process)
-        if not os.path.exists(filepath_to_process):
-             return jsonify({"status": "error", "message": "Ошибка загрузки файла по URL для API обработки"}), 500
+        if stream:
+            # Заголовок Server-Timing не добавляется: ответ начинается до завершения задачи
+            return stream_api_response(job, page_stream, output_format, internal_message)
 
-        result_data = process_ocr_document(filepath_to_process, include_images=include_images)
+        job.wait()
+        if job.error is not None:
+            return job_error_response(job.error, internal_message)
+        result_data = job.result
 
         if output_format == 'markdown':
-            # Собираем полный Markdown из всех страниц
-            markdown_output_pages = []
-            for page in result_data.get('pages', []):
-                page_md = f"# Страница {page.get('index',0) + 1}\n\n{page.get('markdown', '')}"
-                if include_images and page.get('images'):
-                     for img_info in page['images']:
-                        # Для API возвращаем base64 изображения прямо в Markdown
-                        img_path = img_info.get('path')
-                        if app.config['USE_MOCK_OCR'] and img_info.get('image_base64') and not (img_path and os.path.exists(img_path)):
-                            image_data_b64 = img_info['image_base64']
-                            if not image_data_b64.startswith('data:image'):
-                                image_data_b64 = f"data:image/png;base64,{image_data_b64.split(',')[-1]}"
-                            page_md += f"\n\n![image]({image_data_b64})\n\n"
-                        elif img_path and os.path.exists(img_path):
-                            with open(img_path, "rb") as image_file:
-                                b64_encoded = base64.b64encode(image_file.read()).decode('utf-8')
-                            page_md += f"\n\n![image](data:image/png;base64,{b64_encoded})\n\n"
-                markdown_output_pages.append(page_md)
-            full_markdown = "\n\n---\n\n".join(markdown_output_pages)
-            return jsonify({"status": "success", "markdown": full_markdown, "source_document_url": result_data.get("document_url")})
+            # Для API возвращаем base64 изображения прямо в Markdown
+            full_markdown = "".join(iter_markdown_document(
+                result_data.get('pages', []),
+                lambda page: api_page_markdown(page, include_images)
+            ))
+            return add_server_timing(
+                jsonify({"status": "success", "markdown": full_markdown, "source_document_url": result_data.get("document_url")}), job
+            )
 
         elif output_format == 'json':
-            # Для JSON ответа, изображения могут быть представлены как пути или base64 строки
-            # В данном случае, result_data уже содержит пути, если include_images=True и файлы были сохранены
-            # Если GUI нужно base64, это можно добавить здесь дополнительно
             api_json_result = {
                 "source_document_url": result_data.get("document_url"),
-                "pages": []
+                "pages": [api_page_json(page, include_images) for page in result_data.get('pages', [])]
             }
-            for page in result_data.get('pages', []):
-                api_page_data = {"index": page.get("index"), "markdown": page.get("markdown")}
-                if include_images and page.get('images'):
-                    api_page_data["images"] = []
-                    for img_info in page['images']:
-                        # Предоставляем URL для доступа к изображению через /image эндпоинт
-                        api_img_obj = {"id": img_info.get("id")}
-                        if img_info.get('path'):
-                             api_img_obj['url'] = f"/image/{secure_filename(os.path.basename(img_info['path']))}"
-                        # Опционально: добавить base64 если это нужно API клиенту
-                        # if img_info.get('path') and os.path.exists(img_info['path']):
-                        #     with open(img_info['path'], "rb") as image_file:
-                        #         b64_encoded = base64.b64encode(image_file.read()).decode('utf-8')
-                        #     api_img_obj['base64'] = f"data:image/png;base64,{b64_encoded}"
-                        api_page_data["images"].append(api_img_obj)
-                api_json_result["pages"].append(api_page_data)
-            return jsonify({"status": "success", "data": api_json_result})
+            return add_server_timing(jsonify({"status": "success", "data": api_json_result}), job)
 
-    except ValueError as e:
-        return jsonify({"status": "error", "message": str(e)}), 400 if "URL" in str(e) or "файл" in str(e) else 500
     except Exception as e:
-        logger.error(f"API ошибка: {e}\n{traceback.format_exc()}")
-        return jsonify({"status": "error", "message": "Внутренняя ошибка сервера при обработке API запроса."}), 500
-    finally:
-        if filepath_to_process and os.path.exists(filepath_to_process):
-            try:
-                # Удаляем временный файл, скачанный для API
-                if not (filepath_to_process.endswith(('.md', '.json')) or filepath_to_process.startswith(os.path.join(app.config['UPLOAD_FOLDER'], 'page_'))):
-                    os.unlink(filepath_to_process)
-                    logger.info(f"Удален временный API файл: {filepath_to_process}")
-            except Exception as cleanup_err:
-                logger.warning(f"Ошибка очистки временного API файла {filepath_to_process}: {cleanup_err}")
+        return job_error_response(e, internal_message)
 
-        # Дополнительно: очистка сохраненных md, json и png файлов от предыдущих API запросов, если они не нужны
-        # Это можно реализовать через удаление файлов старше определенного времени
+    # Сохраненные md, json и изображения API запросов удаляет artifact_janitor (срок хранения и лимит диска)
 
 
 @app.route('/api/markdown', methods=['GET'])
@@ -1120,7 +2015,7 @@ def api_get_markdown():
     # Параметр include_images, по умолчанию true
     include_images_str = request.args.get('include_images', 'true').lower()
     include_images = include_images_str == 'true'
-    return process_api_request(url, 'markdown', include_images)
+    return process_api_request(url, 'markdown', include_images, stream=wants_streaming_response('text/markdown'))
 
 @app.route('/api/json', methods=['GET'])
 def api_get_json():
@@ -1129,19 +2024,248 @@ def api_get_json():
     # Параметр include_images, по умолчанию true
     include_images_str = request.args.get('include_images', 'true').lower()
     include_images = include_images_str == 'true'
-    return process_api_request(url, 'json', include_images)
+    return process_api_request(url, 'json', include_images, stream=wants_streaming_response('application/x-ndjson'))
+
+# --- Пакетная обработка ---
+def batch_item_error_message(error):
+    """Сообщение об ошибке элемента пакета (внутренние ошибки не раскрываются, как в job_error_response)."""
+    if isinstance(error, ValueError):
+        return str(error)
+    return "Внутренняя ошибка сервера."
+
+def batch_status(batch):
+    """Статус пакета с сообщениями об ошибках элементов."""
+    data = batch.to_dict()
+    for item, item_data in zip(batch.items, data['items']):
+        if item.state == ITEM_FAILED:
+            item_data['message'] = batch_item_error_message(item.error)
+    return data
+
+def prepare_batch_url(url, include_images):
+    """Подготовка элемента-URL: каталог задачи создается при постановке элемента в очередь."""
+    def prepare():
+        workspace = workspace_manager.create()
+        filepath_to_process = build_url_source_path(url, 'batch', "batch_downloaded_file.tmp", workspace)
+        workspace.add_cleanup(cleanup_source_file, filepath_to_process)
+        return run_ocr_job, (workspace, filepath_to_process, include_images), {'url': url}, workspace.id
+    return prepare
+
+def prepare_batch_file(file, include_images):
+    """Подготовка элемента-файла: файл запроса переносится в каталог задачи сразу (до ответа).
+
+    Возвращает (prepare, каталог задачи); недопустимый файл становится ошибкой элемента, а не пакета.
+    """
+    def rejected(message):
+        def prepare():
+            raise ValueError(message)
+        return prepare, None
+
+    if not allowed_file(file.filename):
+        return rejected("Недопустимый тип файла")
+    ingested = file.stream if isinstance(file.stream, IngestedFile) else None
+    if ingested is not None and not content_matches_extension(file.filename, ingested.detected_type):
+        return rejected("Содержимое файла не соответствует его расширению")
+
+    workspace = workspace_manager.create()
+    filepath_to_process = workspace.file_path(file.filename)
+    document_hash = None
+    source_file = None
+    try:
+        if ingested is not None:
+            source_file = ingested.claim(filepath_to_process)
+            document_hash = ingested.sha256
+            workspace.add_cleanup(source_file.close)
+        else:
+            file.save(filepath_to_process)
+    except Exception:
+        workspace.remove()
+        raise
+    workspace.add_cleanup(cleanup_source_file, filepath_to_process)
+
+    def prepare():
+        return (run_ocr_job, (workspace, filepath_to_process, include_images),
+                {'document_hash': document_hash, 'source_file': source_file}, workspace.id)
+    return prepare, workspace
+
+def iter_batch_item_markdown(item, include_images):
+    """Markdown результата элемента по частям (изображения встроены как base64, как в /api/markdown)."""
+    for chunk in iter_markdown_document(item.result.get('pages', []),
+                                        lambda page: api_page_markdown(page, include_images)):
+        yield chunk.encode('utf-8')
+
+def batch_item_json(item, include_images):
+    """Результат элемента в формате /api/json."""
+    return {
+        "source_document_url": item.result.get("document_url"),
+        "pages": [api_page_json(page, include_images) for page in item.result.get('pages', [])]
+    }
+
+def iter_batch_ndjson(batch):
+    """NDJSON: строка {"type": "item", ...} на каждый элемент по мере завершения, затем {"type": "summary", ...}."""
+    include_images = batch.options['include_images']
+    for item in batch.iter_finished():
+        line = {"type": "item", **item.to_dict()}
+        if item.state == ITEM_FAILED:
+            line["message"] = batch_item_error_message(item.error)
+        elif batch.options['output_format'] == 'markdown':
+            line["markdown"] = b"".join(iter_batch_item_markdown(item, include_images)).decode('utf-8')
+        else:
+            line["data"] = batch_item_json(item, include_images)
+        yield dumps_ndjson_line(line)
+    status = batch.to_dict(include_items=False)
+    yield dumps_ndjson_line({"type": "summary", "batch_id": batch.id, "total": status['total'],
+                             "done": status['done'], "failed": status['failed']})
+
+def batch_entry_name(item, extension):
+    """Имя файла элемента в архиве: номер элемента и имя исходного документа."""
+    source_name = os.path.basename(urlparse(item.source).path) if item.kind == 'url' else item.source
+    stem = os.path.splitext(secure_filename(unquote(source_name or '')))[0] or 'document'
+    return f"{item.index + 1:04d}_{stem}.{extension}"
+
+def iter_batch_zip(batch):
+    """ZIP с результатами элементов по мере завершения и manifest.json со статусом пакета в конце."""
+    include_images = batch.options['include_images']
+
+    def entries():
+        for item in batch.iter_finished():
+            if item.state == ITEM_FAILED:
+                continue
+            if batch.options['output_format'] == 'markdown':
+                yield batch_entry_name(item, 'md'), iter_batch_item_markdown(item, include_images)
+            else:
+                yield batch_entry_name(item, 'json'), [dumps_ndjson_line(batch_item_json(item, include_images))]
+        yield 'manifest.json', [json.dumps(batch_status(batch), ensure_ascii=False, indent=2).encode('utf-8')]
+
+    return iter_zip_stream(entries())
+
+def batch_results_response(batch, results_format):
+    """Потоковая выдача результатов пакета: NDJSON или ZIP."""
+    if results_format == 'zip':
+        return Response(stream_with_context(iter_batch_zip(batch)), mimetype='application/zip', headers={
+            'Content-Disposition': f'attachment; filename="batch_{batch.id}.zip"'
+        })
+    return Response(stream_with_context(iter_batch_ndjson(batch)), mimetype='application/x-ndjson')
+
+@app.route('/api/batch', methods=['POST'])
+def api_create_batch():
+    """Пакетная обработка: список URL и/или файлов с общими параметрами.
+
+    JSON: {"urls": [...], "output_format", "include_images", "concurrency"} или multipart
+    (поля urls и файлы documents). Ответ - 202 со статусом пакета; с параметром
+    results=ndjson|zip результаты сразу отдаются потоком по мере готовности.
+    """
+    try:
+        params = request.get_json(silent=True) if request.is_json else request.form
+        if request.is_json and not isinstance(params, dict):
+            params = {}
+        files = [] if request.is_json else [f for f in request.files.getlist('documents') if f.filename]
+    except (DocumentTooLargeError, RequestEntityTooLarge):
+        return jsonify({"status": "error", "message": f"Запрос слишком большой. Максимальный размер: {app.config['MAX_CONTENT_LENGTH'] // (1024*1024)}MB"}), 413
+
+    if request.is_json:
+        urls = params.get('urls') or []
+        if not isinstance(urls, list):
+            return jsonify({"status": "error", "message": "Поле 'urls' должно быть списком"}), 400
+    else:
+        # Поле urls можно повторять или передать несколько URL через перевод строки
+        urls = [line for value in params.getlist('urls') for line in value.splitlines()]
+    urls = [str(url).strip() for url in urls if str(url).strip()]
+
+    output_format = params.get('output_format', 'json')
+    if output_format not in ('json', 'markdown'):
+        return jsonify({"status": "error", "message": "output_format должен быть 'json' или 'markdown'"}), 400
+    include_images = parse_bool(params.get('include_images'))
+    max_concurrency = app.config['BATCH_MAX_CONCURRENCY']
+    try:
+        concurrency = min(max(int(params.get('concurrency', max_concurrency)), 1), max_concurrency)
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "concurrency должен быть целым числом"}), 400
+
+    total = len(urls) + len(files)
+    if total == 0:
+        return jsonify({"status": "error", "message": "Не переданы ни URL, ни файлы"}), 400
+    if total > app.config['BATCH_MAX_ITEMS']:
+        return jsonify({"status": "error", "message": f"Слишком много документов в пакете (максимум {app.config['BATCH_MAX_ITEMS']})"}), 400
+
+    items = []
+    claimed = []
+    try:
+        for url in urls:
+            items.append(BatchItem(len(items), 'url', url, prepare_batch_url(url, include_images)))
+        for file in files:
+            prepare, workspace = prepare_batch_file(file, include_images)
+            if workspace is not None:
+                claimed.append(workspace)
+            items.append(BatchItem(len(items), 'file', file.filename, prepare,
+                                   workspace.id if workspace is not None else None))
+
+        batch = batch_manager.create(items, concurrency, options={
+            'output_format': output_format, 'include_images': include_images
+        })
+    except Exception as e:
+        # Каталоги уже принятых файлов не переданы задачам - удаляем их (и закрываем файлы) сразу
+        for workspace in claimed:
+            workspace.cleanup(keep_results=False)
+        return job_error_response(e)
+    logger.info(f"[BATCH] Пакет {batch.id}: {len(urls)} URL, {len(files)} файлов, параллельно до {concurrency}")
+
+    results_format = request.args.get('results')
+    if results_format in ('ndjson', 'zip'):
+        return batch_results_response(batch, results_format)
+    return jsonify({
+        "status": "success",
+        "batch_id": batch.id,
+        "batch": batch_status(batch),
+        "status_url": f"/api/batch/{batch.id}",
+        "results_url": f"/api/batch/{batch.id}/results"
+    }), 202
+
+@app.route('/api/batch/<batch_id>', methods=['GET'])
+def api_get_batch(batch_id):
+    """Статус пакета и каждого его элемента."""
+    batch = batch_manager.get(batch_id)
+    if batch is None:
+        return jsonify({"status": "error", "message": "Пакет не найден"}), 404
+    return jsonify({"status": "success", "batch": batch_status(batch)})
+
+@app.route('/api/batch/<batch_id>/results', methods=['GET'])
+def api_get_batch_results(batch_id):
+    """Результаты пакета потоком: format=ndjson (по умолчанию) или format=zip."""
+    batch = batch_manager.get(batch_id)
+    if batch is None:
+        return jsonify({"status": "error", "message": "Пакет не найден"}), 404
+    results_format = request.args.get('format', 'ndjson')
+    if results_format not in ('ndjson', 'zip'):
+        return jsonify({"status": "error", "message": "format должен быть 'ndjson' или 'zip'"}), 400
+    return batch_results_response(batch, results_format)
 
 @app.route('/compare')
 def compare_results():
     """Показывает страницу сравнения оригинального PDF с результатами OCR."""
     return render_template('compare.html')
 
-@app.route('/pdf_page/<filename>')
+@app.route('/pdf_page/<document_hash>/<int:page_num>')
+def serve_rendered_pdf_page(document_hash, page_num):
+    """Рендерит страницу PDF по запросу (с кэшированием на диске) и отдает PNG."""
+    if not re.fullmatch(r'[0-9a-f]{64}', document_hash):
+        return jsonify({"status": "error", "message": "Неверный идентификатор документа"}), 400
+    dpi = request.args.get('dpi', app.config['PAGE_RENDER_DEFAULT_DPI'], type=int)
+    try:
+        page_path = page_render_cache.render(document_hash, page_num, dpi)
+    except Exception as e:
+        logger.error(f"Ошибка рендера страницы {page_num} документа {document_hash[:12]}: {e}")
+        return jsonify({"status": "error", "message": "Ошибка рендера страницы"}), 500
+    if page_path is None:
+        return jsonify({"status": "error", "message": "Страница недоступна"}), 404
+    return send_file(page_path, mimetype='image/png', max_age=86400)
+
+@app.route('/pdf_page/<path:filename>')
 def serve_pdf_page(filename):
-    """Отдает изображения страниц PDF для сравнения."""
+    """Отдает изображения страниц PDF для сравнения (ссылка <workspace_id>/<filename>)."""
     try:
-        pdf_page_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(filename))
-        if os.path.exists(pdf_page_path):
+        pdf_page_path = workspace_manager.resolve(filename)
+        if pdf_page_path is not None and os.path.exists(pdf_page_path):
+            artifact_janitor.touch(pdf_page_path)
             return send_file(pdf_page_path, mimetype='image/png')
         else:
             logger.warning(f"PDF страница не найдена: {filename}")
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарк переписывания ссылок на изображения в markdown
+Сравнивает прежний подход (re.findall + str.replace на каждое изображение, затем
+еще один replace на каждое изображение для embedded вывода) с однопроходной
+заменой через таблицу соответствий (services/markdown_links.py)
+
+Запуск: python benchmarks/bench_markdown_links.py [--images 100 300 1000] [--repeat 5]
+"""
+
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.markdown_links import rewrite_image_links, page_image_resolver, image_url_for_path  # noqa: E402
+
+LEGACY_IMAGE_PATTERN = r'!\[([^\]]*)\]\(([^)]+\.(jpeg|jpg|png|gif|webp))\)'
+FAKE_DATA_URL = "data:image/png;base64," + "A" * 2048
+
+
+def make_page(image_count):
+    """Синтетическая страница: абзац текста и ссылка на изображение для каждого изображения API"""
+    paragraphs = []
+    images = []
+    for i in range(image_count):
+        image_id = f"img-{i}.jpeg"
+        paragraphs.append(f"Абзац {i} с текстом рядом с рисунком. " * 4)
+        paragraphs.append(f"![{image_id}]({image_id})")
+        images.append({"id": image_id, "path": f"/tmp/page_0_img_{image_id}.jpeg"})
+    return {"index": 0, "markdown": "\n\n".join(paragraphs), "images": images}
+
+
+def legacy_rewrite(page):
+    """Прежний алгоритм: позиционная замена str.replace(old, new, 1) и replace на каждое изображение"""
+    markdown = page["markdown"]
+    saved = [img for img in page["images"] if img.get("path")]
+    for k, (alt_text, image_ref, _) in enumerate(re.findall(LEGACY_IMAGE_PATTERN, markdown, re.IGNORECASE)):
+        if k < len(saved):
+            old_pattern = f"![{alt_text}]({image_ref})"
+            new_pattern = f"![{alt_text}](/image/{os.path.basename(saved[k]['path'])})"
+            markdown = markdown.replace(old_pattern, new_pattern, 1)
+    for img in saved:
+        img_url = f"/image/{os.path.basename(img['path'])}"
+        if img_url in markdown:
+            markdown = markdown.replace(img_url, FAKE_DATA_URL)
+    return markdown
+
+
+def single_pass_rewrite(page):
+    """Новый алгоритм: один проход на ссылки /image/... и один проход на data URL"""
+    markdown, _ = rewrite_image_links(page["markdown"], page_image_resolver(page["images"], page["markdown"]))
+    urls = {image_url_for_path(img["path"]) for img in page["images"] if img.get("path")}
+    markdown, _ = rewrite_image_links(markdown, lambda ref: FAKE_DATA_URL if ref in urls else None)
+    return markdown
+
+
+def main():
+    """Основная функция бенчмарка"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, nargs="+", default=[100, 300, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'изображений':>12} {'прежний, мс':>14} {'один проход, мс':>16} {'ускорение':>10}")
+    for image_count in args.images:
+        page = make_page(image_count)
+        assert legacy_rewrite(page) == single_pass_rewrite(page)
+        legacy = min(timeit.repeat(lambda: legacy_rewrite(page), number=1, repeat=args.repeat))
+        single = min(timeit.repeat(lambda: single_pass_rewrite(page), number=1, repeat=args.repeat))
+        print(f"{image_count:>12} {legacy * 1000:>14.2f} {single * 1000:>16.2f} {legacy / single:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
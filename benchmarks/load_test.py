@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест маршрутов приложения
+Запускает приложение с локальным stub API Mistral (USE_STUB_OCR), фикстурный HTTP-сервер
+с PDF для URL-сценариев и генерирует конкурентную нагрузку смесью сценариев:
+  upload - POST /upload с уникальным PDF (промах кэша)
+  url    - GET /api/json?url=... с уникальным PDF с фикстурного сервера
+  cache  - POST /upload одного и того же PDF (попадание в кэш)
+Для каждого уровня параллельности выводит пропускную способность, p50/p95/p99,
+долю ошибок и RSS сервера во времени; полный отчет сохраняется в JSON
+
+Запуск:
+    python benchmarks/load_test.py --concurrency 1 4 8 16 --duration 20 --output load.json
+    python benchmarks/load_test.py --target http://127.0.0.1:5000 --server-pid 1234  # уже запущенный сервер
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from benchmarks.synthetic import make_pdf  # noqa: E402
+
+SCENARIOS = ('upload', 'url', 'cache')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def unique_pdf(base_pdf, n):
+    """Уникальные байты PDF (комментарий после %%EOF меняет хэш, документ остается тем же)"""
+    return base_pdf + f"\n%load-test-{n}\n".encode('ascii')
+
+
+def start_fixture_server(base_pdf):
+    """HTTP-сервер с документами /doc/<n>.pdf для URL-сценария"""
+
+    class FixtureHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            match = re.fullmatch(r'/doc/(\d+)\.pdf', self.path)
+            if not match:
+                self.send_error(404)
+                return
+            body = unique_pdf(base_pdf, int(match.group(1)))
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/pdf')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_app_server(args, work_dir):
+    """Запускает app.py в отдельном процессе с USE_STUB_OCR; возвращает (процесс, базовый URL)"""
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        'HOST': '127.0.0.1',
+        'PORT': str(port),
+        'DEBUG': 'False',
+        'USE_MOCK_OCR': 'false',
+        'USE_STUB_OCR': 'true',
+        'UPLOAD_FOLDER': work_dir,
+        'SETTINGS_DB_PATH': os.path.join(work_dir, 'settings.db'),
+        'OCR_JOB_WORKERS': str(args.job_workers),
+        'OCR_JOB_MAX_PENDING': str(args.job_max_pending),
+        'STUB_OCR_LATENCY_MS': str(args.stub_latency_ms),
+        'STUB_OCR_PAGE_LATENCY_MS': str(args.stub_page_latency_ms),
+        'STUB_OCR_ERROR_RATE': str(args.stub_error_rate),
+        'STUB_OCR_MISSING_BASE64_RATE': str(args.stub_missing_base64_rate),
+    })
+    log = open(os.path.join(work_dir, 'server.log'), 'wb')
+    process = subprocess.Popen([sys.executable, 'app.py'], cwd=ROOT_DIR, env=env, stdout=log, stderr=log)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Сервер завершился при запуске, см. {log.name}")
+        try:
+            requests.get(f"{base_url}/api/status", timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Сервер не запустился за 60 секунд")
+
+
+def process_tree_rss_mb(pid):
+    """RSS процесса и его потомков (МБ) по /proc; None, если недоступно"""
+    if not pid or not os.path.exists(f"/proc/{pid}"):
+        return None
+    total_kb = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total_kb += int(line.split()[1])
+                        break
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    stack.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return total_kb / 1024
+
+
+class RssSampler(threading.Thread):
+    """Периодически записывает RSS сервера: [(секунды от старта, МБ)]"""
+
+    def __init__(self, pid, interval):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self.started_at = time.time()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            rss = process_tree_rss_mb(self.pid)
+            if rss is not None:
+                self.samples.append((round(time.time() - self.started_at, 2), round(rss, 1)))
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class LoadGenerator:
+    """Выполняет сценарии в пуле потоков и собирает результаты запросов"""
+
+    def __init__(self, base_url, fixture_url, base_pdf, mix, timeout, seed):
+        self.base_url = base_url
+        self.fixture_url = fixture_url
+        self.base_pdf = base_pdf
+        self.cached_pdf = unique_pdf(base_pdf, 0)
+        self.scenarios = [name for name, weight in mix.items() for _ in range(weight)]
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.counter = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _next_id(self):
+        with self.lock:
+            self.counter += 1
+            return self.counter
+
+    def _session(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def run_one(self, scenario):
+        session = self._session()
+        started = time.perf_counter()
+        try:
+            if scenario == 'upload':
+                content = unique_pdf(self.base_pdf, 1_000_000 + self._next_id())
+                response = session.post(f"{self.base_url}/upload", files={'document': ('load.pdf', content)},
+                                        data={'export_format': 'links'}, timeout=self.timeout)
+            elif scenario == 'cache':
+                response = session.post(f"{self.base_url}/upload", files={'document': ('cached.pdf', self.cached_pdf)},
+                                        data={'export_format': 'links'}, timeout=self.timeout)
+            else:
+                url = f"{self.fixture_url}/doc/{2_000_000 + self._next_id()}.pdf"
+                response = session.get(f"{self.base_url}/api/json", params={'url': url}, timeout=self.timeout)
+            status = response.status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        return scenario, status, (time.perf_counter() - started) * 1000
+
+    def run_level(self, concurrency, duration):
+        """Нагрузка заданной параллельности в течение duration секунд"""
+        deadline = time.time() + duration
+        results = []
+
+        def worker():
+            while time.time() < deadline:
+                with self.lock:
+                    scenario = self.rng.choice(self.scenarios)
+                results.append(self.run_one(scenario))
+
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in [executor.submit(worker) for _ in range(concurrency)]:
+                future.result()
+        return results, time.time() - started
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return round(sorted_values[index], 1)
+
+
+def summarize(results, elapsed):
+    latencies = sorted(latency for _, _, latency in results)
+    errors = sum(1 for _, status, _ in results if status != 200)
+    statuses = {}
+    for _, status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "requests": len(results),
+        "errors": errors,
+        "error_rate": round(errors / len(results), 4) if results else None,
+        "statuses": statuses,
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "p50": percentile(latencies, 50), "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99), "max": round(latencies[-1], 1) if latencies else None,
+        },
+    }
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Неизвестный сценарий: {name}")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+def main():
+    """Основная функция нагрузочного теста"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--duration", type=float, default=15, help="секунд на уровень параллельности")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("upload=2,url=1,cache=1"),
+                        help="веса сценариев, например upload=2,url=1,cache=1")
+    parser.add_argument("--pages", type=int, default=10, help="страниц в тестовом PDF")
+    parser.add_argument("--images-per-page", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rss-interval", type=float, default=0.5)
+    parser.add_argument("--target", help="URL уже запущенного сервера (иначе app.py запускается с USE_STUB_OCR)")
+    parser.add_argument("--server-pid", type=int, help="PID сервера для замера RSS при --target")
+    parser.add_argument("--job-workers", type=int, default=4, help="OCR_JOB_WORKERS запускаемого сервера")
+    parser.add_argument("--job-max-pending", type=int, default=100)
+    parser.add_argument("--stub-latency-ms", type=float, default=200)
+    parser.add_argument("--stub-page-latency-ms", type=float, default=20)
+    parser.add_argument("--stub-error-rate", type=float, default=0.0)
+    parser.add_argument("--stub-missing-base64-rate", type=float, default=0.1)
+    parser.add_argument("--output", help="файл для JSON отчета (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="mistral_ocr_load_")
+    process = None
+    try:
+        base_pdf = open(make_pdf(os.path.join(work_dir, "base.pdf"), args.pages, args.images_per_page, 96), 'rb').read()
+        fixture = start_fixture_server(base_pdf)
+        if args.target:
+            base_url, server_pid = args.target.rstrip('/'), args.server_pid
+        else:
+            process, base_url = start_app_server(args, work_dir)
+            server_pid = process.pid
+
+        generator = LoadGenerator(base_url, f"http://127.0.0.1:{fixture.server_address[1]}",
+                                  base_pdf, args.mix, args.timeout, args.seed)
+        generator.run_one('cache')  # Прогрев: первый запрос заполняет кэш для сценария cache
+        sampler = RssSampler(server_pid, args.rss_interval)
+        sampler.start()
+        levels = []
+        for concurrency in args.concurrency:
+            level_started = time.time() - sampler.started_at
+            results, elapsed = generator.run_level(concurrency, args.duration)
+            level_rss = [mb for t, mb in sampler.samples if t >= level_started]
+            level = {"concurrency": concurrency, "duration_s": round(elapsed, 2), **summarize(results, elapsed)}
+            level["by_scenario"] = {
+                name: summarize([r for r in results if r[0] == name], elapsed)
+                for name in args.mix
+            }
+            level["rss_mb"] = {"max": max(level_rss), "end": level_rss[-1]} if level_rss else None
+            levels.append(level)
+            print(f"c={concurrency:<3} {level['throughput_rps']:>7} req/s  "
+                  f"p50 {level['latency_ms']['p50']} ms  p95 {level['latency_ms']['p95']} ms  "
+                  f"p99 {level['latency_ms']['p99']} ms  errors {level['error_rate']}  "
+                  f"rss max {level['rss_mb']['max'] if level['rss_mb'] else '-'} MB", file=sys.stderr)
+        sampler.stop()
+        fixture.shutdown()
+
+        report = {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "target": base_url,
+                "params": {key: value for key, value in vars(args).items() if key != 'output'},
+            },
+            "levels": levels,
+            "rss_timeline_mb": sampler.samples,
+        }
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(output + "\n")
+        else:
+            print(output)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Бенчмарки горячих путей постобработки документа
+Генерирует синтетические PDF и ответы OCR, измеряет время, пропускную способность
+и пиковую память (tracemalloc) каждой функции и сохраняет результаты в JSON
+
+Запуск:
+    python benchmarks/run_benchmarks.py --pages 50 --images-per-page 4 --output before.json
+    python benchmarks/run_benchmarks.py --compare before.json after.json
+"""
+
+import argparse
+import copy
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = tempfile.mkdtemp(prefix="mistral_ocr_bench_")
+os.environ["UPLOAD_FOLDER"] = WORK_DIR
+os.environ["SETTINGS_DB_PATH"] = os.path.join(WORK_DIR, "settings.db")
+os.environ["METRICS_ENABLED"] = "False"
+sys.path.insert(0, ROOT_DIR)
+
+import app as ocr_app  # noqa: E402
+from benchmarks.synthetic import make_ocr_response, make_pdf, make_result_data  # noqa: E402
+from services.page_renderer import PageRenderCache  # noqa: E402
+from services.pdf_fallback import extract_fallback_assets  # noqa: E402
+
+
+def measure(func, setup=None, repeat=5):
+    """Выполняет func repeat раз; setup() готовит аргументы и не входит в замер.
+
+    Возвращает времена (с) и пиковую память Python-аллокаций (байт) за один вызов.
+    """
+    times = []
+    peak = 0
+    for i in range(repeat):
+        args = setup() if setup else ()
+        if i == 0:
+            tracemalloc.start()
+            func(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            args = setup() if setup else ()
+        started = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - started)
+    return times, peak
+
+
+def summarize(name, times, peak, units, unit_name):
+    median = statistics.median(times)
+    return {
+        "name": name,
+        "repeat": len(times),
+        "time_s": {"min": min(times), "median": median, "mean": statistics.mean(times)},
+        "throughput": {"unit": f"{unit_name}/s", "value": units / median if median > 0 else None},
+        "peak_memory_bytes": peak,
+    }
+
+
+def clean_work_dir(keep):
+    for name in os.listdir(WORK_DIR):
+        path = os.path.join(WORK_DIR, name)
+        if path not in keep and os.path.isfile(path):
+            os.remove(path)
+
+
+def run_suite(args):
+    """Запускает все бенчмарки с заданными параметрами синтетических данных"""
+    pages, per_page, size = args.pages, args.images_per_page, args.image_size
+    total_images = pages * per_page
+    ocr_response = make_ocr_response(pages, per_page, size, missing_base64_rate=0.0)
+    payloads = [img.image_base64 for page in ocr_response.pages for img in page.images]
+    result_data = make_result_data(ocr_response, WORK_DIR)
+    # Страницы до и после переписывания ссылок (embedded markdown встраивает ссылки /image/...)
+    raw_pages = copy.deepcopy(result_data["pages"])
+    for page in result_data["pages"]:
+        ocr_app.update_markdown_image_links(page, page["index"], True)
+    pdf_path = make_pdf(os.path.join(WORK_DIR, "synthetic.pdf"), pages, per_page, size)
+    keep = {pdf_path} | {img["path"] for page in result_data["pages"] for img in page["images"]}
+    results = []
+
+    def bench(name, func, units, unit_name, setup=None):
+        if args.only and name not in args.only:
+            return
+        times, peak = measure(func, setup, args.repeat)
+        results.append(summarize(name, times, peak, units, unit_name))
+        clean_work_dir(keep)
+        print(f"{name:32} {statistics.median(times) * 1000:10.2f} ms  peak {peak / 1024:10.1f} KiB", file=sys.stderr)
+
+    bench("validate_ocr_response", lambda: ocr_app.validate_ocr_response(ocr_response), total_images, "images")
+    bench("enhanced_base64_processing",
+          lambda: [ocr_app.enhanced_base64_processing(p, i) for i, p in enumerate(payloads)], total_images, "images")
+    bench("decode_and_write_image",
+          lambda: [ocr_app.write_image_file(os.path.join(WORK_DIR, f"img{i}.png"),
+                                            ocr_app.enhanced_base64_processing(p, i)['data'])
+                   for i, p in enumerate(payloads)],
+          total_images, "images")
+    bench("update_markdown_image_links",
+          lambda pages_copy: [ocr_app.update_markdown_image_links(p, i, True) for i, p in enumerate(pages_copy)],
+          pages, "pages", setup=lambda: (copy.deepcopy(raw_pages),))
+    bench("embedded_markdown",
+          lambda: "".join(ocr_app.iter_markdown_document(result_data["pages"], ocr_app.embedded_page_markdown)),
+          pages, "pages")
+    bench("save_results_to_files (embedded)",
+          lambda: ocr_app.save_results_to_files(result_data, WORK_DIR, True, "embedded"), pages, "pages")
+    bench("save_results_to_files (links)",
+          lambda: ocr_app.save_results_to_files(result_data, WORK_DIR, True, "links"), pages, "pages")
+    # Рендер страниц для режима сравнения: каждый замер - с пустым кэшем страниц
+    render_cache = PageRenderCache(os.path.join(WORK_DIR, "page_cache"), max_size_bytes=1 << 40)
+    render_cache.register_document("synthetic", pdf_path)
+
+    def empty_page_cache():
+        shutil.rmtree(render_cache.pages_dir, ignore_errors=True)
+        os.makedirs(render_cache.pages_dir)
+        return ()
+
+    bench("PageRenderCache.render",
+          lambda: [render_cache.render("synthetic", i, args.dpi) for i in range(pages)], pages, "pages",
+          setup=empty_page_cache)
+    page_targets = {
+        page.index: {
+            "dimensions": page.dimensions.model_dump(),
+            "images": [{"id": img.id, "coordinates": {
+                "top_left_x": img.top_left_x, "top_left_y": img.top_left_y,
+                "bottom_right_x": img.bottom_right_x, "bottom_right_y": img.bottom_right_y}}
+                for img in page.images]
+        }
+        for page in ocr_response.pages
+    }
+    bench("extract_fallback_assets",
+          lambda: extract_fallback_assets(pdf_path, page_targets, WORK_DIR, max_workers=1), total_images, "images")
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before_path, after_path):
+    """Печатает изменение медианного времени и пиковой памяти между двумя прогонами"""
+    with open(before_path, encoding="utf-8") as f:
+        before = {r["name"]: r for r in json.load(f)["results"]}
+    with open(after_path, encoding="utf-8") as f:
+        after = {r["name"]: r for r in json.load(f)["results"]}
+    print(f"{'бенчмарк':32} {'время, мс':>22} {'пик памяти, KiB':>26}")
+    for name, new in after.items():
+        old = before.get(name)
+        if old is None:
+            continue
+        t_old, t_new = old["time_s"]["median"] * 1000, new["time_s"]["median"] * 1000
+        m_old, m_new = old["peak_memory_bytes"] / 1024, new["peak_memory_bytes"] / 1024
+        print(f"{name:32} {t_old:9.2f} -> {t_new:9.2f} {m_old:11.1f} -> {m_new:11.1f}"
+              f"  ({t_old / t_new if t_new else float('inf'):.2f}x)")
+
+
+def main():
+    """Основная функция бенчмарков"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--images-per-page", type=int, default=4)
+    parser.add_argument("--image-size", type=int, default=256, help="сторона изображения в пикселях")
+    parser.add_argument("--dpi", type=int, default=100, help="DPI для PageRenderCache.render")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", nargs="+", help="запустить только указанные бенчмарки")
+    parser.add_argument("--output", help="файл для JSON результатов (по умолчанию stdout)")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="сравнить два JSON файла")
+    args = parser.parse_args()
+
+    try:
+        if args.compare:
+            compare(*args.compare)
+            return
+        logging.disable(logging.WARNING)  # Логи искажают замеры
+        results = run_suite(args)
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {
+                "pages": args.pages, "images_per_page": args.images_per_page,
+                "image_size": args.image_size, "dpi": args.dpi, "repeat": args.repeat,
+            },
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Synthetic Documents for Mistral OCR App benchmarks
+Генерация синтетических PDF и ответов OCR с заданным числом страниц и изображений
+"""
+import base64
+import os
+import random
+
+import fitz  # PyMuPDF
+from mistralai.models import OCRResponse
+
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+RENDER_DPI = 200
+
+
+def make_png(width, height, seed=0):
+    """PNG со случайным шумом (плохо сжимается - размер близок к width * height * 3)"""
+    rng = random.Random(seed)
+    samples = rng.randbytes(width * height * 3)
+    return fitz.Pixmap(fitz.csRGB, width, height, samples, False).tobytes('png')
+
+
+def image_grid(images_per_page):
+    """Прямоугольники размещения изображений на странице (в пунктах PDF)"""
+    columns = max(1, int(images_per_page ** 0.5))
+    rows = (images_per_page + columns - 1) // columns
+    cell_w = (PAGE_WIDTH - 80) / columns
+    cell_h = (PAGE_HEIGHT - 160) / max(rows, 1)
+    rects = []
+    for i in range(images_per_page):
+        row, col = divmod(i, columns)
+        x0 = 40 + col * cell_w
+        y0 = 120 + row * cell_h
+        rects.append(fitz.Rect(x0 + 2, y0 + 2, x0 + cell_w - 2, y0 + cell_h - 2))
+    return rects
+
+
+def make_pdf(path, pages=10, images_per_page=2, image_size=128, seed=0):
+    """Создает PDF: на каждой странице абзац текста и images_per_page разных изображений"""
+    doc = fitz.open()
+    counter = 0
+    for page_num in range(pages):
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        page.insert_text((40, 60), f"Synthetic page {page_num + 1}", fontsize=18)
+        page.insert_text((40, 90), "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 2, fontsize=9)
+        for rect in image_grid(images_per_page):
+            page.insert_image(rect, stream=make_png(image_size, image_size, seed + counter))
+            counter += 1
+    doc.save(path)
+    doc.close()
+    return path
+
+
+def make_ocr_response(pages=10, images_per_page=2, image_size=128, missing_base64_rate=0.0, seed=0):
+    """Ответ OCR в формате Mistral: markdown со ссылками img-N.png и base64 изображения"""
+    rng = random.Random(seed)
+    scale = RENDER_DPI / 72
+    payloads = {}
+    page_dicts = []
+    counter = 0
+    for page_num in range(pages):
+        markdown = [f"# Synthetic page {page_num + 1}", "Lorem ipsum dolor sit amet. " * 20]
+        images = []
+        for rect in image_grid(images_per_page):
+            image_id = f"img-{counter}.png"
+            key = counter % 16  # Ограничиваем число уникальных изображений - генерация шума не бесплатна
+            if key not in payloads:
+                payloads[key] = "data:image/png;base64," + base64.b64encode(
+                    make_png(image_size, image_size, seed + key)).decode('ascii')
+            images.append({
+                "id": image_id,
+                "top_left_x": int(rect.x0 * scale), "top_left_y": int(rect.y0 * scale),
+                "bottom_right_x": int(rect.x1 * scale), "bottom_right_y": int(rect.y1 * scale),
+                "image_base64": None if rng.random() < missing_base64_rate else payloads[key],
+            })
+            markdown.append(f"![{image_id}]({image_id})")
+            counter += 1
+        page_dicts.append({
+            "index": page_num,
+            "markdown": "\n\n".join(markdown),
+            "images": images,
+            "dimensions": {"dpi": RENDER_DPI, "width": int(PAGE_WIDTH * scale), "height": int(PAGE_HEIGHT * scale)},
+        })
+    return OCRResponse.model_validate({
+        "pages": page_dicts,
+        "model": "mistral-ocr-latest",
+        "usage_info": {"pages_processed": pages},
+    })
+
+
+def make_result_data(ocr_response, upload_folder):
+    """Результат обработки (как после mistral_ocr_processing) с изображениями на диске"""
+    pages = []
+    for page in ocr_response.pages:
+        images = []
+        for img in page.images:
+            path = os.path.join(upload_folder, f"page_{page.index}_img_{img.id}.png")
+            if img.image_base64:
+                with open(path, 'wb') as f:
+                    f.write(base64.b64decode(img.image_base64.split(',', 1)[1]))
+            images.append({"id": img.id, "path": path, "image_base64": img.image_base64, "mime_type": "image/png"})
+        pages.append({"index": page.index, "markdown": page.markdown, "images": images})
+    return {"document_url": None, "pages": pages}
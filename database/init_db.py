@@ -96,6 +96,8 @@ def init_database(db_path='settings.db'):
         ('cache_enabled', 'true', 'boolean', 'Enable result caching', 'performance'),
         ('cache_duration_hours', '24', 'integer', 'Cache duration in hours', 'performance'),
         ('parallel_processing', 'false', 'boolean', 'Enable parallel processing', 'performance'),
+        ('chunk_size_pages', '20', 'integer', 'Pages per chunk in parallel PDF processing', 'performance'),
+        ('chunk_concurrency', '4', 'integer', 'Maximum chunks processed concurrently', 'performance'),
         ('memory_limit_mb', '512', 'integer', 'Memory limit in MB', 'performance'),
         
         # Security Settings
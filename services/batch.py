@@ -0,0 +1,231 @@
+"""
+Batch Processing for Mistral OCR App
+Пакетная обработка документов: ограниченное число одновременных задач на пакет,
+статус каждого элемента и выдача результатов по мере готовности
+"""
+import threading
+import time
+import uuid
+import zipfile
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from services.job_queue import JobManager, JobQueueFullError
+
+ITEM_PENDING = 'pending'
+ITEM_RUNNING = 'running'
+ITEM_DONE = 'done'
+ITEM_FAILED = 'failed'
+
+# Подготовка элемента к запуску: (функция задачи, args, kwargs, id каталога задачи)
+PrepareItem = Callable[[], Tuple[Callable[..., Any], tuple, dict, Optional[str]]]
+
+
+class BatchItem:
+    """Один документ пакета: URL или загруженный файл"""
+
+    def __init__(self, index: int, kind: str, source: str, prepare: PrepareItem,
+                 workspace_id: Optional[str] = None):
+        self.index = index
+        self.kind = kind
+        self.source = source
+        self.prepare = prepare
+        self.workspace_id = workspace_id
+        self.job_id: Optional[str] = None
+        self.state = ITEM_PENDING
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (ITEM_DONE, ITEM_FAILED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            'index': self.index,
+            'kind': self.kind,
+            'source': self.source,
+            'state': self.state,
+            'job_id': self.job_id,
+        }
+        if self.started_at is not None and self.finished_at is not None:
+            data['duration_ms'] = round((self.finished_at - self.started_at) * 1000, 1)
+        return data
+
+
+class Batch:
+    """Пакет документов; не более concurrency элементов выполняется одновременно.
+
+    Элементы ставятся в общую очередь задач по одному по мере освобождения слотов,
+    поэтому большой пакет не переполняет очередь и не вытесняет одиночные запросы.
+    Ошибка элемента не прерывает пакет.
+    """
+
+    def __init__(self, batch_id: str, items: List[BatchItem], concurrency: int,
+                 options: Optional[Dict[str, Any]] = None):
+        self.id = batch_id
+        self.items = items
+        self.concurrency = concurrency
+        self.options = options or {}
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._finished_order: List[BatchItem] = []
+        self._slots = threading.Semaphore(concurrency)
+        self._condition = threading.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return len(self._finished_order) == len(self.items)
+
+    def to_dict(self, include_items: bool = True) -> Dict[str, Any]:
+        counts = {ITEM_PENDING: 0, ITEM_RUNNING: 0, ITEM_DONE: 0, ITEM_FAILED: 0}
+        for item in self.items:
+            counts[item.state] += 1
+        data = {
+            'id': self.id,
+            'state': ITEM_DONE if self.finished else ITEM_RUNNING,
+            'total': len(self.items),
+            'concurrency': self.concurrency,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+            **counts,
+        }
+        data.update(self.options)
+        if include_items:
+            data['items'] = [item.to_dict() for item in self.items]
+        return data
+
+    def _run_item(self, item: BatchItem, func: Callable[..., Any], args: tuple, kwargs: dict):
+        """Выполняется в воркере очереди задач"""
+        item.state = ITEM_RUNNING
+        item.started_at = time.time()
+        try:
+            item.result = func(*args, **kwargs)
+            return item.result
+        except Exception as e:
+            item.error = e
+            raise
+        finally:
+            self._finish(item)
+
+    def _finish(self, item: BatchItem):
+        item.finished_at = time.time()
+        item.state = ITEM_FAILED if item.error is not None else ITEM_DONE
+        item.prepare = None  # Замыкание подготовки больше не нужно
+        self._slots.release()
+        with self._condition:
+            self._finished_order.append(item)
+            if self.finished:
+                self.finished_at = time.time()
+            self._condition.notify_all()
+
+    def feed(self, job_manager: JobManager, retry_interval: float = 0.5):
+        """Ставит элементы в очередь задач по мере освобождения слотов (в отдельном потоке)"""
+        for item in self.items:
+            self._slots.acquire()
+            try:
+                func, args, kwargs, item.workspace_id = item.prepare()
+            except Exception as e:
+                item.error = e
+                self._finish(item)
+                continue
+            while True:
+                try:
+                    job = job_manager.submit(self._run_item, item, func, args, kwargs, metadata={
+                        'processing_type': 'batch', 'batch_id': self.id, 'batch_index': item.index,
+                        'workspace': item.workspace_id,
+                    })
+                    item.job_id = job.id
+                    break
+                except JobQueueFullError:
+                    # Общая очередь занята другими запросами - элемент ждет, а не завершается ошибкой
+                    time.sleep(retry_interval)
+
+    def iter_finished(self) -> Iterator[BatchItem]:
+        """Элементы в порядке завершения; ждет незавершенные (каждый вызов - с начала)"""
+        position = 0
+        while True:
+            with self._condition:
+                while position >= len(self._finished_order) and not self.finished:
+                    self._condition.wait()
+                if position >= len(self._finished_order):
+                    return
+                item = self._finished_order[position]
+            position += 1
+            yield item
+
+
+class BatchManager:
+    """Пакеты в памяти процесса; завершенные хранятся retention_seconds секунд"""
+
+    def __init__(self, job_manager: JobManager, retention_seconds: int = 3600):
+        self.job_manager = job_manager
+        self.retention_seconds = retention_seconds
+        self._batches: Dict[str, Batch] = {}
+        self._lock = threading.Lock()
+
+    def _prune(self):
+        now = time.time()
+        for batch_id, batch in list(self._batches.items()):
+            if batch.finished_at is not None and now - batch.finished_at > self.retention_seconds:
+                del self._batches[batch_id]
+
+    def create(self, items: List[BatchItem], concurrency: int,
+               options: Optional[Dict[str, Any]] = None) -> Batch:
+        """Создает пакет и сразу начинает ставить его элементы в очередь"""
+        batch = Batch(uuid.uuid4().hex, items, concurrency, options)
+        with self._lock:
+            self._prune()
+            self._batches[batch.id] = batch
+        threading.Thread(target=batch.feed, args=(self.job_manager,), daemon=True,
+                         name=f"batch-{batch.id[:8]}").start()
+        return batch
+
+    def get(self, batch_id: str) -> Optional[Batch]:
+        with self._lock:
+            return self._batches.get(batch_id)
+
+    def is_active(self, workspace_id: str) -> bool:
+        """Каталог принадлежит незавершенному элементу пакета"""
+        with self._lock:
+            batches = list(self._batches.values())
+        return any(item.workspace_id == workspace_id and not item.finished
+                   for batch in batches for item in batch.items)
+
+
+class _ZipStreamBuffer:
+    """Приемник для zipfile без seek/tell: записанные байты забираются по мере готовности"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_zip_stream(entries: Iterable[Tuple[str, Iterable[bytes]]]) -> Iterator[bytes]:
+    """Потоковый ZIP из (имя, части содержимого): записи сжимаются и отдаются по мере
+    формирования, архив целиком в памяти не собирается (размеры пишутся в data descriptor)"""
+    buffer = _ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, chunks in entries:
+            with archive.open(name, 'w', force_zip64=True) as entry:
+                for chunk in chunks:
+                    entry.write(chunk)
+                    data = buffer.take()
+                    if data:
+                        yield data
+            data = buffer.take()
+            if data:
+                yield data
+    yield buffer.take()
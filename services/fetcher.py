@@ -0,0 +1,327 @@
+"""
+Document Fetcher for Mistral OCR App
+Скачивание документов по URL: общий пул соединений, лимит размера при чтении потока,
+SHA-256 во время загрузки, параллельная загрузка диапазонами (Range)
+и дисковый кэш с условными запросами (ETag / If-Modified-Since)
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from services.result_cache import compute_file_sha256
+from services.workspace import TMP_MARKER, atomic_path, atomic_write
+
+CONTENT_RANGE_RE = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+
+
+class DocumentTooLargeError(Exception):
+    """Документ превышает допустимый размер"""
+
+
+class RangeRequestError(Exception):
+    """Сервер не выполнил запрос диапазона (ответ 200 вместо 206 или документ изменился)"""
+
+
+class FetchResult:
+    """Результат загрузки: путь, SHA-256 и размер содержимого.
+
+    not_modified - сервер ответил 304 и содержимое взято из кэша URL;
+    downloaded_bytes - байты, фактически полученные по сети.
+    """
+
+    def __init__(self, path: str, sha256: str, size: int, content_type: Optional[str],
+                 not_modified: bool = False, downloaded_bytes: int = 0):
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        self.content_type = content_type
+        self.not_modified = not_modified
+        self.downloaded_bytes = downloaded_bytes
+
+
+class DocumentFetcher:
+    """Загрузчик документов с общим requests.Session.
+
+    Соединения переиспользуются (keep-alive); на каждый хост открывается не более
+    pool_size соединений, остальные запросы ждут освобождения. Ответы с ETag или
+    Last-Modified сохраняются в cache_dir (тела - по SHA-256, одно на содержимое);
+    повторный запрос того же URL отправляется условным, и при 304 файл берется из кэша
+    без загрузки и повторного хэширования. cache_max_bytes=0 отключает кэш.
+
+    Если сервер поддерживает Range и документ не меньше range_min_bytes, тело делится
+    на range_parts диапазонов, которые загружаются параллельно в заранее выделенный файл;
+    неудавшийся диапазон докачивается с места обрыва (до range_retries повторов).
+    Без поддержки Range документ загружается одним потоком.
+    """
+
+    def __init__(self, max_bytes: int, cache_dir: Optional[str] = None, cache_max_bytes: int = 0,
+                 chunk_size: int = 1024 * 1024, pool_size: int = 10, timeout: float = 30,
+                 range_parts: int = 4, range_min_bytes: int = 8 * 1024 * 1024, range_retries: int = 3):
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.range_parts = range_parts
+        self.range_min_bytes = range_min_bytes
+        self.range_retries = range_retries
+        self.cache_dir = cache_dir if cache_dir and cache_max_bytes > 0 else None
+        self.cache_max_bytes = cache_max_bytes
+        self._lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if self.cache_dir:
+            os.makedirs(os.path.join(self.cache_dir, 'entries'), exist_ok=True)
+            os.makedirs(os.path.join(self.cache_dir, 'bodies'), exist_ok=True)
+
+    # --- Кэш URL ---
+
+    def _entry_path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, 'entries', hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def _body_path(self, sha256: str) -> str:
+        return os.path.join(self.cache_dir, 'bodies', sha256)
+
+    def _load_entry(self, url: str) -> Optional[dict]:
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._entry_path(url), encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('url') != url or not os.path.exists(self._body_path(entry.get('sha256', ''))):
+            return None
+        return entry
+
+    def _store_entry(self, url: str, response, path: str, sha256: str, size: int):
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not self.cache_dir or not (etag or last_modified) or size > self.cache_max_bytes:
+            return
+        body_path = self._body_path(sha256)
+        if not os.path.exists(body_path):
+            self._link_or_copy(path, body_path)
+        atomic_write(self._entry_path(url), json.dumps({
+            'url': url, 'etag': etag, 'last_modified': last_modified, 'sha256': sha256, 'size': size,
+            'content_type': response.headers.get('Content-Type'), 'fetched_at': time.time(),
+        }))
+        self._evict()
+
+    @staticmethod
+    def _link_or_copy(source: str, target: str):
+        """Жесткая ссылка, если возможно, иначе копия (атомарно)"""
+        with atomic_path(target) as tmp_path:
+            try:
+                os.link(source, tmp_path)
+            except OSError:
+                shutil.copyfile(source, tmp_path)
+
+    @staticmethod
+    def _touch(path: str):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        """Удаляет давно не использованные тела и их записи, пока кэш больше лимита"""
+        with self._lock:
+            bodies_dir = os.path.join(self.cache_dir, 'bodies')
+            entries = []
+            total = 0
+            for name in os.listdir(bodies_dir):
+                if TMP_MARKER in name:
+                    continue
+                try:
+                    stat = os.stat(os.path.join(bodies_dir, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+                total += stat.st_size
+            if total <= self.cache_max_bytes:
+                return
+            for _, size, name in sorted(entries):
+                if total <= self.cache_max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(bodies_dir, name))
+                    total -= size
+                except OSError:
+                    pass
+            # Записи без тела больше не используются (_load_entry их пропускает) - удаляем
+            entries_dir = os.path.join(self.cache_dir, 'entries')
+            for name in os.listdir(entries_dir):
+                path = os.path.join(entries_dir, name)
+                try:
+                    with open(path, encoding='utf-8') as f:
+                        sha256 = json.load(f).get('sha256', '')
+                    if not os.path.exists(self._body_path(sha256)):
+                        os.remove(path)
+                except (OSError, ValueError):
+                    continue
+
+    # --- Загрузка ---
+
+    def fetch(self, url: str, save_path: str) -> FetchResult:
+        """Сохраняет документ по URL в save_path.
+
+        Исключения: requests.RequestException - ошибка сети или HTTP-статус,
+        DocumentTooLargeError - размер больше max_bytes (по заголовкам или по факту).
+        """
+        entry = self._load_entry(url)
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        if self.range_parts > 1:
+            # Открытый диапазон: ответ 206 сообщает полный размер и поддержку Range без отдельного HEAD
+            headers['Range'] = 'bytes=0-'
+
+        with self.session.get(url, stream=True, timeout=self.timeout, headers=headers) as response:
+            if entry and response.status_code == 304:
+                body_path = self._body_path(entry['sha256'])
+                self._link_or_copy(body_path, save_path)
+                self._touch(body_path)
+                return FetchResult(save_path, entry['sha256'], entry['size'], entry.get('content_type'),
+                                   not_modified=True)
+            response.raise_for_status()
+
+            total = self._range_total(response)
+            if total is not None and total >= max(self.range_min_bytes, 2):
+                try:
+                    sha256, size = self._download_ranges(url, response, total, save_path)
+                except RangeRequestError:
+                    # Сервер перестал выполнять запросы диапазонов - загружаем заново одним потоком
+                    return self._fetch_single(url, save_path)
+            else:
+                sha256, size = self._stream_to_file(response, save_path)
+            return self._finish(url, response, save_path, sha256, size)
+
+    def _fetch_single(self, url: str, save_path: str) -> FetchResult:
+        with self.session.get(url, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            sha256, size = self._stream_to_file(response, save_path)
+            return self._finish(url, response, save_path, sha256, size)
+
+    def _finish(self, url: str, response, save_path: str, sha256: str, size: int) -> FetchResult:
+        try:
+            self._store_entry(url, response, save_path, sha256, size)
+        except OSError:
+            pass  # Кэш URL - оптимизация, ошибка записи не мешает обработке
+        return FetchResult(save_path, sha256, size, response.headers.get('Content-Type'),
+                           downloaded_bytes=size)
+
+    def _stream_to_file(self, response, save_path: str) -> Tuple[str, int]:
+        """Пишет тело ответа в save_path одним потоком, считая SHA-256; возвращает (хэш, размер)"""
+        content_length = response.headers.get('Content-Length')
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            raise DocumentTooLargeError(f"Content-Length {content_length} > {self.max_bytes}")
+
+        digest = hashlib.sha256()
+        size = 0
+        with atomic_path(save_path) as tmp_path:
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    size += len(chunk)
+                    # Лимит проверяется по факту: Content-Length может отсутствовать (chunked)
+                    if size > self.max_bytes:
+                        raise DocumentTooLargeError(f"более {self.max_bytes} байт")
+                    digest.update(chunk)
+                    f.write(chunk)
+        return digest.hexdigest(), size
+
+    @staticmethod
+    def _range_total(response) -> Optional[int]:
+        """Полный размер документа из ответа 206 на диапазон с нулевой позиции; None - Range не поддерживается"""
+        if response.status_code != 206:
+            return None
+        match = CONTENT_RANGE_RE.fullmatch(response.headers.get('Content-Range', '').strip())
+        if not match or int(match.group(1)) != 0:
+            return None
+        return int(match.group(3))
+
+    @staticmethod
+    def _range_validator(response) -> Optional[str]:
+        """Значение If-Range: сильный ETag или Last-Modified (части одной версии документа)"""
+        etag = response.headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return response.headers.get('Last-Modified')
+
+    def _download_ranges(self, url: str, first_response, total: int, save_path: str) -> Tuple[str, int]:
+        """Параллельная загрузка диапазонами; первая часть читается из уже открытого ответа"""
+        if total > self.max_bytes:
+            raise DocumentTooLargeError(f"Content-Range {total} > {self.max_bytes}")
+        part_size = -(-total // self.range_parts)
+        ranges = [(start, min(start + part_size, total)) for start in range(0, total, part_size)]
+        validator = self._range_validator(first_response)
+
+        with atomic_path(save_path) as tmp_path:
+            with open(tmp_path, 'wb') as f:
+                f.truncate(total)  # Файл выделяется заранее, части пишутся по своим смещениям
+            with ThreadPoolExecutor(max_workers=len(ranges) - 1, thread_name_prefix='range-fetch') as executor:
+                futures = [executor.submit(self._download_range, url, tmp_path, start, end, validator)
+                           for start, end in ranges[1:]]
+                position = self._copy_range(first_response, tmp_path, 0, ranges[0][1])
+                # Соединение освобождается сразу: остаток тела относится к другим диапазонам
+                first_response.close()
+                self._download_range(url, tmp_path, position, ranges[0][1], validator)
+                for future in futures:
+                    future.result()
+            # Части пришли не по порядку, поэтому хэш считается по готовому файлу (он в кэше ОС)
+            sha256 = compute_file_sha256(tmp_path)
+        return sha256, total
+
+    def _copy_range(self, response, path: str, start: int, end: int) -> int:
+        """Пишет тело ответа в path с позиции start, не дальше end; возвращает достигнутую позицию"""
+        position = start
+        with open(path, 'r+b') as f:
+            f.seek(start)
+            try:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    chunk = chunk[:end - position]
+                    f.write(chunk)
+                    position += len(chunk)
+                    if position >= end:
+                        break
+            except requests.RequestException:
+                pass  # Остаток докачивается повторным запросом с текущей позиции
+        return position
+
+    def _download_range(self, url: str, path: str, start: int, end: int, validator: Optional[str]):
+        """Загружает байты [start, end) с повторами; каждый повтор продолжает с места обрыва"""
+        position = start
+        attempt = 0
+        while position < end:
+            if attempt > self.range_retries:
+                raise requests.ConnectionError(
+                    f"Диапазон {start}-{end - 1} не загружен после {self.range_retries + 1} попыток")
+            if attempt:
+                time.sleep(min(2.0, 0.1 * 2 ** attempt))
+            attempt += 1
+            headers = {'Range': f"bytes={position}-{end - 1}"}
+            if validator:
+                headers['If-Range'] = validator
+            try:
+                with self.session.get(url, stream=True, timeout=self.timeout, headers=headers) as response:
+                    if response.status_code in (200, 416):
+                        raise RangeRequestError(f"HTTP {response.status_code} на запрос диапазона")
+                    response.raise_for_status()
+                    match = CONTENT_RANGE_RE.fullmatch(response.headers.get('Content-Range', '').strip())
+                    if response.status_code != 206 or not match or int(match.group(1)) != position:
+                        raise RangeRequestError(f"Неожиданный ответ на запрос диапазона {position}-{end - 1}")
+                    position = self._copy_range(response, path, position, end)
+            except requests.RequestException:
+                continue
@@ -0,0 +1,85 @@
+"""
+Mistral File Registry for Mistral OCR App
+Хранит соответствие SHA-256 документа и file_id, уже загруженного в Mistral
+"""
+import hashlib
+import os
+import sqlite3
+import time
+from typing import Optional
+
+
+class MistralFileRegistry:
+    """Персистентный реестр загруженных в Mistral файлов.
+
+    Ключ - хэш содержимого документа и отпечаток API-ключа (файлы одного
+    аккаунта недоступны другому). Записи живут ``ttl_seconds`` секунд.
+    """
+
+    def __init__(self, db_path: str, ttl_seconds: int = 24 * 3600):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._init_db()
+
+    def _get_connection(self):
+        """Get database connection"""
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _init_db(self):
+        conn = self._get_connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS mistral_files (
+                document_hash TEXT NOT NULL,
+                account TEXT NOT NULL,
+                file_id TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (document_hash, account)
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def account_fingerprint(api_key: str, server_url: Optional[str] = None) -> str:
+        """Отпечаток аккаунта (API-ключ не хранится в открытом виде)"""
+        raw = f"{server_url or ''}|{api_key or ''}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:16]
+
+    def lookup(self, document_hash: str, account: str) -> Optional[str]:
+        """Возвращает действующий file_id или None"""
+        conn = self._get_connection()
+        try:
+            row = conn.execute('''
+                SELECT file_id FROM mistral_files
+                WHERE document_hash = ? AND account = ? AND expires_at > ?
+            ''', (document_hash, account, time.time())).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+    def remember(self, document_hash: str, account: str, file_id: str):
+        """Сохраняет file_id загруженного документа"""
+        conn = self._get_connection()
+        try:
+            now = time.time()
+            conn.execute('DELETE FROM mistral_files WHERE expires_at <= ?', (now,))
+            conn.execute('''
+                INSERT OR REPLACE INTO mistral_files (document_hash, account, file_id, expires_at)
+                VALUES (?, ?, ?, ?)
+            ''', (document_hash, account, file_id, now + self.ttl_seconds))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def forget(self, document_hash: str, account: str):
+        """Удаляет запись (например, если файл удален на стороне Mistral)"""
+        conn = self._get_connection()
+        try:
+            conn.execute('DELETE FROM mistral_files WHERE document_hash = ? AND account = ?',
+                         (document_hash, account))
+            conn.commit()
+        finally:
+            conn.close()
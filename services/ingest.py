@@ -0,0 +1,124 @@
+"""
+Upload Ingestion for Mistral OCR App
+Потоковый прием загружаемых файлов: запись на диск за один проход по данным,
+SHA-256 и размер во время записи, тип по сигнатуре первых байтов
+"""
+import hashlib
+import io
+import os
+import shutil
+import uuid
+from typing import BinaryIO, Optional
+
+from services.fetcher import DocumentTooLargeError
+from services.workspace import TMP_MARKER
+
+MAGIC_SIGNATURES = (
+    (b'%PDF-', 'pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'PK\x03\x04', 'zip'),  # docx и другие форматы Office Open XML
+)
+SNIFF_BYTES = max(len(signature) for signature, _ in MAGIC_SIGNATURES)
+
+# Типы содержимого, допустимые для расширения (PNG и JPEG часто путают в именах файлов)
+EXTENSION_TYPES = {
+    'pdf': {'pdf'},
+    'png': {'png', 'jpeg'},
+    'jpg': {'png', 'jpeg'},
+    'jpeg': {'png', 'jpeg'},
+    'docx': {'zip'},
+}
+
+
+def sniff_file_type(head: bytes) -> Optional[str]:
+    """Тип файла по первым байтам ('pdf', 'png', 'jpeg', 'zip') или None"""
+    for signature, file_type in MAGIC_SIGNATURES:
+        if head.startswith(signature):
+            return file_type
+    return None
+
+
+def content_matches_extension(filename: str, detected_type: Optional[str]) -> bool:
+    """Совпадает ли содержимое с расширением; расширения без известной сигнатуры не проверяются"""
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    expected = EXTENSION_TYPES.get(extension)
+    return expected is None or detected_type in expected
+
+
+class IngestedFile:
+    """Файл загрузки, который парсер multipart пишет сразу на диск.
+
+    Во время записи считаются SHA-256 и размер, по первым байтам определяется тип;
+    превышение max_bytes прерывает прием (DocumentTooLargeError) без дочитывания тела.
+    claim() переносит файл на постоянное место (rename в пределах файловой системы)
+    и передает открытый файл дальше, close() без claim() удаляет его.
+    """
+
+    def __init__(self, spool_dir: str, max_bytes: int):
+        os.makedirs(spool_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.path: Optional[str] = os.path.join(spool_dir, f"upload{TMP_MARKER}{uuid.uuid4().hex}")
+        self._file = open(self.path, 'w+b')
+        self._digest = hashlib.sha256()
+        self._head = b''
+
+    @property
+    def sha256(self) -> str:
+        return self._digest.hexdigest()
+
+    @property
+    def detected_type(self) -> Optional[str]:
+        return sniff_file_type(self._head)
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            # Парсер не вернет файл после ошибки - частично принятые данные удаляются сразу
+            self.close()
+            raise DocumentTooLargeError(f"более {self.max_bytes} байт")
+        if len(self._head) < SNIFF_BYTES:
+            self._head += bytes(data[:SNIFF_BYTES - len(self._head)])
+        self._digest.update(data)
+        return self._file.write(data)
+
+    # Остальной интерфейс файла нужен werkzeug.FileStorage
+    def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+    def readline(self, size: int = -1) -> bytes:
+        return self._file.readline(size)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def flush(self):
+        self._file.flush()
+
+    def claim(self, target_path: str) -> BinaryIO:
+        """Переносит принятый файл в target_path без копирования данных.
+
+        Возвращает открытый файл (с позиции 0): загрузка в Mistral читает его без
+        повторного открытия по пути. Закрывает файл получатель.
+        """
+        self._file.flush()
+        shutil.move(self.path, target_path)
+        self.path = None
+        # Тот же дескриптор, но как BufferedReader - такой тип содержимого принимает files.upload SDK
+        raw, self._file = self._file.detach(), None
+        raw.seek(0)
+        return io.BufferedReader(raw)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        if self.path:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.path = None
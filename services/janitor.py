@@ -0,0 +1,142 @@
+"""
+Artifact Janitor for Mistral OCR App
+Фоновая очистка каталогов задач: срок хранения, лимит диска и вытеснение давно не отдававшихся
+"""
+import os
+import shutil
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from services.workspace import WORKSPACE_ID_RE, marker_is_fresh
+
+
+def _directory_size(path: str) -> int:
+    total = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file(follow_symlinks=False):
+                        total += entry.stat(follow_symlinks=False).st_size
+                    elif entry.is_dir(follow_symlinks=False):
+                        total += _directory_size(entry.path)
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return total
+
+
+class ArtifactJanitor:
+    """Удаляет каталоги задач в root_dir целиком (markdown ссылается на изображения задачи).
+
+    Время последнего использования каталога - его mtime: он меняется при создании файлов
+    задачи и при отдаче файлов через touch(). За проход удаляются каталоги старше
+    max_age_seconds, затем, пока суммарный размер больше max_total_bytes, - наименее
+    давно использованные. Не удаляются каталоги выполняющихся задач: этого процесса
+    (is_active) и любых других (маркер job.active, обновленный за последние
+    active_marker_max_age секунд), а также использованные за последние min_idle_seconds.
+    Значение 0 отключает соответствующее ограничение.
+    """
+
+    def __init__(self, root_dir: str, max_age_seconds: float = 0, max_total_bytes: int = 0,
+                 interval_seconds: float = 300, min_idle_seconds: float = 300,
+                 active_marker_max_age: float = 120,
+                 is_active: Optional[Callable[[str], bool]] = None,
+                 on_sweep: Optional[Callable[[Dict[str, int]], None]] = None):
+        self.root_dir = os.path.abspath(root_dir)
+        self.max_age_seconds = max_age_seconds
+        self.max_total_bytes = max_total_bytes
+        self.interval_seconds = interval_seconds
+        self.min_idle_seconds = min_idle_seconds
+        self.active_marker_max_age = active_marker_max_age
+        self.is_active = is_active or (lambda workspace_id: False)
+        self.on_sweep = on_sweep
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def touch(self, path: str):
+        """Отмечает использование каталога задачи, которому принадлежит файл path"""
+        workspace_dir = os.path.dirname(os.path.abspath(path))
+        if (os.path.dirname(workspace_dir) == self.root_dir
+                and WORKSPACE_ID_RE.fullmatch(os.path.basename(workspace_dir))):
+            try:
+                os.utime(workspace_dir)
+            except OSError:
+                pass
+
+    def _workspaces(self):
+        """[(mtime, размер, id, путь)] каталогов задач"""
+        workspaces = []
+        try:
+            entries = list(os.scandir(self.root_dir))
+        except OSError:
+            return workspaces
+        for entry in entries:
+            if not WORKSPACE_ID_RE.fullmatch(entry.name):
+                continue
+            try:
+                if not entry.is_dir(follow_symlinks=False):
+                    continue
+                mtime = entry.stat(follow_symlinks=False).st_mtime
+            except OSError:
+                continue
+            workspaces.append((mtime, _directory_size(entry.path), entry.name, entry.path))
+        return workspaces
+
+    def sweep(self) -> Dict[str, int]:
+        """Один проход очистки; возвращает число удаленных каталогов и освобожденные байты"""
+        with self._lock:
+            now = time.time()
+            stats = {'expired': 0, 'evicted': 0, 'freed_bytes': 0, 'total_bytes': 0, 'workspaces': 0}
+            remaining = []
+            for mtime, size, workspace_id, path in sorted(self._workspaces()):
+                if (now - mtime < self.min_idle_seconds
+                        or marker_is_fresh(path, self.active_marker_max_age, now)
+                        or self.is_active(workspace_id)):
+                    remaining.append((mtime, size, workspace_id, path, False))
+                elif self.max_age_seconds and now - mtime > self.max_age_seconds:
+                    shutil.rmtree(path, ignore_errors=True)
+                    stats['expired'] += 1
+                    stats['freed_bytes'] += size
+                else:
+                    remaining.append((mtime, size, workspace_id, path, True))
+
+            total = sum(item[1] for item in remaining)
+            if self.max_total_bytes and total > self.max_total_bytes:
+                # remaining отсортирован по mtime: первыми вытесняются давно не использованные
+                for mtime, size, workspace_id, path, evictable in remaining:
+                    if total <= self.max_total_bytes:
+                        break
+                    if not evictable:
+                        continue
+                    shutil.rmtree(path, ignore_errors=True)
+                    total -= size
+                    stats['evicted'] += 1
+                    stats['freed_bytes'] += size
+            stats['total_bytes'] = total
+            stats['workspaces'] = len(remaining) - stats['evicted']
+        if self.on_sweep:
+            self.on_sweep(stats)
+        return stats
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval_seconds):
+            try:
+                self.sweep()
+            except Exception:
+                pass  # Ошибка прохода не должна останавливать фоновый поток
+
+    def start(self):
+        """Запускает периодическую очистку в фоновом потоке"""
+        if self._thread is None and self.interval_seconds > 0:
+            self._thread = threading.Thread(target=self._run, daemon=True, name='artifact-janitor')
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
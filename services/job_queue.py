@@ -0,0 +1,118 @@
+"""
+Job Queue for Mistral OCR App
+Фоновое выполнение OCR задач в ограниченном пуле потоков
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+class JobQueueFullError(Exception):
+    """Очередь задач переполнена"""
+
+
+class Job:
+    """Состояние одной фоновой задачи"""
+
+    def __init__(self, job_id: str, metadata: Optional[Dict[str, Any]] = None):
+        self.id = job_id
+        self.state = JOB_QUEUED
+        self.metadata = metadata or {}
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._done = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Ожидает завершения задачи, возвращает True если задача завершилась"""
+        return self._done.wait(timeout)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Сериализует статус задачи (без результата)"""
+        data = {
+            'id': self.id,
+            'state': self.state,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+        data.update(self.metadata)
+        if self.error is not None:
+            data['error'] = str(self.error)
+        return data
+
+
+class JobManager:
+    """Пул потоков с ограниченным числом воркеров и ограниченной очередью.
+
+    Завершенные задачи хранятся в памяти ``retention_seconds`` секунд,
+    после чего удаляются при следующей постановке задачи.
+    """
+
+    def __init__(self, max_workers: int = 4, max_pending: int = 100,
+                 retention_seconds: int = 3600):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='ocr-job')
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, func: Callable[..., Any], *args,
+               metadata: Optional[Dict[str, Any]] = None, **kwargs) -> Job:
+        """Ставит задачу в очередь и сразу возвращает объект Job"""
+        with self._lock:
+            self._prune()
+            pending = sum(1 for job in self._jobs.values() if not job.finished)
+            if pending >= self.max_pending:
+                raise JobQueueFullError(f"Очередь задач переполнена ({pending} задач в обработке)")
+            job = Job(uuid.uuid4().hex, metadata)
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def _run(self, job: Job, func: Callable[..., Any], args, kwargs):
+        job.state = JOB_RUNNING
+        job.started_at = time.time()
+        try:
+            job.result = func(*args, **kwargs)
+            job.state = JOB_DONE
+        except BaseException as e:  # noqa: B902 - ошибка сохраняется в задаче
+            job.error = e
+            job.state = JOB_FAILED
+        finally:
+            job.finished_at = time.time()
+            job._done.set()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _prune(self):
+        """Удаляет завершенные задачи старше retention_seconds (вызывается под блокировкой)"""
+        cutoff = time.time() - self.retention_seconds
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
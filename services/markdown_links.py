@@ -0,0 +1,94 @@
+"""
+Markdown Image Links for Mistral OCR App
+Однопроходная замена ссылок на изображения в markdown через таблицу соответствий
+"""
+import re
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from services.workspace import artifact_ref
+
+# ![alt](ref) - ссылки без пробелов и закрывающей скобки (id API, /image/..., data URL)
+IMAGE_LINK_RE = re.compile(r'!\[([^\]]*)\]\(([^)\s]+)\)')
+
+# Ссылки с такими расширениями считаются ссылками на изображения из ответа OCR
+IMAGE_REF_EXTENSIONS = ('.jpeg', '.jpg', '.png', '.gif', '.webp', '.svg')
+
+
+def image_url_for_path(path: str) -> str:
+    """URL сохраненного изображения (маршрут /image/<workspace_id>/<filename>)"""
+    return f"/image/{artifact_ref(path)}"
+
+
+def rewrite_image_links(markdown: str, resolve: Callable[[str], Optional[str]]) -> Tuple[str, int]:
+    """Заменяет ссылки на изображения за один проход регулярного выражения.
+
+    resolve(ref) возвращает новую ссылку или None, если ссылку нужно оставить.
+    Возвращает (новый markdown, число замен).
+    """
+    replaced = 0
+
+    def _replace(match):
+        nonlocal replaced
+        new_ref = resolve(match.group(2))
+        if new_ref is None or new_ref == match.group(2):
+            return match.group(0)
+        replaced += 1
+        return f"![{match.group(1)}]({new_ref})"
+
+    return IMAGE_LINK_RE.sub(_replace, markdown), replaced
+
+
+def _is_ocr_image_ref(ref: str) -> bool:
+    return (not ref.startswith('data:') and '://' not in ref
+            and ref.lower().endswith(IMAGE_REF_EXTENSIONS))
+
+
+def page_image_resolver(images: Iterable[dict], markdown: str = '') -> Callable[[str], Optional[str]]:
+    """Таблица соответствий ссылок markdown страницы и сохраненных изображений.
+
+    Ссылка разрешается по id изображения API; уже переписанные ссылки /image/...
+    остаются на месте; остальные ссылки на изображения получают следующее
+    по порядку изображение, на которое markdown не ссылается напрямую
+    (как k-я ссылка - k-е изображение).
+    """
+    referenced = {match.group(2) for match in IMAGE_LINK_RE.finditer(markdown)}
+    saved = [img for img in images if img.get('path')]
+    by_id: Dict[str, str] = {}
+    by_url: Dict[str, dict] = {}
+    for img in saved:
+        url = image_url_for_path(img['path'])
+        by_url[url] = img
+        if img.get('id') is not None:
+            by_id.setdefault(str(img['id']), url)
+    used = {id(by_url[ref]) for ref in referenced if ref in by_url}
+    used.update(id(by_url[by_id[ref]]) for ref in referenced if ref in by_id)
+    unused = iter(saved)
+
+    def resolve(ref: str) -> Optional[str]:
+        if ref in by_url:
+            return None
+        if ref in by_id:
+            return by_id[ref]
+        if not _is_ocr_image_ref(ref):
+            return None
+        for img in unused:
+            if id(img) not in used:
+                used.add(id(img))
+                return image_url_for_path(img['path'])
+        return None
+
+    return resolve
+
+
+def restored_image_resolver(paths_by_name: Dict[str, str]) -> Callable[[str], Optional[str]]:
+    """Ссылки /image/<workspace_id>/<имя> на файлы, восстановленные в другой каталог.
+
+    paths_by_name - новые пути по имени файла; ссылки на другие файлы не меняются.
+    """
+    def resolve(ref: str) -> Optional[str]:
+        if not ref.startswith('/image/'):
+            return None
+        path = paths_by_name.get(ref.rsplit('/', 1)[-1])
+        return image_url_for_path(path) if path else None
+
+    return resolve
@@ -0,0 +1,221 @@
+"""
+Metrics Registry for Mistral OCR App
+Счетчики, гистограммы и gauge в формате Prometheus, общие для всех процессов (sqlite)
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _format_labels(labels: Optional[Dict[str, str]]) -> str:
+    if not labels:
+        return ''
+    parts = []
+    for key in sorted(labels):
+        value = str(labels[key]).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return ','.join(parts)
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class MetricsBatch:
+    """Набор изменений метрик, записываемый одной транзакцией"""
+
+    def __init__(self):
+        self.ops: List[Tuple] = []
+        self.local_gauges: List[Tuple[str, str]] = []
+
+    def inc(self, name: str, value: float = 1, labels: Optional[Dict[str, str]] = None):
+        """Увеличивает счетчик"""
+        label_str = _format_labels(labels)
+        self.ops.append((name, COUNTER, name, label_str, label_str, None, 0, value))
+
+    def local_gauge(self, name: str, labels: Optional[Dict[str, str]] = None):
+        """Записывает текущее значение gauge процесса из памяти (MetricsRegistry.gauge_add)"""
+        self.local_gauges.append((name, _format_labels(labels)))
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None,
+                buckets: Iterable[float] = DEFAULT_BUCKETS):
+        """Добавляет наблюдение в гистограмму (кумулятивные bucket, _sum и _count)"""
+        label_str = _format_labels(labels)
+        for bound in buckets:
+            if value <= bound:
+                bucket_labels = _format_labels({**(labels or {}), 'le': _format_value(bound)})
+                self.ops.append((name, HISTOGRAM, f"{name}_bucket", bucket_labels, label_str, float(bound), 0, 1))
+        inf_labels = _format_labels({**(labels or {}), 'le': '+Inf'})
+        self.ops.append((name, HISTOGRAM, f"{name}_bucket", inf_labels, label_str, float('inf'), 0, 1))
+        self.ops.append((name, HISTOGRAM, f"{name}_sum", label_str, label_str, None, 0, value))
+        self.ops.append((name, HISTOGRAM, f"{name}_count", label_str, label_str, None, 0, 1))
+
+
+class MetricsRegistry:
+    """Метрики приложения в общей sqlite базе.
+
+    Все процессы WSGI-сервера пишут в один файл, поэтому /metrics в любом воркере
+    отдает агрегированные значения. Gauge хранятся отдельно для каждого процесса;
+    значения завершившихся процессов удаляются при выводе. Значение gauge процесса
+    ведется в памяти и записывается в базу целиком (не приращением), поэтому запись
+    в конце запроса можно объединить с остальными метриками (MetricsBatch.local_gauge).
+    """
+
+    def __init__(self, db_path: str, enabled: bool = True):
+        self.db_path = db_path
+        self.enabled = enabled
+        self._descriptions: Dict[str, str] = {}
+        self._local_gauges: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+        if enabled:
+            db_dir = os.path.dirname(db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            self._init_db()
+
+    def _get_connection(self):
+        """Get database connection"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        # В режиме WAL NORMAL не делает fsync на каждый commit: сбой питания может
+        # потерять последние приращения, но не повредить базу
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _init_db(self):
+        conn = self._get_connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS metric_samples (
+                family TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                sample TEXT NOT NULL,
+                labels TEXT NOT NULL,
+                series TEXT NOT NULL,
+                le REAL,
+                pid INTEGER NOT NULL,
+                value REAL NOT NULL,
+                PRIMARY KEY (sample, labels, pid)
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+    def describe(self, name: str, help_text: str):
+        """Задает текст # HELP для метрики"""
+        self._descriptions[name] = help_text
+
+    @contextmanager
+    def batch(self):
+        """Собирает изменения и записывает их одной транзакцией при выходе"""
+        batch = MetricsBatch()
+        yield batch
+        self.apply(batch.ops, batch.local_gauges)
+
+    @staticmethod
+    def _write(conn, ops: List[Tuple], sets: List[Tuple]):
+        if ops:
+            conn.executemany('''
+                INSERT INTO metric_samples (family, kind, sample, labels, series, le, pid, value)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (sample, labels, pid) DO UPDATE SET value = value + excluded.value
+            ''', ops)
+        if sets:
+            conn.executemany('''
+                INSERT INTO metric_samples (family, kind, sample, labels, series, le, pid, value)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (sample, labels, pid) DO UPDATE SET value = excluded.value
+            ''', sets)
+
+    def apply(self, ops: List[Tuple], local_gauges: List[Tuple[str, str]] = ()):
+        if not self.enabled or not (ops or local_gauges):
+            return
+        with self._lock:
+            # Значения gauge берутся под блокировкой: при параллельных запросах процесса
+            # последняя запись в базу всегда содержит последнее значение
+            pid = os.getpid()
+            sets = [(name, GAUGE, name, label_str, label_str, None, pid, self._local_gauges.get((name, label_str), 0))
+                    for name, label_str in local_gauges]
+            conn = self._get_connection()
+            try:
+                self._write(conn, ops, sets)
+                conn.commit()
+            finally:
+                conn.close()
+
+    def local_gauge_add(self, name: str, delta: float, labels: Optional[Dict[str, str]] = None) -> float:
+        """Изменяет gauge текущего процесса только в памяти; возвращает новое значение.
+
+        Значение попадает в базу через MetricsBatch.local_gauge.
+        """
+        key = (name, _format_labels(labels))
+        with self._lock:
+            value = self._local_gauges.get(key, 0) + delta
+            self._local_gauges[key] = value
+            return value
+
+    def gauge_add(self, name: str, delta: float, labels: Optional[Dict[str, str]] = None):
+        """Изменяет gauge текущего процесса и сразу записывает его значение в базу"""
+        self.local_gauge_add(name, delta, labels)
+        with self.batch() as batch:
+            batch.local_gauge(name, labels)
+
+    def inc(self, name: str, value: float = 1, labels: Optional[Dict[str, str]] = None):
+        with self.batch() as batch:
+            batch.inc(name, value, labels)
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None,
+                buckets: Iterable[float] = DEFAULT_BUCKETS):
+        with self.batch() as batch:
+            batch.observe(name, value, labels, buckets)
+
+    @staticmethod
+    def _pid_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def render(self) -> str:
+        """Текстовый формат экспозиции Prometheus"""
+        if not self.enabled:
+            return ''
+        conn = self._get_connection()
+        try:
+            gauge_pids = [row[0] for row in conn.execute(
+                'SELECT DISTINCT pid FROM metric_samples WHERE kind = ?', (GAUGE,))]
+            dead = [pid for pid in gauge_pids if pid != os.getpid() and not self._pid_alive(pid)]
+            if dead:
+                conn.executemany('DELETE FROM metric_samples WHERE kind = ? AND pid = ?',
+                                 [(GAUGE, pid) for pid in dead])
+            conn.commit()
+            rows = conn.execute('''
+                SELECT family, kind, sample, labels, SUM(value)
+                FROM metric_samples
+                GROUP BY family, kind, sample, labels
+                ORDER BY family, MIN(series), sample, MIN(le)
+            ''').fetchall()
+        finally:
+            conn.close()
+
+        lines = []
+        current_family = None
+        for family, kind, sample, labels, value in rows:
+            if family != current_family:
+                current_family = family
+                if family in self._descriptions:
+                    lines.append(f"# HELP {family} {self._descriptions[family]}")
+                lines.append(f"# TYPE {family} {kind}")
+            lines.append(f"{sample}{{{labels}}} {_format_value(value)}" if labels
+                         else f"{sample} {_format_value(value)}")
+        return '\n'.join(lines) + '\n' if lines else ''
@@ -0,0 +1,63 @@
+"""
+Mistral Client Manager for Mistral OCR App
+Общий для процесса клиент Mistral с пулом keep-alive соединений
+"""
+import threading
+from typing import Optional
+
+import httpx
+from mistralai import Mistral
+
+
+class MistralClientManager:
+    """Создает один клиент Mistral на процесс и переиспользует его во всех потоках.
+
+    httpx.Client потокобезопасен и держит пул keep-alive соединений, поэтому
+    последовательные запросы (files.upload, files.get_signed_url, ocr.process)
+    и запросы разных воркеров не платят за новое TLS-соединение.
+    При изменении ключа, таймаута или размера пула клиент пересоздается.
+    """
+
+    def __init__(self, pool_size: int = 10, keepalive_expiry: float = 60.0,
+                 connect_timeout: float = 10.0, server_url: Optional[str] = None):
+        self.pool_size = pool_size
+        self.keepalive_expiry = keepalive_expiry
+        self.connect_timeout = connect_timeout
+        self.server_url = server_url
+        self._lock = threading.Lock()
+        self._client: Optional[Mistral] = None
+        self._http_client: Optional[httpx.Client] = None
+        self._config_key = None
+
+    def get_client(self, api_key: str, timeout_seconds: float = 30) -> Mistral:
+        """Возвращает общий клиент Mistral для заданного ключа и таймаута"""
+        config_key = (api_key, timeout_seconds, self.pool_size, self.server_url)
+        with self._lock:
+            if self._client is None or self._config_key != config_key:
+                # Предыдущий httpx.Client не закрываем: он может использоваться в других потоках
+                self._http_client = httpx.Client(
+                    limits=httpx.Limits(
+                        max_connections=self.pool_size,
+                        max_keepalive_connections=self.pool_size,
+                        keepalive_expiry=self.keepalive_expiry
+                    ),
+                    timeout=httpx.Timeout(timeout_seconds, connect=min(self.connect_timeout, timeout_seconds)),
+                    follow_redirects=True
+                )
+                self._client = Mistral(
+                    api_key=api_key,
+                    server_url=self.server_url,
+                    client=self._http_client,
+                    timeout_ms=int(timeout_seconds * 1000)
+                )
+                self._config_key = config_key
+            return self._client
+
+    def close(self):
+        """Закрывает пул соединений (при остановке процесса)"""
+        with self._lock:
+            if self._http_client is not None:
+                self._http_client.close()
+            self._client = None
+            self._http_client = None
+            self._config_key = None
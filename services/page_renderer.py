@@ -0,0 +1,122 @@
+"""
+Page Render Cache for Mistral OCR App
+Ленивая растеризация страниц PDF с дисковым кэшем (ключ: хэш документа, страница, DPI)
+"""
+import os
+import shutil
+import threading
+from typing import Optional
+
+try:
+    import fitz  # PyMuPDF
+    PYMUPDF_AVAILABLE = True
+except ImportError:
+    PYMUPDF_AVAILABLE = False
+
+
+class PageRenderCache:
+    """Хранит исходные PDF (по SHA-256) и отрендеренные по запросу страницы.
+
+    Страница рендерится при первом обращении и сохраняется как
+    ``pages/<hash>_<page>_<dpi>.png``. Время последнего доступа хранится в mtime файлов;
+    при превышении ``max_size_bytes`` удаляются наименее давно использованные файлы.
+    """
+
+    MIN_DPI = 36
+    MAX_DPI = 400
+
+    def __init__(self, cache_dir: str, max_size_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.documents_dir = os.path.join(cache_dir, 'documents')
+        self.pages_dir = os.path.join(cache_dir, 'pages')
+        self._lock = threading.Lock()
+        os.makedirs(self.documents_dir, exist_ok=True)
+        os.makedirs(self.pages_dir, exist_ok=True)
+
+    def _document_path(self, document_hash: str) -> str:
+        return os.path.join(self.documents_dir, f"{document_hash}.pdf")
+
+    def has_document(self, document_hash: str) -> bool:
+        return os.path.exists(self._document_path(document_hash))
+
+    def register_document(self, document_hash: str, pdf_path: str) -> str:
+        """Сохраняет исходный PDF в кэше (жесткая ссылка, если возможно, иначе копия)"""
+        target = self._document_path(document_hash)
+        if os.path.exists(target):
+            os.utime(target)
+            return target
+        tmp_path = f"{target}.tmp-{os.getpid()}-{threading.get_ident()}"
+        try:
+            os.link(pdf_path, tmp_path)
+        except OSError:
+            shutil.copyfile(pdf_path, tmp_path)
+        os.replace(tmp_path, target)
+        self._touch(target)
+        self._evict()
+        return target
+
+    def clamp_dpi(self, dpi: int) -> int:
+        return max(self.MIN_DPI, min(self.MAX_DPI, int(dpi)))
+
+    def render(self, document_hash: str, page_num: int, dpi: int = 150) -> Optional[str]:
+        """Возвращает путь к PNG страницы, рендеря ее при первом обращении.
+
+        None - если документ отсутствует в кэше или страницы нет.
+        """
+        if not PYMUPDF_AVAILABLE:
+            return None
+        dpi = self.clamp_dpi(dpi)
+        page_path = os.path.join(self.pages_dir, f"{document_hash}_{page_num}_{dpi}.png")
+        if os.path.exists(page_path):
+            self._touch(page_path)
+            self._touch(self._document_path(document_hash))
+            return page_path
+
+        document_path = self._document_path(document_hash)
+        if not os.path.exists(document_path):
+            return None
+        with fitz.open(document_path) as doc:
+            if page_num < 0 or page_num >= len(doc):
+                return None
+            pix = doc.load_page(page_num).get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72))
+            tmp_path = f"{page_path}.tmp-{os.getpid()}-{threading.get_ident()}"
+            pix.save(tmp_path, output='png')
+        os.replace(tmp_path, page_path)
+        self._touch(document_path)
+        self._evict()
+        return page_path
+
+    @staticmethod
+    def _touch(path: str):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        """Удаляет самые давно использованные файлы, пока размер кэша превышает лимит"""
+        with self._lock:
+            entries = []
+            total = 0
+            for directory in (self.documents_dir, self.pages_dir):
+                for name in os.listdir(directory):
+                    if '.tmp-' in name:
+                        continue
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+            if total <= self.max_size_bytes:
+                return
+            for _, size, path in sorted(entries):
+                if total <= self.max_size_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
@@ -0,0 +1,72 @@
+"""
+Page Streaming for Mistral OCR App
+Передача готовых страниц из задачи OCR в потоковый ответ до завершения задачи
+"""
+import contextvars
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Optional
+
+_current_page_stream: contextvars.ContextVar = contextvars.ContextVar('ocr_page_stream', default=None)
+
+_END = object()
+
+
+class PageStream:
+    """Очередь готовых страниц одной задачи.
+
+    Задача публикует страницы по порядку (publish_pages) и закрывает поток по
+    завершению (close); ответ читает их итерацией, пока поток не закрыт. Страница
+    преобразуется render в потоке задачи в момент публикации - пока файлы ее
+    изображений гарантированно на месте (в embedded формате они удаляются после
+    сохранения результата).
+    """
+
+    def __init__(self, render: Callable[[dict], Any]):
+        self.render = render
+        self.published = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def publish_pages(self, pages: List[dict]):
+        """Публикует страницы pages, которые еще не были опубликованы (по позиции в списке)"""
+        with self._lock:
+            if self._closed:
+                return
+            for page in pages[self.published:]:
+                self._queue.put(self.render(page))
+                self.published += 1
+
+    def close(self):
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put(_END)
+
+    def __iter__(self) -> Iterator[Any]:
+        while True:
+            item = self._queue.get()
+            if item is _END:
+                return
+            yield item
+
+
+def publish_pages(pages: List[dict]):
+    """Публикует готовые страницы в поток текущей задачи (вне потокового запроса ничего не делает)"""
+    stream = _current_page_stream.get()
+    if stream is not None:
+        stream.publish_pages(pages)
+
+
+@contextmanager
+def use_page_stream(stream: Optional[PageStream]):
+    """Делает stream текущим на время выполнения задачи и закрывает его по завершении"""
+    token = _current_page_stream.set(stream)
+    try:
+        yield stream
+    finally:
+        _current_page_stream.reset(token)
+        if stream is not None:
+            stream.close()
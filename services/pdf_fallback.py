@@ -0,0 +1,279 @@
+"""
+PDF Fallback Extraction for Mistral OCR App
+Извлечение встроенных изображений PDF для изображений API без base64
+(сопоставление по координатам, декодируются только нужные xref)
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from services.workspace import atomic_path
+
+try:
+    import fitz  # PyMuPDF
+    PYMUPDF_AVAILABLE = True
+except ImportError:
+    PYMUPDF_AVAILABLE = False
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def scale_api_bbox(coordinates: dict, dimensions: Optional[dict], page_rect) -> Optional[Tuple[float, float, float, float]]:
+    """Переводит координаты изображения из ответа API (пиксели рендера страницы)
+    в координаты страницы PDF (пункты). None - если координат нет."""
+    keys = ('top_left_x', 'top_left_y', 'bottom_right_x', 'bottom_right_y')
+    if not coordinates or any(coordinates.get(key) is None for key in keys):
+        return None
+    x0, y0, x1, y1 = (float(coordinates[key]) for key in keys)
+    if dimensions and dimensions.get('width') and dimensions.get('height'):
+        scale_x = page_rect.width / dimensions['width']
+        scale_y = page_rect.height / dimensions['height']
+    elif dimensions and dimensions.get('dpi'):
+        scale_x = scale_y = 72 / dimensions['dpi']
+    else:
+        scale_x = scale_y = 1.0
+    return (page_rect.x0 + x0 * scale_x, page_rect.y0 + y0 * scale_y,
+            page_rect.x0 + x1 * scale_x, page_rect.y0 + y1 * scale_y)
+
+
+def _iou(a: Tuple[float, float, float, float], b: Tuple[float, float, float, float]) -> float:
+    inter_w = min(a[2], b[2]) - max(a[0], b[0])
+    inter_h = min(a[3], b[3]) - max(a[1], b[1])
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    inter = inter_w * inter_h
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    return inter / (area_a + area_b - inter) if area_a + area_b - inter > 0 else 0.0
+
+
+def _center_distance(a: Tuple[float, float, float, float], b: Tuple[float, float, float, float]) -> float:
+    return (((a[0] + a[2]) - (b[0] + b[2])) ** 2 + ((a[1] + a[3]) - (b[1] + b[3])) ** 2) ** 0.5
+
+
+def match_images_to_placements(targets: List[Tuple[str, Optional[tuple]]],
+                               placements: List[Tuple[int, tuple]]) -> Dict[str, int]:
+    """Сопоставляет изображения API размещениям изображений на странице.
+
+    targets - список (id, bbox или None), placements - список (индекс, bbox).
+    Сначала жадно по убыванию IoU, затем оставшиеся с bbox - по ближайшему центру,
+    затем изображения без координат - по порядку. Возвращает {id: индекс размещения}.
+    """
+    matches = {}
+    free = {index: bbox for index, bbox in placements}
+
+    pairs = []
+    for target_id, target_bbox in targets:
+        if target_bbox is None:
+            continue
+        for index, bbox in placements:
+            overlap = _iou(target_bbox, bbox)
+            if overlap > 0:
+                pairs.append((overlap, target_id, index))
+    for _, target_id, index in sorted(pairs, key=lambda pair: -pair[0]):
+        if target_id not in matches and index in free:
+            matches[target_id] = index
+            del free[index]
+
+    for target_id, target_bbox in targets:
+        if target_id in matches or not free:
+            continue
+        if target_bbox is not None:
+            index = min(free, key=lambda i: _center_distance(target_bbox, free[i]))
+        else:
+            index = min(free)
+        matches[target_id] = index
+        del free[index]
+    return matches
+
+
+def extract_page_assets(pdf_path: str, page_targets: Dict[int, dict], output_dir: str) -> Dict[int, dict]:
+    """Открывает PDF один раз и извлекает только те встроенные изображения,
+    которым соответствуют изображения API без base64.
+
+    page_targets: ``{page_num: {'dimensions': {...}, 'images': [{'id', 'coordinates'}]}}``.
+    Возвращает ``{page_num: {'images': [...], 'matches': {api_id: image}}}``.
+    Функция выполняется в дочерних процессах, поэтому не использует логгер приложения.
+    """
+    assets = {}
+    with fitz.open(pdf_path) as doc:
+        for page_num, target in page_targets.items():
+            if page_num < 0 or page_num >= len(doc):
+                continue
+            page = doc.load_page(page_num)
+            page_assets = {'images': [], 'matches': {}}
+
+            # Размещения изображений на странице (bbox и xref) - без декодирования
+            placements = [
+                (img_index, tuple(info['bbox']), info['xref'])
+                for img_index, info in enumerate(page.get_image_info(xrefs=True))
+                if info.get('xref')
+            ]
+            xref_by_index = {img_index: xref for img_index, _, xref in placements}
+            bbox_by_index = {img_index: bbox for img_index, bbox, _ in placements}
+            targets = [
+                (img['id'], scale_api_bbox(img.get('coordinates'), target.get('dimensions'), page.rect))
+                for img in target.get('images', [])
+            ]
+            matches = match_images_to_placements(targets, [(i, bbox) for i, bbox, _ in placements])
+
+            # Декодируем только выбранные xref (каждый не более одного раза)
+            saved_by_xref = {}
+            for api_id, img_index in matches.items():
+                xref = xref_by_index[img_index]
+                if xref not in saved_by_xref:
+                    pix = fitz.Pixmap(doc, xref)
+                    if pix.n - pix.alpha >= 4:  # CMYK - конвертируем в RGB
+                        pix = fitz.Pixmap(fitz.csRGB, pix)
+                    elif pix.alpha:
+                        pix = fitz.Pixmap(fitz.csRGB, pix)
+                    img_path = os.path.join(output_dir, f"extracted_page_{page_num}_img_{img_index}.png")
+                    with atomic_path(img_path) as tmp_path:
+                        pix.save(tmp_path, output='png')
+                    bbox = bbox_by_index[img_index]
+                    saved_by_xref[xref] = {
+                        'page_num': page_num,
+                        'image_index': img_index,
+                        'xref': xref,
+                        'image_path': img_path,
+                        'width': pix.width,
+                        'height': pix.height,
+                        'bbox': {
+                            'x0': bbox[0], 'y0': bbox[1],
+                            'x1': bbox[2], 'y1': bbox[3]
+                        }
+                    }
+                    page_assets['images'].append(saved_by_xref[xref])
+                    pix = None  # Освобождаем память
+                page_assets['matches'][api_id] = saved_by_xref[xref]
+            assets[page_num] = page_assets
+    return assets
+
+
+def _get_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Ленивый общий пул процессов (создается при первом многостраничном fallback).
+
+    Процессы запускаются через spawn: fork многопоточного веб-процесса копирует
+    захваченные другими потоками блокировки, и воркер может зависнуть.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _reset_pool(broken: ProcessPoolExecutor):
+    """Убирает сломанный пул: следующий вызов _get_pool создаст новый"""
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _iter_in_process(pdf_path: str, pages: List[int], page_targets: Dict[int, dict],
+                     output_dir: str) -> Iterator[Tuple[int, dict]]:
+    for page in pages:
+        yield from extract_page_assets(pdf_path, {page: page_targets[page]}, output_dir).items()
+
+
+def _submit_groups(pool: ProcessPoolExecutor, pdf_path: str, groups: List[Dict[int, dict]],
+                   output_dir: str) -> List[Future]:
+    return [pool.submit(extract_page_assets, pdf_path, group, output_dir) for group in groups]
+
+
+def _iter_pool_results(pool: ProcessPoolExecutor, futures: List[Future], pdf_path: str,
+                       groups: List[Dict[int, dict]], output_dir: str, max_workers: int,
+                       retried: bool) -> Iterator[Tuple[int, dict]]:
+    done = 0
+    try:
+        while done < len(groups):
+            try:
+                assets = futures[done].result()
+            except BrokenProcessPool:
+                if retried:
+                    raise
+                # Воркер пула аварийно завершился (например, по нехватке памяти) - пул непригоден
+                # для всех последующих задач; создаем новый и повторяем оставшиеся группы один раз
+                retried = True
+                _reset_pool(pool)
+                pool = _get_pool(max_workers)
+                futures = futures[:done] + _submit_groups(pool, pdf_path, groups[done:], output_dir)
+                continue
+            done += 1
+            yield from sorted(assets.items())
+    finally:
+        # Итерация прервана - группы, которые еще не начали выполняться, не нужны
+        for future in futures[done:]:
+            future.cancel()
+
+
+def iter_fallback_assets(pdf_path: str, page_targets: Dict[int, dict], output_dir: str,
+                         max_workers: int = 4,
+                         min_pages_per_worker: int = 2) -> Iterator[Tuple[int, dict]]:
+    """Извлекает fallback-изображения только для указанных страниц.
+
+    Страницы делятся на последовательные группы, которые сразу при вызове ставятся в пул
+    процессов; каждая группа открывает документ один раз. Итератор отдает
+    ``(page_num, assets)`` по возрастанию страниц, как только готова очередная группа,
+    пока следующие еще извлекаются. Если страниц мало, работа выполняется в текущем
+    процессе по мере итерации.
+    """
+    pages = sorted(page_targets)
+    workers = max(1, min(max_workers, len(pages) // max(1, min_pages_per_worker)))
+    if workers == 1:
+        return _iter_in_process(pdf_path, pages, page_targets, output_dir)
+
+    # Небольшие последовательные группы: первые страницы готовы раньше, а пул
+    # сам распределяет группы между воркерами
+    size = max(1, min_pages_per_worker)
+    groups = [{page: page_targets[page] for page in pages[i:i + size]} for i in range(0, len(pages), size)]
+    pool = _get_pool(max_workers)
+    retried = False
+    try:
+        futures = _submit_groups(pool, pdf_path, groups, output_dir)
+    except BrokenProcessPool:
+        # Пул сломан предыдущей задачей - создаем новый (это и есть единственный повтор)
+        retried = True
+        _reset_pool(pool)
+        pool = _get_pool(max_workers)
+        futures = _submit_groups(pool, pdf_path, groups, output_dir)
+    return _iter_pool_results(pool, futures, pdf_path, groups, output_dir, max_workers, retried)
+
+
+def extract_fallback_assets(pdf_path: str, page_targets: Dict[int, dict], output_dir: str,
+                            max_workers: int = 4,
+                            min_pages_per_worker: int = 2) -> Dict[int, dict]:
+    """Извлекает fallback-изображения для указанных страниц целиком (см. iter_fallback_assets)"""
+    return dict(iter_fallback_assets(pdf_path, page_targets, output_dir, max_workers, min_pages_per_worker))
+
+
+class PageAssetsReader:
+    """Результаты iter_fallback_assets по номеру страницы.
+
+    Страницы запрашиваются по возрастанию; страница, которой нет в результатах
+    (вне документа или без запроса на извлечение), дает None.
+    """
+
+    def __init__(self, assets: Iterator[Tuple[int, dict]]):
+        self._assets = assets
+        self._ready: Dict[int, dict] = {}
+        self._last = -1
+
+    def get(self, page_num: int) -> Optional[dict]:
+        while page_num not in self._ready and self._last < page_num:
+            item = next(self._assets, None)
+            if item is None:
+                break
+            self._last, self._ready[item[0]] = item[0], item[1]
+        return self._ready.pop(page_num, None)
+
+    def close(self):
+        close = getattr(self._assets, 'close', None)
+        if close is not None:
+            close()
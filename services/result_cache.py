@@ -0,0 +1,195 @@
+"""
+Result Cache for Mistral OCR App
+Контентно-адресуемый кэш результатов OCR (SHA-256 документа + опции обработки)
+"""
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional
+
+
+def compute_file_sha256(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Вычисляет SHA-256 файла, читая его блоками"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Персистентный кэш результатов OCR с TTL и LRU-вытеснением по суммарному размеру.
+
+    Каждая запись хранится в отдельном каталоге ``<cache_dir>/<key>/``:
+    ``result.json`` с результатом и копии файлов-артефактов (изображения, .md, .json).
+    Индекс (время создания, последнего доступа, размер) хранится в SQLite.
+    """
+
+    def __init__(self, cache_dir: str, max_size_bytes: int, ttl_seconds: int):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.ttl_seconds = ttl_seconds
+        self.db_path = os.path.join(cache_dir, 'index.db')
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._init_db()
+
+    def _get_connection(self):
+        """Get database connection"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        conn = self._get_connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                cache_key TEXT PRIMARY KEY,
+                size_bytes INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_access ON cache_entries(last_access)')
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def make_key(document_hash: str, include_images: bool, export_format: str, model: str) -> str:
+        """Строит ключ кэша из хэша документа и параметров, влияющих на результат"""
+        raw = json.dumps([document_hash, bool(include_images), export_format, model])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Возвращает запись ``{'result': ..., 'artifacts': {basename: path}}`` или None"""
+        now = time.time()
+        with self._lock:
+            conn = self._get_connection()
+            try:
+                row = conn.execute(
+                    'SELECT created_at FROM cache_entries WHERE cache_key = ?', (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                if self.ttl_seconds and now - row['created_at'] > self.ttl_seconds:
+                    self._delete_entry(conn, key)
+                    conn.commit()
+                    return None
+                result_path = os.path.join(self._entry_dir(key), 'result.json')
+                try:
+                    with open(result_path, 'r', encoding='utf-8') as f:
+                        result = json.load(f)
+                except (OSError, ValueError):
+                    # Запись повреждена или удалена с диска - считаем промахом
+                    self._delete_entry(conn, key)
+                    conn.commit()
+                    return None
+                conn.execute(
+                    'UPDATE cache_entries SET last_access = ? WHERE cache_key = ?', (now, key)
+                )
+                conn.commit()
+            finally:
+                conn.close()
+
+        artifacts_dir = os.path.join(self._entry_dir(key), 'artifacts')
+        artifacts = {}
+        if os.path.isdir(artifacts_dir):
+            for name in os.listdir(artifacts_dir):
+                artifacts[name] = os.path.join(artifacts_dir, name)
+        return {'result': result, 'artifacts': artifacts}
+
+    def put(self, key: str, result: Dict[str, Any], artifact_paths: Iterable[str]) -> bool:
+        """Сохраняет результат и копии существующих файлов-артефактов"""
+        entry_dir = self._entry_dir(key)
+        tmp_dir = f"{entry_dir}.tmp-{os.getpid()}-{threading.get_ident()}"
+        try:
+            os.makedirs(os.path.join(tmp_dir, 'artifacts'), exist_ok=True)
+            size = 0
+            for path in artifact_paths:
+                if path and os.path.isfile(path):
+                    target = os.path.join(tmp_dir, 'artifacts', os.path.basename(path))
+                    shutil.copyfile(path, target)
+                    size += os.path.getsize(target)
+            result_path = os.path.join(tmp_dir, 'result.json')
+            with open(result_path, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False)
+            size += os.path.getsize(result_path)
+
+            if size > self.max_size_bytes:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                return False
+
+            with self._lock:
+                conn = self._get_connection()
+                try:
+                    self._delete_entry(conn, key)
+                    os.replace(tmp_dir, entry_dir)
+                    now = time.time()
+                    conn.execute('''
+                        INSERT OR REPLACE INTO cache_entries
+                        (cache_key, size_bytes, created_at, last_access)
+                        VALUES (?, ?, ?, ?)
+                    ''', (key, size, now, now))
+                    self._evict(conn)
+                    conn.commit()
+                finally:
+                    conn.close()
+            return True
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    def _delete_entry(self, conn, key: str):
+        conn.execute('DELETE FROM cache_entries WHERE cache_key = ?', (key,))
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def _evict(self, conn):
+        """Удаляет просроченные записи, затем наименее давно использованные сверх лимита"""
+        if self.ttl_seconds:
+            expired = conn.execute(
+                'SELECT cache_key FROM cache_entries WHERE created_at < ?',
+                (time.time() - self.ttl_seconds,)
+            ).fetchall()
+            for row in expired:
+                self._delete_entry(conn, row['cache_key'])
+
+        total = conn.execute('SELECT COALESCE(SUM(size_bytes), 0) FROM cache_entries').fetchone()[0]
+        if total <= self.max_size_bytes:
+            return
+        rows = conn.execute(
+            'SELECT cache_key, size_bytes FROM cache_entries ORDER BY last_access ASC'
+        ).fetchall()
+        for row in rows:
+            if total <= self.max_size_bytes:
+                break
+            self._delete_entry(conn, row['cache_key'])
+            total -= row['size_bytes']
+
+    def clear(self):
+        """Полностью очищает кэш"""
+        with self._lock:
+            conn = self._get_connection()
+            try:
+                for row in conn.execute('SELECT cache_key FROM cache_entries').fetchall():
+                    self._delete_entry(conn, row['cache_key'])
+                conn.commit()
+            finally:
+                conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Возвращает количество записей и суммарный размер кэша"""
+        conn = self._get_connection()
+        try:
+            count, total = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM cache_entries'
+            ).fetchone()
+        finally:
+            conn.close()
+        return {'entries': count, 'size_bytes': total, 'max_size_bytes': self.max_size_bytes}
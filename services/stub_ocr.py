@@ -0,0 +1,265 @@
+"""
+Stub OCR Server for Mistral OCR App
+Локальный сервер, отвечающий в формате API Mistral (files и ocr) по реальным страницам PDF:
+текст страницы из PyMuPDF, встроенные изображения, настраиваемые задержки и ошибки
+
+Запуск отдельно: python -m services.stub_ocr --port 8089 --missing-base64-rate 0.2
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+import fitz  # PyMuPDF
+import requests
+
+RENDER_DPI = 200
+
+
+class StubOCREngine:
+    """Формирует ответ OCR по документу: одна страница ответа на страницу PDF.
+
+    markdown - текстовые блоки страницы и ссылки ``![img-N.jpeg](img-N.jpeg)`` на месте
+    изображений (в порядке сверху вниз), images - встроенные изображения с координатами
+    в пикселях рендера RENDER_DPI. Доля изображений без base64 задается missing_base64_rate.
+    """
+
+    def __init__(self, latency_ms: float = 0, page_latency_ms: float = 0,
+                 error_rate: float = 0.0, missing_base64_rate: float = 0.0,
+                 seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.page_latency_ms = page_latency_ms
+        self.error_rate = error_rate
+        self.missing_base64_rate = missing_base64_rate
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    def _chance(self, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with self._rng_lock:
+            return self._rng.random() < rate
+
+    def should_fail(self) -> bool:
+        return self._chance(self.error_rate)
+
+    def simulate_latency(self, pages: int):
+        delay = self.latency_ms + self.page_latency_ms * pages
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    @staticmethod
+    def open_document(content: bytes, mime_type: Optional[str] = None):
+        """Открывает PDF или изображение (изображение превращается в одностраничный PDF)"""
+        if mime_type and mime_type.startswith('image/'):
+            with fitz.open(stream=content, filetype=mime_type.split('/', 1)[1]) as image_doc:
+                return fitz.open('pdf', image_doc.convert_to_pdf())
+        return fitz.open(stream=content, filetype='pdf')
+
+    @staticmethod
+    def _image_payload(doc, xref: int) -> str:
+        pix = fitz.Pixmap(doc, xref)
+        if pix.n - pix.alpha >= 4 or pix.alpha:
+            pix = fitz.Pixmap(fitz.csRGB, pix)
+        return "data:image/jpeg;base64," + base64.b64encode(pix.tobytes('jpg')).decode('ascii')
+
+    def process(self, content: bytes, mime_type: Optional[str] = None,
+                include_image_base64: bool = True, model: str = 'mistral-ocr-latest') -> dict:
+        """Возвращает тело ответа /v1/ocr (dict в формате Mistral)"""
+        scale = RENDER_DPI / 72
+        pages = []
+        image_counter = 0
+        with self.open_document(content, mime_type) as doc:
+            for page in doc:
+                rect = page.rect
+                blocks = []
+                for block in page.get_text('blocks'):
+                    if block[6] == 0 and block[4].strip():
+                        blocks.append((block[1], block[0], 'text', block[4].strip()))
+                images = []
+                for info in page.get_image_info(xrefs=True):
+                    if not info.get('xref'):
+                        continue
+                    image_id = f"img-{image_counter}.jpeg"
+                    image_counter += 1
+                    x0, y0, x1, y1 = info['bbox']
+                    image_base64 = None
+                    if include_image_base64 and not self._chance(self.missing_base64_rate):
+                        image_base64 = self._image_payload(doc, info['xref'])
+                    images.append({
+                        "id": image_id,
+                        "top_left_x": int((x0 - rect.x0) * scale),
+                        "top_left_y": int((y0 - rect.y0) * scale),
+                        "bottom_right_x": int((x1 - rect.x0) * scale),
+                        "bottom_right_y": int((y1 - rect.y0) * scale),
+                        "image_base64": image_base64,
+                    })
+                    blocks.append((y0, x0, 'image', f"![{image_id}]({image_id})"))
+                blocks.sort(key=lambda item: (item[0], item[1]))
+                pages.append({
+                    "index": page.number,
+                    "markdown": "\n\n".join(item[3] for item in blocks),
+                    "images": images,
+                    "dimensions": {
+                        "dpi": RENDER_DPI,
+                        "height": int(rect.height * scale),
+                        "width": int(rect.width * scale),
+                    },
+                })
+        return {
+            "pages": pages,
+            "model": model,
+            "usage_info": {"pages_processed": len(pages), "doc_size_bytes": len(content)},
+        }
+
+
+class StubOCRHandler(BaseHTTPRequestHandler):
+    """Пути API Mistral: POST /v1/files, GET /v1/files/<id>/url, POST /v1/ocr"""
+
+    engine: StubOCREngine = None
+    storage_dir: str = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _file_path(self, file_id: str) -> str:
+        return os.path.join(self.storage_dir, os.path.basename(file_id))
+
+    def _upload(self):
+        body = self._read_body()
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode('latin-1') + body
+        )
+        for part in message.iter_parts():
+            if part.get_param('name', header='content-disposition') == 'file':
+                file_id = f"stub-{uuid.uuid4().hex}"
+                content = part.get_payload(decode=True)
+                with open(self._file_path(file_id), 'wb') as f:
+                    f.write(content)
+                with open(self._file_path(file_id) + '.type', 'w') as f:
+                    f.write(part.get_content_type())
+                return self._send_json({
+                    "id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                    "filename": part.get_filename() or 'document', "purpose": "ocr",
+                    "sample_type": "ocr_input", "source": "upload"
+                })
+        self._send_json({"detail": "file part is missing"}, 422)
+
+    def _load_document(self, document: dict):
+        """Возвращает (байты, mime-тип) документа из data URL, signed URL стаба или внешнего URL"""
+        url = document.get('document_url') or document.get('image_url')
+        if isinstance(url, dict):
+            url = url.get('url')
+        if not url:
+            raise ValueError('document url is missing')
+        if url.startswith('data:'):
+            header, data = url.split(',', 1)
+            return base64.b64decode(data), header[5:].split(';')[0]
+        marker = '/signed/'
+        if marker in url:
+            file_id = url.rsplit(marker, 1)[1]
+            with open(self._file_path(file_id), 'rb') as f:
+                content = f.read()
+            type_path = self._file_path(file_id) + '.type'
+            mime_type = 'application/pdf'
+            if os.path.exists(type_path):
+                with open(type_path) as f:
+                    mime_type = f.read()
+            return content, mime_type
+        response = requests.get(url, timeout=60)
+        response.raise_for_status()
+        return response.content, response.headers.get('Content-Type', 'application/pdf').split(';')[0]
+
+    def _ocr(self):
+        request_body = json.loads(self._read_body() or b'{}')
+        if self.engine.should_fail():
+            self.engine.simulate_latency(0)
+            return self._send_json({"detail": "Stub OCR: injected server error"}, 500)
+        try:
+            content, mime_type = self._load_document(request_body.get('document') or {})
+            result = self.engine.process(
+                content, mime_type,
+                include_image_base64=bool(request_body.get('include_image_base64')),
+                model=request_body.get('model') or 'mistral-ocr-latest'
+            )
+        except Exception as e:
+            return self._send_json({"detail": f"Stub OCR: {e}"}, 422)
+        self.engine.simulate_latency(len(result['pages']))
+        self._send_json(result)
+
+    def do_POST(self):
+        if self.path == '/v1/files':
+            self._upload()
+        elif self.path == '/v1/ocr':
+            self._ocr()
+        else:
+            self.send_error(404)
+
+    def do_GET(self):
+        if self.path.startswith('/v1/files/') and self.path.split('?')[0].endswith('/url'):
+            file_id = self.path.split('/')[3]
+            if not os.path.exists(self._file_path(file_id)):
+                return self._send_json({"detail": "file not found"}, 404)
+            return self._send_json({"url": f"http://{self.headers['Host']}/signed/{file_id}"})
+        self.send_error(404)
+
+
+def start_stub_server(engine: StubOCREngine, host: str = '127.0.0.1', port: int = 0,
+                      storage_dir: Optional[str] = None) -> ThreadingHTTPServer:
+    """Запускает stub-сервер в фоновом потоке; адрес - server.server_address"""
+    handler = type('BoundStubOCRHandler', (StubOCRHandler,), {
+        'engine': engine,
+        'storage_dir': storage_dir or tempfile.mkdtemp(prefix='stub_ocr_files_'),
+    })
+    os.makedirs(handler.storage_dir, exist_ok=True)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name='stub-ocr-server').start()
+    return server
+
+
+def main():
+    """Запуск stub-сервера как отдельного процесса"""
+    parser = argparse.ArgumentParser(description='Локальный stub API Mistral OCR')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--page-latency-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--missing-base64-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    engine = StubOCREngine(args.latency_ms, args.page_latency_ms, args.error_rate,
+                           args.missing_base64_rate, args.seed)
+    server = start_stub_server(engine, args.host, args.port)
+    print(f"Stub Mistral OCR: http://{args.host}:{server.server_address[1]} (MISTRAL_SERVER_URL)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Request Timings for Mistral OCR App
+Легковесные замеры этапов обработки (span) и заголовок Server-Timing
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+_current_timings: contextvars.ContextVar = contextvars.ContextVar('ocr_timings', default=None)
+
+
+class Timings:
+    """Суммарная длительность этапов одной обработки (мс) и число вызовов.
+
+    Повторяющиеся этапы (например, ocr_process для частей документа) суммируются,
+    поэтому при параллельной обработке сумма может превышать время запроса.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans: Dict[str, list] = {}
+
+    def add(self, name: str, duration_ms: float):
+        with self._lock:
+            entry = self._spans.setdefault(name, [0.0, 0])
+            entry[0] += duration_ms
+            entry[1] += 1
+
+    def to_dict(self) -> Dict[str, float]:
+        """{этап: мс} в порядке первого появления"""
+        with self._lock:
+            return {name: round(total, 1) for name, (total, _) in self._spans.items()}
+
+
+class _Span:
+    __slots__ = ('timings', 'name', 'started')
+
+    def __init__(self, timings: Timings, name: str):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.timings.add(self.name, (time.perf_counter() - self.started) * 1000)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name: str):
+    """Контекстный менеджер замера этапа; без активного сбора - пустая операция"""
+    timings = _current_timings.get()
+    if timings is None:
+        return _NULL_SPAN
+    return _Span(timings, name)
+
+
+@contextmanager
+def collect_timings(enabled: bool = True):
+    """Включает сбор замеров в текущем потоке; возвращает Timings или None, если выключено"""
+    if not enabled:
+        yield None
+        return
+    timings = Timings()
+    token = _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
+
+
+def propagate_timings(func: Callable) -> Callable:
+    """Оборачивает функцию для пула потоков: замеры попадают в сбор вызывающего потока"""
+    timings = _current_timings.get()
+    if timings is None:
+        return func
+
+    def wrapper(*args, **kwargs):
+        token = _current_timings.set(timings)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current_timings.reset(token)
+    return wrapper
+
+
+def format_server_timing(timings: Optional[Dict[str, float]]) -> str:
+    """Значение заголовка Server-Timing: ``name;dur=12.3, ...``"""
+    if not timings:
+        return ''
+    return ', '.join(f"{name};dur={duration}" for name, duration in timings.items())
@@ -0,0 +1,325 @@
+"""
+Resumable Uploads for Mistral OCR App
+Возобновляемая загрузка больших файлов частями: сессия, части по смещению,
+текущее смещение после обрыва и проверка SHA-256 при завершении
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+try:
+    import fcntl  # Блокировка файла между процессами (POSIX)
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+from services.fetcher import DocumentTooLargeError
+from services.ingest import SNIFF_BYTES, sniff_file_type
+from services.result_cache import compute_file_sha256
+from services.workspace import TMP_MARKER, JobWorkspace, WorkspaceManager, atomic_write
+
+# Параметры сессии и файл блокировки - в каталоге задачи рядом с принимаемым файлом
+SESSION_FILENAME = 'upload_session.json'
+LOCK_FILENAME = 'upload_session.lock'
+
+
+class UploadOffsetError(Exception):
+    """Смещение части не совпадает с числом байтов, принятых сервером"""
+
+    def __init__(self, offset: int):
+        super().__init__(f"Ожидалась часть со смещением {offset}")
+        self.offset = offset
+
+
+class UploadHashMismatchError(Exception):
+    """SHA-256 собранного файла не совпадает с переданным клиентом"""
+
+
+class UploadSession:
+    """Файл, принимаемый частями в каталог задачи; id сессии - id каталога.
+
+    Части пишутся строго последовательно: смещение каждой должно совпадать с offset.
+    offset - размер недокачанного файла на диске: если соединение оборвалось посреди
+    части, он учитывает все записанные байты, и клиент продолжает с него. Параметры
+    сессии хранятся в upload_session.json, запись частей и завершение сериализуются
+    блокировкой файла, поэтому части одной загрузки могут принимать разные процессы.
+    SHA-256 считается по мере приема; если предыдущие части принял другой процесс,
+    файл хэшируется при завершении.
+    """
+
+    def __init__(self, workspace: JobWorkspace, filename: str, size: int,
+                 sha256: Optional[str] = None, options: Optional[Dict[str, Any]] = None,
+                 created_at: Optional[float] = None):
+        self.id = workspace.id
+        self.workspace = workspace
+        self.filename = filename
+        self.size = size
+        self.expected_sha256 = sha256.lower() if sha256 else None
+        self.options = options or {}
+        self.created_at = created_at or time.time()
+        self.final_path = workspace.file_path(filename)
+        # Маркер временного файла: хук очистки каталога задачи удалит недокачанный файл
+        self.part_path = f"{self.final_path}{TMP_MARKER}upload"
+        self.metadata_path = os.path.join(workspace.path, SESSION_FILENAME)
+        # SHA-256 байтов [0, _digest_offset), принятых этим процессом; None - хэш не продолжить
+        self._digest: Optional[Any] = hashlib.sha256()
+        self._digest_offset = 0
+        self._verified_sha256: Optional[str] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, workspace: JobWorkspace, filename: str, size: int, sha256: Optional[str] = None,
+               options: Optional[Dict[str, Any]] = None) -> 'UploadSession':
+        session = cls(workspace, filename, size, sha256, options)
+        open(session.part_path, 'wb').close()
+        atomic_write(session.metadata_path, json.dumps({
+            'upload_id': session.id,
+            'filename': filename,
+            'size': size,
+            'sha256': session.expected_sha256,
+            'options': session.options,
+            'created_at': session.created_at,
+        }, ensure_ascii=False))
+        return session
+
+    @classmethod
+    def load(cls, workspace: JobWorkspace) -> Optional['UploadSession']:
+        """Сессия по upload_session.json каталога; None - если ее нет (завершена или отменена)"""
+        try:
+            with open(os.path.join(workspace.path, SESSION_FILENAME), encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        session = cls(workspace, data['filename'], data['size'], data.get('sha256'),
+                      data.get('options'), data.get('created_at'))
+        session._digest = None  # Уже принятые байты этим процессом не хэшировались
+        return session
+
+    @property
+    def exists(self) -> bool:
+        """Сессия не завершена и не отменена (в том числе другим процессом)"""
+        return os.path.exists(self.metadata_path)
+
+    @property
+    def finalized(self) -> bool:
+        return not os.path.exists(self.part_path) and os.path.exists(self.final_path)
+
+    @property
+    def offset(self) -> int:
+        """Число принятых байтов"""
+        try:
+            return os.path.getsize(self.part_path)
+        except OSError:
+            return self.size if self.finalized else 0
+
+    @property
+    def updated_at(self) -> float:
+        """Время последней записи части (mtime файла)"""
+        for path in (self.part_path, self.final_path, self.metadata_path):
+            try:
+                return os.path.getmtime(path)
+            except OSError:
+                continue
+        return self.created_at
+
+    @property
+    def sha256(self) -> str:
+        """SHA-256 принятых байтов"""
+        if self._verified_sha256:
+            return self._verified_sha256
+        if self.finalized:
+            return compute_file_sha256(self.final_path)
+        return self._accepted_sha256(self.offset)
+
+    def _accepted_sha256(self, offset: int) -> str:
+        if self._digest is not None and self._digest_offset == offset:
+            return self._digest.hexdigest()
+        # Часть данных принял другой процесс - хэш по файлу на диске
+        return compute_file_sha256(self.part_path)
+
+    @contextmanager
+    def _exclusive(self):
+        """Блокировка сессии для потоков процесса и (где есть flock) для других процессов"""
+        with self._lock:
+            if not FCNTL_AVAILABLE:
+                yield
+                return
+            with open(os.path.join(self.workspace.path, LOCK_FILENAME), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def to_dict(self) -> Dict[str, Any]:
+        offset = self.offset
+        return {
+            'upload_id': self.id,
+            'filename': self.filename,
+            'size': self.size,
+            'offset': offset,
+            'complete': offset == self.size,
+        }
+
+    def write_chunk(self, offset: int, stream, block_size: int = 1024 * 1024) -> int:
+        """Дописывает часть из потока stream с позиции offset; возвращает новое смещение"""
+        with self._exclusive():
+            current = self.offset
+            if self.finalized or not self.exists or offset != current:
+                raise UploadOffsetError(current)
+            if self._digest is None or self._digest_offset != offset:
+                # Предыдущие части принял другой процесс: с нуля хэш можно начать заново
+                self._digest = hashlib.sha256() if offset == 0 else None
+                self._digest_offset = offset
+            with open(self.part_path, 'r+b') as f:
+                f.seek(offset)
+                while True:
+                    block = stream.read(block_size)
+                    if not block:
+                        break
+                    if offset + len(block) > self.size:
+                        raise ValueError(f"Часть выходит за объявленный размер файла ({self.size} байт)")
+                    f.write(block)
+                    if self._digest is not None:
+                        self._digest.update(block)
+                    offset += len(block)
+                    self._digest_offset = offset
+            return offset
+
+    def finalize(self, sha256: Optional[str] = None) -> str:
+        """Проверяет размер и SHA-256 (если передан) и переносит файл на постоянное место; возвращает путь
+
+        Без переданного хэша целостность подтверждает размер, а SHA-256 для кэша результатов
+        считает сервер - клиенту не нужно читать файл целиком ради хэша.
+        """
+        expected = (sha256 or self.expected_sha256 or '').lower()
+        with self._exclusive():
+            if self.finalized:
+                raise UploadOffsetError(self.size)
+            offset = self.offset
+            if offset != self.size:
+                raise ValueError(f"Файл загружен не полностью: {offset} из {self.size} байт")
+            actual = self._accepted_sha256(offset)
+            if expected and actual != expected:
+                raise UploadHashMismatchError("SHA-256 загруженного файла не совпадает с переданным")
+            os.replace(self.part_path, self.final_path)
+            self._verified_sha256 = actual
+            return self.final_path
+
+    def reopen(self):
+        """Отменяет finalize (задачу не удалось поставить в очередь) - завершение можно повторить"""
+        with self._exclusive():
+            if self.finalized:
+                os.replace(self.final_path, self.part_path)
+                self._verified_sha256 = None
+
+    def close(self):
+        """Удаляет файлы сессии: каталог передан задаче OCR"""
+        for name in (SESSION_FILENAME, LOCK_FILENAME):
+            try:
+                os.remove(os.path.join(self.workspace.path, name))
+            except OSError:
+                pass
+
+    def detected_type(self) -> Optional[str]:
+        """Тип файла по сигнатуре первых байтов"""
+        path = self.final_path if self.finalized else self.part_path
+        with open(path, 'rb') as f:
+            return sniff_file_type(f.read(SNIFF_BYTES))
+
+
+class UploadSessionManager:
+    """Сессии загрузки; каталог сессии - каталог будущей задачи.
+
+    Состояние сессии хранится в ее каталоге, поэтому get() находит сессии, созданные
+    другими процессами; в памяти держатся только объекты сессий (с SHA-256, посчитанным
+    по мере приема). Сессия без активности дольше ttl_seconds считается истекшей:
+    она удаляется при следующем обращении к ней, а ее каталог перестает считаться
+    активным для фоновой очистки.
+    """
+
+    def __init__(self, workspace_manager: WorkspaceManager, max_bytes: int, ttl_seconds: float = 86400):
+        self.workspace_manager = workspace_manager
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._sessions: Dict[str, UploadSession] = {}
+        self._lock = threading.Lock()
+
+    def _expired(self, session: UploadSession, now: float) -> bool:
+        return now - session.updated_at > self.ttl_seconds
+
+    def _load(self, upload_id: str) -> Optional[UploadSession]:
+        workspace = self.workspace_manager.open(upload_id)
+        return UploadSession.load(workspace) if workspace is not None else None
+
+    def expire(self):
+        """Удаляет истекшие сессии этого процесса вместе с каталогами
+        (сессии, известные только другим процессам, удаляет фоновая очистка)"""
+        now = time.time()
+        with self._lock:
+            expired = [s for s in self._sessions.values() if not s.exists or self._expired(s, now)]
+            for session in expired:
+                del self._sessions[session.id]
+        for session in expired:
+            if session.exists:
+                session.workspace.remove()
+
+    def create(self, filename: str, size: int, sha256: Optional[str] = None,
+               options: Optional[Dict[str, Any]] = None) -> UploadSession:
+        if size > self.max_bytes:
+            raise DocumentTooLargeError(f"{size} > {self.max_bytes}")
+        self.expire()
+        workspace = self.workspace_manager.create()
+        try:
+            session = UploadSession.create(workspace, filename, size, sha256, options)
+        except Exception:
+            workspace.remove()
+            raise
+        with self._lock:
+            self._sessions[session.id] = session
+        return session
+
+    def get(self, upload_id: str) -> Optional[UploadSession]:
+        with self._lock:
+            session = self._sessions.get(upload_id)
+        if session is None:
+            session = self._load(upload_id)
+            if session is None:
+                return None
+            with self._lock:
+                session = self._sessions.setdefault(upload_id, session)
+        elif not session.exists:
+            # Сессию завершил или отменил другой процесс
+            with self._lock:
+                self._sessions.pop(upload_id, None)
+            return None
+        if self._expired(session, time.time()):
+            self.discard(upload_id)
+            return None
+        return session
+
+    def finish(self, upload_id: str):
+        """Снимает сессию с учета: каталог передан задаче OCR"""
+        with self._lock:
+            session = self._sessions.pop(upload_id, None)
+        session = session or self._load(upload_id)
+        if session is not None:
+            session.close()
+
+    def discard(self, upload_id: str):
+        """Отменяет сессию и удаляет принятые данные"""
+        with self._lock:
+            session = self._sessions.pop(upload_id, None)
+        session = session or self._load(upload_id)
+        # Каталог без файла сессии уже принадлежит задаче OCR - его не трогаем
+        if session is not None and session.exists:
+            session.workspace.remove()
+
+    def is_active(self, workspace_id: str) -> bool:
+        """Каталог принадлежит неистекшей сессии загрузки (любого процесса)"""
+        session = self._load(workspace_id)
+        return session is not None and not self._expired(session, time.time())
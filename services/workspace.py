@@ -0,0 +1,224 @@
+"""
+Job Workspaces for Mistral OCR App
+Отдельный каталог файлов для каждой задачи и атомарная запись артефактов
+"""
+import contextvars
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from werkzeug.utils import secure_filename
+
+WORKSPACE_ID_RE = re.compile(r'[0-9a-f]{32}')
+TMP_MARKER = '.tmp-'
+# Файл-маркер выполняющейся задачи (см. WorkspaceHeartbeat)
+ACTIVE_MARKER = 'job.active'
+
+_current_workspace: contextvars.ContextVar = contextvars.ContextVar('ocr_workspace', default=None)
+
+
+@contextmanager
+def atomic_path(path: str):
+    """Временный путь рядом с path; после успешного выхода файл атомарно переименовывается в path.
+
+    Читатели видят либо прежний файл, либо полностью записанный новый. При ошибке
+    временный файл удаляется.
+    """
+    tmp_path = f"{path}{TMP_MARKER}{os.getpid()}-{threading.get_ident()}"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def atomic_write(path: str, data, encoding: str = 'utf-8') -> str:
+    """Атомарно записывает bytes или str в path"""
+    with atomic_path(path) as tmp_path:
+        if isinstance(data, str):
+            with open(tmp_path, 'w', encoding=encoding) as f:
+                f.write(data)
+        else:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+    return path
+
+
+def artifact_ref(path: str) -> str:
+    """Публичная ссылка на файл: ``<workspace_id>/<имя>`` для файлов задачи, иначе имя файла.
+
+    Используется в URL /image/..., /download/... и в полях markdown_file/json_file.
+    """
+    parent = os.path.basename(os.path.dirname(path))
+    if WORKSPACE_ID_RE.fullmatch(parent):
+        return f"{parent}/{os.path.basename(path)}"
+    return os.path.basename(path)
+
+
+class JobWorkspace:
+    """Каталог файлов одной задачи: исходный документ, изображения, результаты.
+
+    Имена внутри каталога не пересекаются с другими задачами, поэтому фиксированные
+    имена (pdf_page_0.png, extracted_page_0_img_0.png, исходное имя загрузки)
+    безопасны при параллельной обработке в потоках и процессах.
+    """
+
+    def __init__(self, root_dir: str, workspace_id: str):
+        self.id = workspace_id
+        self.path = os.path.join(root_dir, workspace_id)
+        self._cleanups: List[Tuple[Callable, tuple]] = []
+        os.makedirs(self.path, exist_ok=True)
+
+    def file_path(self, filename: str) -> str:
+        """Путь файла в каталоге задачи (имя проходит secure_filename)"""
+        return os.path.join(self.path, secure_filename(filename))
+
+    def add_cleanup(self, callback: Callable, *args):
+        """Регистрирует действие, выполняемое при завершении задачи"""
+        self._cleanups.append((callback, args))
+
+    def cleanup(self, keep_results: bool = True):
+        """Хук завершения задачи: зарегистрированные действия и незавершенные временные файлы.
+
+        keep_results=False (задача не удалась) - каталог удаляется целиком.
+        """
+        while self._cleanups:
+            callback, args = self._cleanups.pop()
+            try:
+                callback(*args)
+            except Exception:
+                pass  # Ошибка одного действия не должна мешать остальным (действия логируют сами)
+        if not keep_results:
+            self.remove()
+            return
+        try:
+            for name in os.listdir(self.path):
+                if TMP_MARKER in name:
+                    os.remove(os.path.join(self.path, name))
+        except OSError:
+            pass
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class WorkspaceManager:
+    """Создает каталоги задач в root_dir и разрешает ссылки на артефакты в пути.
+
+    Ссылки без каталога задачи (просто имя файла) разрешаются в legacy_dir -
+    так продолжают работать файлы, созданные вне задач.
+    """
+
+    def __init__(self, root_dir: str, legacy_dir: str):
+        self.root_dir = root_dir
+        self.legacy_dir = legacy_dir
+        os.makedirs(root_dir, exist_ok=True)
+
+    def create(self) -> JobWorkspace:
+        return JobWorkspace(self.root_dir, uuid.uuid4().hex)
+
+    def open(self, workspace_id: str) -> Optional[JobWorkspace]:
+        """Существующий каталог задачи (например, созданный другим процессом); None - если его нет"""
+        if not WORKSPACE_ID_RE.fullmatch(workspace_id or '') or not os.path.isdir(os.path.join(self.root_dir, workspace_id)):
+            return None
+        return JobWorkspace(self.root_dir, workspace_id)
+
+    def resolve(self, ref: str) -> Optional[str]:
+        """Путь файла по ссылке ``<workspace_id>/<имя>`` или ``<имя>``; None - если ссылка недопустима"""
+        parts = (ref or '').split('/')
+        filename = parts[-1]
+        if not filename or secure_filename(filename) != filename:
+            return None
+        if len(parts) == 1:
+            return os.path.join(self.legacy_dir, filename)
+        if len(parts) == 2 and WORKSPACE_ID_RE.fullmatch(parts[0]):
+            return os.path.join(self.root_dir, parts[0], filename)
+        return None
+
+
+class WorkspaceHeartbeat:
+    """Маркеры выполняющихся задач, видимые всем процессам.
+
+    На время hold() в каталоге задачи лежит файл job.active, mtime которого фоновый
+    поток обновляет каждые interval_seconds секунд. Фоновая очистка любого процесса
+    пропускает каталог со свежим маркером; маркер процесса, завершившегося аварийно,
+    перестает обновляться и через некоторое время не учитывается.
+    """
+
+    def __init__(self, interval_seconds: float = 30):
+        self.interval_seconds = interval_seconds
+        self._holders: Dict[str, int] = {}  # Путь маркера -> число удерживающих задач
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _touch(path: str):
+        try:
+            with open(path, 'a'):
+                pass
+            os.utime(path)
+        except OSError:
+            pass  # Каталог уже удален (задача завершилась ошибкой)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval_seconds)
+            with self._lock:
+                paths = list(self._holders)
+            for path in paths:
+                self._touch(path)
+
+    @contextmanager
+    def hold(self, workspace: JobWorkspace):
+        """Отмечает каталог активным на время выполнения задачи"""
+        path = os.path.join(workspace.path, ACTIVE_MARKER)
+        with self._lock:
+            self._holders[path] = self._holders.get(path, 0) + 1
+            if self._thread is None and self.interval_seconds > 0:
+                self._thread = threading.Thread(target=self._run, daemon=True, name='workspace-heartbeat')
+                self._thread.start()
+        self._touch(path)
+        try:
+            yield workspace
+        finally:
+            with self._lock:
+                self._holders[path] -= 1
+                if not self._holders[path]:
+                    del self._holders[path]
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+
+def marker_is_fresh(workspace_path: str, max_age_seconds: float, now: Optional[float] = None) -> bool:
+    """В каталоге есть маркер выполняющейся задачи, обновленный не раньше max_age_seconds назад"""
+    try:
+        mtime = os.stat(os.path.join(workspace_path, ACTIVE_MARKER)).st_mtime
+    except OSError:
+        return False
+    return (now if now is not None else time.time()) - mtime <= max_age_seconds
+
+
+def current_workspace() -> Optional[JobWorkspace]:
+    """Каталог задачи, выполняющейся в текущем потоке (None вне задачи)"""
+    return _current_workspace.get()
+
+
+@contextmanager
+def use_workspace(workspace: Optional[JobWorkspace]):
+    """Делает workspace текущим на время выполнения задачи"""
+    token = _current_workspace.set(workspace)
+    try:
+        yield workspace
+    finally:
+        _current_workspace.reset(token)
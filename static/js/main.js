@@ -16,18 +16,27 @@ document.addEventListener('DOMContentLoaded', function() {
         submitButton.disabled = true;
 
         const formData = new FormData(form);
+        const file = formData.get('document');
 
-        fetch('/upload', {
-            method: 'POST',
-            body: formData
-        })
-        .then(response => {
-            // Проверяем, что ответ корректный
-            if (!response.ok) {
-                throw new Error('Ошибка сервера: ' + response.statusText);
-            }
-            return response.json();
-        })
+        // Большие файлы загружаются частями (resumable_upload.js), остальные - одним запросом
+        const request = (typeof resumableUploadSupported === 'function' && resumableUploadSupported(file))
+            ? resumableUpload(file, {
+                  includeImages: formData.get('include_images') !== null,
+                  exportFormat: formData.get('export_format') || 'embedded'
+              }, () => {}).then(text => JSON.parse(text))
+            : fetch('/upload', {
+                  method: 'POST',
+                  body: formData
+              })
+              .then(response => {
+                  // Проверяем, что ответ корректный
+                  if (!response.ok) {
+                      throw new Error('Ошибка сервера: ' + response.statusText);
+                  }
+                  return response.json();
+              });
+
+        request
         .then(data => {
             // Скрываем индикатор загрузки
             loadingIndicator.style.display = 'none';
@@ -60,7 +69,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 let message = 'Документ успешно обработан! Файл загружен.';
                 
                 // Добавляем статистику если доступна
-                if (data.processing_info) {
+                if (data.processing_info && data.processing_info.export_format) {
                     const info = data.processing_info;
                     message += `\n\n📊 Статистика обработки:`;
                     message += `\n🖼️ Изображений найдено: ${info.total_images}`;
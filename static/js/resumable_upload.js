@@ -0,0 +1,71 @@
+// Возобновляемая загрузка больших файлов частями через /uploads:
+// сессия -> части PUT с заголовком Upload-Offset -> /uploads/<id>/complete.
+// После обрыва соединения загрузка продолжается с числа байтов, принятых сервером.
+// SHA-256 файла считает сервер по мере приема частей: браузер не читает файл целиком в память.
+
+const RESUMABLE_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+const RESUMABLE_UPLOAD_MAX_RETRIES = 5;
+
+function resumableUploadSupported(file) {
+    return Boolean(file && file.size >= RESUMABLE_UPLOAD_THRESHOLD && window.fetch);
+}
+
+async function readJson(response) {
+    try {
+        return await response.json();
+    } catch (e) {
+        return {status: 'error', message: 'Ошибка сервера: ' + response.statusText};
+    }
+}
+
+// Возвращает текст ответа /uploads/<id>/complete?wait=true (формат как у /upload)
+async function resumableUpload(file, options, onProgress) {
+    const createResponse = await fetch('/uploads', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({
+            filename: file.name,
+            size: file.size,
+            include_images: options.includeImages,
+            export_format: options.exportFormat
+        })
+    });
+    const session = await readJson(createResponse);
+    if (!createResponse.ok) {
+        throw new Error(session.message || 'Не удалось начать загрузку');
+    }
+
+    const uploadUrl = session.upload_url;
+    let offset = session.upload.offset;
+    let failures = 0;
+    while (offset < file.size) {
+        try {
+            const response = await fetch(uploadUrl, {
+                method: 'PUT',
+                headers: {'Upload-Offset': String(offset), 'Content-Type': 'application/octet-stream'},
+                body: file.slice(offset, offset + session.chunk_size)
+            });
+            const data = await readJson(response);
+            // 409 - сервер принял другое число байтов: продолжаем с его смещения
+            if (!(response.ok || response.status === 409) || !data.upload) {
+                throw new Error(data.message || 'Ошибка загрузки части файла');
+            }
+            offset = data.upload.offset;
+            failures = 0;
+            onProgress((offset / file.size) * 100);
+        } catch (error) {
+            failures += 1;
+            if (failures > RESUMABLE_UPLOAD_MAX_RETRIES) {
+                throw error;
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+            const status = await fetch(uploadUrl).catch(() => null);
+            if (status && status.ok) {
+                offset = (await readJson(status)).upload.offset;
+            }
+        }
+    }
+
+    const completeResponse = await fetch(`${uploadUrl}/complete?wait=true`, {method: 'POST'});
+    return completeResponse.text();
+}
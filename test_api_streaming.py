@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Тест потоковых ответов /api/json и /api/markdown
+Документ отдается локальным HTTP-сервером и обрабатывается через stub-сервер OCR;
+обработка последней страницы (или OCR следующих частей) задерживается до сигнала теста:
+первая страница должна прийти клиенту раньше, итоговая строка NDJSON - после завершения задачи
+"""
+
+import functools
+import json
+import os
+import sys
+import tempfile
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+TEST_DIR = tempfile.mkdtemp(prefix="mistral_ocr_stream_test_")
+os.environ.setdefault("UPLOAD_FOLDER", TEST_DIR)
+os.environ.setdefault("SETTINGS_DB_PATH", os.path.join(TEST_DIR, "settings.db"))
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app as ocr_app  # noqa: E402
+from benchmarks.synthetic import make_pdf  # noqa: E402
+from services.mistral_client import MistralClientManager  # noqa: E402
+from services.stub_ocr import StubOCREngine, start_stub_server  # noqa: E402
+
+DOCS_DIR = os.path.join(TEST_DIR, 'docs')
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_document_server():
+    os.makedirs(DOCS_DIR, exist_ok=True)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(QuietHandler, directory=DOCS_DIR))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class HeldPage:
+    """Подменяет process_api_page: обработка страницы page_index ждет release() теста"""
+
+    def __init__(self, page_index):
+        self.page_index = page_index
+        self.original = ocr_app.process_api_page
+        self.entered = threading.Event()
+        self.released = threading.Event()
+
+    def __call__(self, page, *args, **kwargs):
+        if page.index == self.page_index:
+            self.entered.set()
+            assert self.released.wait(30)
+        return self.original(page, *args, **kwargs)
+
+    def __enter__(self):
+        ocr_app.process_api_page = self
+        return self
+
+    def __exit__(self, *exc):
+        self.released.set()
+        ocr_app.process_api_page = self.original
+
+
+def configure_stub(server):
+    ocr_app.app.config['MISTRAL_API_KEY'] = 'test-key'
+    ocr_app.app.config['MISTRAL_SERVER_URL'] = f"http://127.0.0.1:{server.server_address[1]}"
+    ocr_app.mistral_client_manager = MistralClientManager(server_url=ocr_app.app.config['MISTRAL_SERVER_URL'])
+
+
+def stream_while_job_holds(path, seed, held, pages=3):
+    """Возвращает (первая часть ответа, полученная, пока задача стоит в held, остальные части)"""
+    ocr_server = start_stub_server(StubOCREngine(seed=seed))
+    doc_server = start_document_server()
+    try:
+        configure_stub(ocr_server)
+        name = f"stream_{seed}.pdf"
+        make_pdf(os.path.join(DOCS_DIR, name), pages=pages, images_per_page=1, seed=seed)
+        url = f"http://127.0.0.1:{doc_server.server_address[1]}/{name}"
+        client = ocr_app.app.test_client()
+        with held:
+            response = client.get(f"{path}?stream=1&url={url}", buffered=False)
+            assert response.status_code == 200
+            chunks = response.iter_encoded()
+            first = next(chunks)
+            # Первая страница получена, а задача дошла до задержанного шага и стоит на нем
+            assert held.entered.wait(30) and not held.released.is_set()
+            held.released.set()
+            rest = list(chunks)
+        response.close()
+        return response, first, rest
+    finally:
+        ocr_server.shutdown()
+        doc_server.shutdown()
+
+
+def test_ndjson_pages_arrive_before_later_pages_finish():
+    """NDJSON: строка первой страницы до окончания обработки последней, итоговая строка - после"""
+    response, first, rest = stream_while_job_holds('/api/json', seed=101, held=HeldPage(2))
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in b''.join([first] + rest).splitlines()]
+    assert json.loads(first.splitlines()[0])['type'] == 'page'
+    assert [line['type'] for line in lines] == ['page', 'page', 'page', 'summary']
+    assert [line['index'] for line in lines[:3]] == [0, 1, 2]
+    assert lines[-1]['status'] == 'success'
+    assert lines[-1]['page_count'] == 3
+
+
+class HeldChunk:
+    """Подменяет submit_document_for_ocr: OCR частей, кроме первой, ждет release() теста"""
+
+    def __init__(self):
+        self.original = ocr_app.submit_document_for_ocr
+        self.entered = threading.Event()
+        self.released = threading.Event()
+
+    def __call__(self, client, file_path, *args, **kwargs):
+        if os.path.basename(file_path).startswith('chunk_') and not file_path.endswith('_0_1.pdf'):
+            # Первая часть (страницы 0-1) распознается сразу, остальные - после release()
+            self.entered.set()
+            assert self.released.wait(30)
+        return self.original(client, file_path, *args, **kwargs)
+
+    def __enter__(self):
+        ocr_app.submit_document_for_ocr = self
+        return self
+
+    def __exit__(self, *exc):
+        self.released.set()
+        ocr_app.submit_document_for_ocr = self.original
+
+
+def test_ndjson_chunks_publish_in_order():
+    """Режим частей: страницы первой части приходят, пока следующие части еще в OCR"""
+    settings = {key: ocr_app.get_app_setting(key) for key in ('parallel_processing', 'chunk_size_pages')}
+    ocr_app.settings_manager.set_setting('parallel_processing', True)
+    ocr_app.settings_manager.set_setting('chunk_size_pages', 2)
+    try:
+        response, first, rest = stream_while_job_holds('/api/json', seed=103, held=HeldChunk(), pages=5)
+    finally:
+        for key, value in settings.items():
+            if value is None:
+                ocr_app.settings_manager.delete_setting(key)
+            else:
+                ocr_app.settings_manager.set_setting(key, value)
+    assert json.loads(first.splitlines()[0])['index'] == 0
+    lines = [json.loads(line) for line in b''.join([first] + rest).splitlines()]
+    assert [line.get('index') for line in lines] == [0, 1, 2, 3, 4, None]
+    assert lines[-1]['page_count'] == 5
+    # id изображений сквозные по всему документу
+    image_ids = [img['id'] for line in lines[:-1] for img in line['images']]
+    assert len(image_ids) == 5 and len(set(image_ids)) == 5
+
+
+def test_markdown_first_page_before_later_pages_finish():
+    """Markdown: первая страница до окончания обработки последней, страницы в исходном порядке"""
+    response, first, rest = stream_while_job_holds('/api/markdown', seed=102, held=HeldPage(2))
+    assert response.mimetype == 'text/markdown'
+    assert first.decode('utf-8').startswith('# Страница 1')
+    markdown = b''.join([first] + rest).decode('utf-8')
+    assert markdown.count(ocr_app.MARKDOWN_PAGE_SEPARATOR) == 2
+    assert markdown.index('# Страница 2') < markdown.index('# Страница 3')
+
+
+def test_failure_before_first_page_keeps_status_code():
+    """Документ не скачался до первой страницы: обычный ответ с ошибкой, а не пустой поток"""
+    doc_server = start_document_server()
+    try:
+        url = f"http://127.0.0.1:{doc_server.server_address[1]}/missing.pdf"
+        response = ocr_app.app.test_client().get(f"/api/json?stream=1&url={url}")
+    finally:
+        doc_server.shutdown()
+    assert response.status_code >= 400
+    assert response.get_json()['status'] == 'error'
+
+
+def main():
+    """Основная функция тестирования"""
+    for test in (test_ndjson_pages_arrive_before_later_pages_finish,
+                 test_ndjson_chunks_publish_in_order,
+                 test_markdown_first_page_before_later_pages_finish,
+                 test_failure_before_first_page_keeps_status_code):
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
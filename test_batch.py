@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Тест пакетной обработки /api/batch
+Два документа отдаются локальным HTTP-сервером и обрабатываются через stub-сервер OCR,
+третий URL недоступен: его ошибка не прерывает пакет, итоговая строка NDJSON считает
+элементы по состояниям, а manifest.json архива перечисляет все элементы; если прием
+пакета прерван ошибкой, каталоги уже принятых файлов удаляются
+"""
+
+import functools
+import io
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import zipfile
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+TEST_DIR = tempfile.mkdtemp(prefix="mistral_ocr_batch_test_")
+os.environ.setdefault("UPLOAD_FOLDER", TEST_DIR)
+os.environ.setdefault("SETTINGS_DB_PATH", os.path.join(TEST_DIR, "settings.db"))
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app as ocr_app  # noqa: E402
+from benchmarks.synthetic import make_pdf  # noqa: E402
+from services.mistral_client import MistralClientManager  # noqa: E402
+from services.stub_ocr import StubOCREngine, start_stub_server  # noqa: E402
+
+DOCS_DIR = os.path.join(TEST_DIR, 'docs')
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_document_server():
+    os.makedirs(DOCS_DIR, exist_ok=True)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(QuietHandler, directory=DOCS_DIR))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def configure_stub(server):
+    ocr_app.app.config['MISTRAL_API_KEY'] = 'test-key'
+    ocr_app.app.config['MISTRAL_SERVER_URL'] = f"http://127.0.0.1:{server.server_address[1]}"
+    ocr_app.mistral_client_manager = MistralClientManager(server_url=ocr_app.app.config['MISTRAL_SERVER_URL'])
+
+
+def unreachable_url():
+    """URL на порт, который никто не слушает: соединение отклоняется"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}/missing.pdf"
+
+
+def test_batch_with_unreachable_url():
+    """Недоступный URL - ошибка только своего элемента; NDJSON и ZIP отражают все элементы"""
+    ocr_server = start_stub_server(StubOCREngine(seed=25))
+    doc_server = start_document_server()
+    try:
+        configure_stub(ocr_server)
+        urls = []
+        for seed in (251, 252):
+            name = f"batch_{seed}.pdf"
+            make_pdf(os.path.join(DOCS_DIR, name), pages=2, images_per_page=1, seed=seed)
+            urls.append(f"http://127.0.0.1:{doc_server.server_address[1]}/{name}")
+        urls.insert(1, unreachable_url())
+
+        client = ocr_app.app.test_client()
+        response = client.post('/api/batch?results=ndjson', json={'urls': urls, 'concurrency': 2})
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    finally:
+        ocr_server.shutdown()
+        doc_server.shutdown()
+
+    items = {line['index']: line for line in lines if line['type'] == 'item'}
+    assert sorted(items) == [0, 1, 2]
+    # Ошибка загрузки не мешает остальным элементам пакета
+    assert items[1]['state'] == 'failed'
+    assert items[1]['source'] == urls[1]
+    assert items[1]['message']
+    assert 'data' not in items[1]
+    for index in (0, 2):
+        assert items[index]['state'] == 'done'
+        assert items[index]['source'] == urls[index]
+        assert len(items[index]['data']['pages']) == 2
+
+    summary = lines[-1]
+    assert summary['type'] == 'summary'
+    assert (summary['total'], summary['done'], summary['failed']) == (3, 2, 1)
+
+    batch_id = summary['batch_id']
+    response = client.get(f'/api/batch/{batch_id}/results?format=zip')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/zip'
+    with zipfile.ZipFile(io.BytesIO(response.get_data())) as archive:
+        assert sorted(archive.namelist()) == ['0001_batch_251.json', '0003_batch_252.json', 'manifest.json']
+        manifest = json.loads(archive.read('manifest.json'))
+        result = json.loads(archive.read('0001_batch_251.json'))
+    assert manifest['id'] == batch_id
+    assert (manifest['total'], manifest['done'], manifest['failed']) == (3, 2, 1)
+    assert [item['state'] for item in manifest['items']] == ['done', 'failed', 'done']
+    assert [item['source'] for item in manifest['items']] == urls
+    assert manifest['items'][1]['message'] == items[1]['message']
+    assert len(result['pages']) == 2
+
+
+def workspace_dirs():
+    """Каталоги задач (без каталога приема загрузок)"""
+    root = ocr_app.app.config['JOB_WORKSPACE_DIR']
+    spool_dir = os.path.abspath(ocr_app.app.config['UPLOAD_SPOOL_DIR'])
+    return {name for name in os.listdir(root) if os.path.abspath(os.path.join(root, name)) != spool_dir}
+
+
+def test_failed_submission_releases_claimed_files():
+    """Ошибка на втором файле пакета: каталог первого (уже принятого) файла удаляется"""
+    original = ocr_app.prepare_batch_file
+    calls = []
+
+    def failing_prepare(file, include_images):
+        calls.append(file.filename)
+        if len(calls) == 2:
+            raise OSError("тест: не удалось сохранить файл")
+        return original(file, include_images)
+
+    pdf = b'%PDF-1.4\n% batch test\n'
+    workspaces_before = workspace_dirs()
+    ocr_app.prepare_batch_file = failing_prepare
+    try:
+        response = ocr_app.app.test_client().post('/api/batch', data={
+            'documents': [(io.BytesIO(pdf), 'first.pdf'), (io.BytesIO(pdf), 'second.pdf')],
+        }, content_type='multipart/form-data')
+    finally:
+        ocr_app.prepare_batch_file = original
+    assert calls == ['first.pdf', 'second.pdf']
+    assert response.status_code == 500
+    assert response.get_json()['status'] == 'error'
+    assert workspace_dirs() == workspaces_before
+    assert os.listdir(ocr_app.app.config['UPLOAD_SPOOL_DIR']) == []
+
+
+def main():
+    """Основная функция тестирования"""
+    for test in (test_batch_with_unreachable_url,
+                 test_failed_submission_releases_claimed_files):
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
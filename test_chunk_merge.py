@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Тест объединения страниц OCR-ответов частей документа (merge_chunk_pages)
+Каждая часть нумерует страницы и изображения с нуля: после объединения индексы страниц
+сдвинуты на начало части, id изображений сквозные, ссылки в markdown ведут на новые id;
+временные файлы частей отправляются без подсчета SHA-256 и записи в реестр файлов
+"""
+
+import os
+import sys
+import tempfile
+
+TEST_DIR = tempfile.mkdtemp(prefix="mistral_ocr_merge_test_")
+os.environ.setdefault("UPLOAD_FOLDER", TEST_DIR)
+os.environ.setdefault("SETTINGS_DB_PATH", os.path.join(TEST_DIR, "settings.db"))
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app as ocr_app  # noqa: E402
+import fitz  # noqa: E402
+from benchmarks.synthetic import make_pdf  # noqa: E402
+from mistralai.models import OCRImageObject, OCRPageDimensions, OCRPageObject, OCRResponse, OCRUsageInfo  # noqa: E402
+
+
+def image(image_id, base64_data):
+    return OCRImageObject(id=image_id, top_left_x=0, top_left_y=0, bottom_right_x=10, bottom_right_y=10,
+                          image_base64=base64_data)
+
+
+def page(index, markdown, images):
+    return OCRPageObject(index=index, markdown=markdown, images=images,
+                         dimensions=OCRPageDimensions(dpi=200, height=100, width=100))
+
+
+def response(pages):
+    return OCRResponse(pages=pages, model='mistral-ocr-latest', usage_info=OCRUsageInfo(pages_processed=len(pages)))
+
+
+def test_chunks_with_overlapping_image_ids():
+    """Две части с одинаковыми id изображений (img-0.jpeg, img-1.jpeg в каждой)"""
+    first = response([
+        page(0, "# A\n\n![img-0.jpeg](img-0.jpeg)", [image('img-0.jpeg', 'a0')]),
+        page(1, "![img-1.jpeg](img-1.jpeg) text ![img-2.png](img-2.png)",
+             [image('img-1.jpeg', 'a1'), image('img-2.png', 'a2')]),
+    ])
+    second = response([
+        page(0, "# B\n\n![img-0.jpeg](img-0.jpeg)", [image('img-0.jpeg', 'b0')]),
+        page(1, "no images", []),
+        page(2, "![img-1.jpeg](img-1.jpeg) and ![external](https://example.com/x.png)",
+             [image('img-1.jpeg', 'b1')]),
+    ])
+
+    merged = ocr_app.merge_chunk_pages([(0, first), (20, second)])
+
+    assert [p.index for p in merged] == [0, 1, 20, 21, 22]
+    ids = [img.id for p in merged for img in p.images]
+    assert ids == ['img-0.jpeg', 'img-1.jpeg', 'img-2.png', 'img-3.jpeg', 'img-4.jpeg']
+    # Данные изображения остаются при своем (новом) id
+    assert [img.image_base64 for p in merged for img in p.images] == ['a0', 'a1', 'a2', 'b0', 'b1']
+
+    assert merged[0].markdown == "# A\n\n![img-0.jpeg](img-0.jpeg)"
+    assert merged[1].markdown == "![img-1.jpeg](img-1.jpeg) text ![img-2.png](img-2.png)"
+    assert merged[2].markdown == "# B\n\n![img-3.jpeg](img-3.jpeg)"
+    assert merged[3].markdown == "no images"
+    # Ссылки, не относящиеся к изображениям страницы, не меняются
+    assert merged[4].markdown == "![img-4.jpeg](img-4.jpeg) and ![external](https://example.com/x.png)"
+
+
+def test_source_responses_are_not_modified():
+    """Объединение не меняет ответы частей (страницы копируются)"""
+    chunk = response([page(0, "![img-0.jpeg](img-0.jpeg)", [image('img-0.jpeg', 'x')])])
+    ocr_app.merge_chunk_pages([(0, response([page(0, "", [image('img-0.jpeg', 'y')])])), (1, chunk)])
+    assert chunk.pages[0].index == 0
+    assert chunk.pages[0].images[0].id == 'img-0.jpeg'
+    assert chunk.pages[0].markdown == "![img-0.jpeg](img-0.jpeg)"
+
+
+def test_chunks_skip_hashing_and_registry():
+    """Части документа загружаются без document_hash (реестр не пополняется) и без SHA-256"""
+    uploads = []
+    saved = (ocr_app.upload_and_ocr, ocr_app.compute_file_sha256, ocr_app.app.config['MISTRAL_INLINE_MAX_MB'])
+
+    def fake_upload(client, file_path, include_images=True, document_hash=None):
+        uploads.append(document_hash)
+        with fitz.open(file_path) as doc:
+            pages = [page(i, f"![img-0.jpeg](img-0.jpeg) {i}", [image('img-0.jpeg', 'x')]) for i in range(len(doc))]
+        return response(pages), f"https://files.example/{os.path.basename(file_path)}"
+
+    def no_hash(path):
+        raise AssertionError(f"SHA-256 временной части: {path}")
+
+    pdf_path = os.path.join(TEST_DIR, 'chunks.pdf')
+    make_pdf(pdf_path, pages=5, images_per_page=1)
+    ocr_app.upload_and_ocr, ocr_app.compute_file_sha256 = fake_upload, no_hash
+    ocr_app.app.config['MISTRAL_INLINE_MAX_MB'] = 0  # Части отправляются через files.upload
+    try:
+        parts = list(ocr_app.iter_ocr_pdf_chunks(None, pdf_path, False, chunk_size=2, concurrency=2))
+    finally:
+        ocr_app.upload_and_ocr, ocr_app.compute_file_sha256, ocr_app.app.config['MISTRAL_INLINE_MAX_MB'] = saved
+
+    assert uploads == [None, None, None]
+    assert [p.index for ocr_response, _ in parts for p in ocr_response.pages] == [0, 1, 2, 3, 4]
+    assert [img.id for ocr_response, _ in parts for p in ocr_response.pages for img in p.images] == \
+        [f'img-{i}.jpeg' for i in range(5)]
+    assert not [name for name in os.listdir(TEST_DIR) if name.startswith('chunk_')]
+
+
+def main():
+    """Основная функция тестирования"""
+    for test in (test_chunks_with_overlapping_image_ids,
+                 test_source_responses_are_not_modified,
+                 test_chunks_skip_hashing_and_registry):
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
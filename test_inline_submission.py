@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Тест inline-отправки документов в Mistral OCR
+Поднимает локальный stub-сервер API Mistral и считает обращения к каждому пути:
+малые документы должны уходить одним запросом /v1/ocr, большие - через upload + signed URL,
+а повторная обработка того же документа - без повторной загрузки
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TEST_DIR = tempfile.mkdtemp(prefix="mistral_ocr_test_")
+os.environ.setdefault("UPLOAD_FOLDER", TEST_DIR)
+os.environ.setdefault("SETTINGS_DB_PATH", os.path.join(TEST_DIR, "settings.db"))
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app as ocr_app  # noqa: E402
+from services.mistral_client import MistralClientManager  # noqa: E402
+
+
+class StubMistralHandler(BaseHTTPRequestHandler):
+    """Минимальная реализация путей files/ocr API Mistral"""
+
+    requests_by_path = Counter()
+    ocr_documents = []
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send_json(self, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _count(self, path):
+        with self.lock:
+            self.requests_by_path[path] += 1
+
+    def do_POST(self):
+        body = self._read_body()
+        if self.path == '/v1/files':
+            self._count('files.upload')
+            self._send_json({
+                "id": "file-stub", "object": "file", "bytes": len(body), "created_at": 0,
+                "filename": "document.pdf", "purpose": "ocr", "sample_type": "ocr_input", "source": "upload"
+            })
+        elif self.path == '/v1/ocr':
+            self._count('ocr.process')
+            with self.lock:
+                self.ocr_documents.append(json.loads(body)['document'])
+            self._send_json({
+                "pages": [{"index": 0, "markdown": "# stub", "images": [],
+                           "dimensions": {"dpi": 200, "height": 100, "width": 100}}],
+                "model": "mistral-ocr-latest",
+                "usage_info": {"pages_processed": 1}
+            })
+        else:
+            self.send_error(404)
+
+    def do_GET(self):
+        if self.path.startswith('/v1/files/') and '/url' in self.path:
+            self._count('files.get_signed_url')
+            self._send_json({"url": f"http://{self.headers['Host']}/signed/file-stub"})
+        else:
+            self.send_error(404)
+
+
+def start_stub_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubMistralHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_ocr(server, file_path, inline_max_mb):
+    """Выполняет mistral_ocr_processing против stub-сервера, возвращает счетчики запросов"""
+    StubMistralHandler.requests_by_path.clear()
+    StubMistralHandler.ocr_documents.clear()
+    ocr_app.app.config['MISTRAL_API_KEY'] = 'test-key'
+    ocr_app.app.config['MISTRAL_INLINE_MAX_MB'] = inline_max_mb
+    ocr_app.app.config['MISTRAL_SERVER_URL'] = f"http://127.0.0.1:{server.server_address[1]}"
+    ocr_app.mistral_client_manager = MistralClientManager(server_url=ocr_app.app.config['MISTRAL_SERVER_URL'])
+    result = ocr_app.mistral_ocr_processing(file_path, include_images=False)
+    assert len(result['pages']) == 1
+    return dict(StubMistralHandler.requests_by_path), list(StubMistralHandler.ocr_documents)
+
+
+def write_file(name, content):
+    path = os.path.join(TEST_DIR, name)
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path
+
+
+def test_small_pdf_uses_single_round_trip():
+    """Малый PDF: только ocr.process с document_url в виде data URL"""
+    server = start_stub_server()
+    try:
+        pdf_path = write_file('small.pdf', b'%PDF-1.4\n% stub document\n')
+        counts, documents = run_ocr(server, pdf_path, inline_max_mb=1)
+        assert counts == {'ocr.process': 1}
+        assert documents[0]['type'] == 'document_url'
+        assert documents[0]['document_url'].startswith('data:application/pdf;base64,')
+    finally:
+        server.shutdown()
+
+
+def test_small_image_uses_image_url():
+    """Малое PNG-изображение: ocr.process с image_url"""
+    server = start_stub_server()
+    try:
+        png_path = write_file('small.png', b'\x89PNG\r\n\x1a\n' + b'\x00' * 64)
+        counts, documents = run_ocr(server, png_path, inline_max_mb=1)
+        assert counts == {'ocr.process': 1}
+        assert documents[0]['type'] == 'image_url'
+        assert documents[0]['image_url'].startswith('data:image/png;base64,')
+    finally:
+        server.shutdown()
+
+
+def test_large_pdf_uses_upload_and_signed_url():
+    """PDF больше порога: прежний путь upload + signed URL + ocr.process"""
+    server = start_stub_server()
+    try:
+        pdf_path = write_file('large.pdf', b'%PDF-1.4\n' + b'0' * (64 * 1024))
+        counts, documents = run_ocr(server, pdf_path, inline_max_mb=0.01)
+        assert counts == {'files.upload': 1, 'files.get_signed_url': 1, 'ocr.process': 1}
+        assert documents[0]['document_url'].endswith('/signed/file-stub')
+    finally:
+        server.shutdown()
+
+
+def test_reprocessing_reuses_uploaded_file():
+    """Повторная обработка того же документа: без files.upload, пока file_id действителен"""
+    server = start_stub_server()
+    try:
+        pdf_path = write_file('reused.pdf', b'%PDF-1.4\n' + b'1' * (64 * 1024))
+        first_counts, _ = run_ocr(server, pdf_path, inline_max_mb=0.01)
+        second_counts, _ = run_ocr(server, pdf_path, inline_max_mb=0.01)
+        assert first_counts == {'files.upload': 1, 'files.get_signed_url': 1, 'ocr.process': 1}
+        assert second_counts == {'files.get_signed_url': 1, 'ocr.process': 1}
+    finally:
+        server.shutdown()
+
+
+def main():
+    """Основная функция тестирования"""
+    for test in (test_small_pdf_uses_single_round_trip,
+                 test_small_image_uses_image_url,
+                 test_large_pdf_uses_upload_and_signed_url,
+                 test_reprocessing_reuses_uploaded_file):
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
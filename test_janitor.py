@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Тест фоновой очистки каталогов задач с маркерами выполняющихся задач
+Очистка не знает о задачах других процессов (is_active всегда False): каталог
+со свежим маркером job.active сохраняется, каталог с брошенным маркером удаляется
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+TEST_DIR = tempfile.mkdtemp(prefix="mistral_ocr_janitor_test_")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from services.janitor import ArtifactJanitor  # noqa: E402
+from services.workspace import ACTIVE_MARKER, WorkspaceHeartbeat, WorkspaceManager  # noqa: E402
+
+
+def make_old_workspace(manager, age_seconds=7200):
+    workspace = manager.create()
+    with open(workspace.file_path('result.md'), 'w') as f:
+        f.write('# result')
+    past = time.time() - age_seconds
+    os.utime(workspace.path, (past, past))
+    return workspace
+
+
+def test_sweep_skips_workspaces_held_by_other_process():
+    """Свежий маркер защищает каталог, брошенный маркер и каталог без маркера - нет"""
+    root = tempfile.mkdtemp(dir=TEST_DIR)
+    manager = WorkspaceManager(root, root)
+    heartbeat = WorkspaceHeartbeat(interval_seconds=0.05)
+    janitor = ArtifactJanitor(root, max_age_seconds=3600, interval_seconds=0, min_idle_seconds=0,
+                              active_marker_max_age=1)
+
+    running = make_old_workspace(manager)
+    idle = make_old_workspace(manager)
+    crashed = make_old_workspace(manager)
+    stale_marker = os.path.join(crashed.path, ACTIVE_MARKER)
+    open(stale_marker, 'w').close()
+    past = time.time() - 60
+    os.utime(stale_marker, (past, past))
+    os.utime(crashed.path, (past - 7200, past - 7200))
+
+    with heartbeat.hold(running):
+        marker = os.path.join(running.path, ACTIVE_MARKER)
+        os.utime(marker, (past, past))
+        time.sleep(0.3)  # Фоновый поток обновляет маркер
+        assert time.time() - os.path.getmtime(marker) < 1
+        os.utime(running.path, (past - 7200, past - 7200))
+        stats = janitor.sweep()
+        assert os.path.isdir(running.path)
+        assert not os.path.exists(idle.path)
+        assert not os.path.exists(crashed.path)
+        assert stats['expired'] == 2
+    assert not os.path.exists(marker)  # Маркер снят по завершении задачи
+
+
+def main():
+    """Основная функция тестирования"""
+    test_sweep_skips_workspaces_held_by_other_process()
+    print("✅ test_sweep_skips_workspaces_held_by_other_process")
+
+
+if __name__ == "__main__":
+    main()
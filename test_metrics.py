@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Тест записи метрик запросов
+In-flight gauge записывается в sqlite в начале запроса, счетчик статусов, длительность и
+gauge - одной транзакцией в конце; /metrics в другом процессе видит выполняющийся запрос
+"""
+
+import multiprocessing
+import os
+import sys
+import tempfile
+
+TEST_DIR = tempfile.mkdtemp(prefix="mistral_ocr_metrics_test_")
+os.environ.setdefault("UPLOAD_FOLDER", TEST_DIR)
+os.environ.setdefault("SETTINGS_DB_PATH", os.path.join(TEST_DIR, "settings.db"))
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app as ocr_app  # noqa: E402
+from services.metrics import MetricsRegistry  # noqa: E402
+
+
+class CountingRegistry(MetricsRegistry):
+    """Считает транзакции записи метрик"""
+
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        self.writes = 0
+
+    def apply(self, ops, local_gauges=()):
+        if ops or local_gauges:
+            self.writes += 1
+        super().apply(ops, local_gauges)
+
+
+def sample_value(text, sample):
+    """Значение сэмпла (имя с метками) в выводе /metrics; None - если его нет"""
+    values = dict(line.rsplit(' ', 1) for line in text.splitlines() if not line.startswith('#'))
+    return float(values[sample]) if sample in values else None
+
+
+def test_request_metrics_single_transaction():
+    """Запрос к OCR эндпоинту: запись gauge в начале и одна транзакция с остальными метриками в конце"""
+    original = ocr_app.metrics_registry
+    registry = CountingRegistry(os.path.join(tempfile.mkdtemp(dir=TEST_DIR), 'metrics.db'))
+    ocr_app.metrics_registry = registry
+    try:
+        response = ocr_app.app.test_client().get('/api/json')  # Без url - сразу 400
+        assert response.status_code == 400
+        assert registry.writes == 2
+        text = registry.render()
+        assert sample_value(text, 'ocr_http_requests_total{route="/api/json",status="400"}') == 1
+        assert sample_value(text, 'ocr_in_flight_requests{route="/api/json"}') == 0
+        assert sample_value(text, 'ocr_request_duration_seconds_count{route="/api/json"}') == 1
+    finally:
+        ocr_app.metrics_registry = original
+
+
+def hold_request(started, release):
+    """Выполняется в другом процессе: запрос к /api/json, завершение которого ждет release"""
+    with ocr_app.app.test_request_context('/api/json'):
+        ocr_app.start_request_metrics()
+        started.set()
+        release.wait(30)
+        ocr_app.finish_request_metrics()
+
+
+def test_in_flight_visible_from_other_process():
+    """Запрос выполняется в другом процессе, /metrics выводится в этом"""
+    context = multiprocessing.get_context('spawn')
+    started, release = context.Event(), context.Event()
+    worker = context.Process(target=hold_request, args=(started, release))
+    worker.start()
+    try:
+        assert started.wait(60)
+        text = ocr_app.metrics_registry.render()
+        assert sample_value(text, 'ocr_in_flight_requests{route="/api/json"}') == 1
+    finally:
+        release.set()
+        worker.join(60)
+    assert worker.exitcode == 0
+    # Запрос завершен, а значения завершившегося процесса удаляются при выводе
+    assert not sample_value(ocr_app.metrics_registry.render(), 'ocr_in_flight_requests{route="/api/json"}')
+
+
+def main():
+    """Основная функция тестирования"""
+    for test in (test_request_metrics_single_transaction,
+                 test_in_flight_visible_from_other_process):
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
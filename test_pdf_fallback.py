@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Тест fallback-извлечения изображений из PDF
+Сопоставление изображений API размещениям на странице по цепочке IoU -> ближайший
+центр -> порядок; пул процессов fallback после аварийного завершения воркера
+(BrokenProcessPool) пересоздается, и извлечение повторяется
+"""
+
+import os
+import sys
+import tempfile
+
+TEST_DIR = tempfile.mkdtemp(prefix="mistral_ocr_fallback_test_")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from benchmarks.synthetic import make_pdf  # noqa: E402
+from services import pdf_fallback  # noqa: E402
+
+
+# (описание, targets [(id, bbox или None)], placements [(индекс, bbox)], ожидаемые совпадения)
+MATCH_CASES = [
+    ("IoU: пересекающиеся прямоугольники независимо от порядка",
+     [('a', (0, 0, 10, 10)), ('b', (100, 100, 110, 110))],
+     [(0, (101, 101, 111, 111)), (1, (1, 1, 11, 11))],
+     {'a': 1, 'b': 0}),
+    ("IoU: размещение достается изображению с наибольшим перекрытием",
+     [('a', (0, 0, 10, 10)), ('b', (0, 0, 20, 20))],
+     [(0, (0, 0, 20, 20)), (1, (50, 50, 60, 60))],
+     {'b': 0, 'a': 1}),
+    ("Ближайший центр: bbox без пересечений",
+     [('a', (0, 0, 10, 10)), ('b', (200, 0, 210, 10))],
+     [(0, (190, 20, 200, 30)), (1, (20, 20, 30, 30))],
+     {'a': 1, 'b': 0}),
+    ("Ближайший центр: после IoU выбирается из оставшихся размещений",
+     [('a', (0, 0, 10, 10)), ('b', (12, 0, 22, 10))],
+     [(0, (2, 0, 12, 10)), (1, (100, 0, 110, 10)), (2, (40, 0, 50, 10))],
+     {'a': 0, 'b': 2}),
+    ("Порядок: изображения без координат получают свободные размещения по возрастанию индекса",
+     [('a', None), ('b', None)],
+     [(3, (0, 0, 10, 10)), (1, (20, 20, 30, 30))],
+     {'a': 1, 'b': 3}),
+    ("Порядок: после сопоставления по координатам",
+     [('a', None), ('b', (0, 0, 10, 10))],
+     [(0, (0, 0, 10, 10)), (1, (50, 50, 60, 60))],
+     {'b': 0, 'a': 1}),
+    ("Размещений меньше, чем изображений: лишние остаются без пары",
+     [('a', (0, 0, 10, 10)), ('b', None), ('c', None)],
+     [(0, (0, 0, 10, 10)), (1, (50, 50, 60, 60))],
+     {'a': 0, 'b': 1}),
+    ("На странице нет размещений",
+     [('a', (0, 0, 10, 10)), ('b', None)],
+     [],
+     {}),
+]
+
+
+def test_match_images_to_placements():
+    """Каждая ветка цепочки IoU -> ближайший центр -> порядок"""
+    for description, targets, placements, expected in MATCH_CASES:
+        matches = pdf_fallback.match_images_to_placements(targets, placements)
+        assert matches == expected, f"{description}: {matches} != {expected}"
+
+
+def page_targets(pages, images_per_page):
+    """Изображения API без координат - сопоставляются размещениям по порядку"""
+    return {
+        page: {'dimensions': None, 'images': [{'id': f"img-{page}-{i}.jpeg", 'coordinates': None}
+                                              for i in range(images_per_page)]}
+        for page in range(pages)
+    }
+
+
+def test_broken_pool_is_recreated():
+    """Воркер пула убит: следующий вызов создает новый пул и извлекает все страницы"""
+    pdf_path = os.path.join(TEST_DIR, 'fallback.pdf')
+    make_pdf(pdf_path, pages=4, images_per_page=2)
+    output_dir = tempfile.mkdtemp(dir=TEST_DIR)
+
+    broken = pdf_fallback._get_pool(2)
+    broken.submit(os._exit, 1).exception()  # Аварийное завершение воркера ломает пул
+    assets = pdf_fallback.extract_fallback_assets(pdf_path, page_targets(4, 2), output_dir,
+                                                  max_workers=2, min_pages_per_worker=1)
+    assert pdf_fallback._pool is not broken
+    assert sorted(assets) == [0, 1, 2, 3]
+    for page_assets in assets.values():
+        assert len(page_assets['matches']) == 2
+        assert all(os.path.exists(img['image_path']) for img in page_assets['images'])
+
+
+def main():
+    """Основная функция тестирования"""
+    for test in (test_match_images_to_placements,
+                 test_broken_pool_is_recreated):
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Тест параллельной загрузки документов диапазонами (Range)
+Поднимает локальный HTTP-сервер с поддержкой Range и ограничением скорости на соединение:
+загрузка частями должна давать тот же файл и SHA-256, что и загрузка одним потоком, и быть
+заметно быстрее; сервер без Range обслуживается одним потоком, оборвавшаяся часть докачивается
+"""
+
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TEST_DIR = tempfile.mkdtemp(prefix="mistral_ocr_range_test_")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from services.fetcher import DocumentFetcher  # noqa: E402
+
+DOCUMENT = os.urandom(2 * 1024 * 1024)
+BYTES_PER_SECOND = 4 * 1024 * 1024
+BLOCK_SIZE = 64 * 1024
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Отдает DOCUMENT с ограничением скорости BYTES_PER_SECOND на каждое соединение"""
+
+    protocol_version = 'HTTP/1.1'
+    supports_ranges = True
+    failures_left = 0
+    range_requests = 0
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _parse_range(self):
+        header = self.headers.get('Range')
+        if not self.supports_ranges or not header or not header.startswith('bytes='):
+            return None
+        start, _, end = header[6:].partition('-')
+        start = int(start)
+        end = int(end) if end else len(DOCUMENT) - 1
+        return start, min(end, len(DOCUMENT) - 1)
+
+    def do_GET(self):
+        byte_range = self._parse_range()
+        if byte_range is None:
+            start, end = 0, len(DOCUMENT) - 1
+            self.send_response(200)
+        else:
+            start, end = byte_range
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{end}/{len(DOCUMENT)}")
+        if self.supports_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', '"doc-v1"')
+        self.send_header('Content-Type', 'application/pdf')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+
+        fail = False
+        if byte_range is not None and start > 0:
+            with self.lock:
+                type(self).range_requests += 1
+                if self.failures_left:
+                    type(self).failures_left -= 1
+                    fail = True
+        position = start
+        while position <= end:
+            block = DOCUMENT[position:min(position + BLOCK_SIZE, end + 1)]
+            if fail and position - start >= BLOCK_SIZE:
+                # Обрыв соединения посреди части
+                self.close_connection = True
+                return
+            try:
+                self.wfile.write(block)
+            except ConnectionError:
+                return  # Клиент закрыл ответ, дочитав свою часть
+            position += len(block)
+            time.sleep(len(block) / BYTES_PER_SECOND)
+
+
+def start_server(supports_ranges=True, failures=0):
+    handler = type('BoundRangeHandler', (RangeHandler,), {
+        'supports_ranges': supports_ranges, 'failures_left': failures, 'range_requests': 0,
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def fetch(server, parts, name):
+    fetcher = DocumentFetcher(max_bytes=64 * 1024 * 1024, chunk_size=BLOCK_SIZE,
+                              range_parts=parts, range_min_bytes=1024 * 1024)
+    url = f"http://127.0.0.1:{server.server_address[1]}/document.pdf"
+    save_path = os.path.join(TEST_DIR, name)
+    started = time.perf_counter()
+    result = fetcher.fetch(url, save_path)
+    elapsed = time.perf_counter() - started
+    with open(save_path, 'rb') as f:
+        assert f.read() == DOCUMENT, name
+    assert result.sha256 == hashlib.sha256(DOCUMENT).hexdigest()
+    assert result.size == result.downloaded_bytes == len(DOCUMENT)
+    assert not [n for n in os.listdir(TEST_DIR) if '.tmp-' in n]
+    return elapsed
+
+
+def test_ranged_download_is_faster():
+    """4 части против одного потока: тот же файл, время заметно меньше"""
+    server = start_server()
+    try:
+        single = fetch(server, 1, 'single.pdf')
+        ranged = fetch(server, 4, 'ranged.pdf')
+    finally:
+        server.shutdown()
+    print(f"  один поток: {single:.2f} c, 4 части: {ranged:.2f} c ({single / ranged:.1f}x)")
+    assert single / ranged >= 2.0, (single, ranged)
+    assert server.RequestHandlerClass.range_requests == 3
+
+
+def test_server_without_ranges_uses_single_stream():
+    """Сервер без Range: ответ 200 на bytes=0-, документ скачивается одним запросом"""
+    server = start_server(supports_ranges=False)
+    try:
+        fetch(server, 4, 'no_ranges.pdf')
+    finally:
+        server.shutdown()
+    assert server.RequestHandlerClass.range_requests == 0
+
+
+def test_failed_range_is_resumed():
+    """Обрыв двух частей: они докачиваются с места обрыва, файл совпадает с исходным"""
+    server = start_server(failures=2)
+    try:
+        fetch(server, 4, 'resumed.pdf')
+    finally:
+        server.shutdown()
+    assert server.RequestHandlerClass.failures_left == 0
+    assert server.RequestHandlerClass.range_requests == 5
+
+
+def main():
+    """Основная функция тестирования"""
+    for test in (test_ranged_download_is_faster,
+                 test_server_without_ranges_uses_single_stream,
+                 test_failed_range_is_resumed):
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Тест восстановления результата OCR из кэша после удаления исходного каталога задачи
+Документ обрабатывается через stub-сервер OCR, каталог первой задачи удаляется (как при
+вытеснении фоновой очисткой), повторная обработка берет результат из кэша: ссылки на
+изображения в markdown страниц и в файле .md должны указывать на новый каталог
+"""
+
+import os
+import re
+import sys
+import tempfile
+
+TEST_DIR = tempfile.mkdtemp(prefix="mistral_ocr_cache_test_")
+os.environ.setdefault("UPLOAD_FOLDER", TEST_DIR)
+os.environ.setdefault("SETTINGS_DB_PATH", os.path.join(TEST_DIR, "settings.db"))
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app as ocr_app  # noqa: E402
+from benchmarks.synthetic import make_pdf  # noqa: E402
+from services.mistral_client import MistralClientManager  # noqa: E402
+from services.stub_ocr import StubOCREngine, start_stub_server  # noqa: E402
+
+IMAGE_URL_RE = re.compile(r'/image/([0-9a-f]{32})/[^)\s]+')
+
+
+def run_job(pdf_path):
+    """Копирует документ в новый каталог задачи и выполняет задачу OCR в формате со ссылками"""
+    workspace = ocr_app.workspace_manager.create()
+    file_path = workspace.file_path(os.path.basename(pdf_path))
+    with open(pdf_path, 'rb') as src, open(file_path, 'wb') as dst:
+        dst.write(src.read())
+    result = ocr_app.run_ocr_job(workspace, file_path, include_images=True, export_format='links')
+    return workspace, result
+
+
+def test_cache_hit_after_source_workspace_removed():
+    """Кэш-попадание после удаления каталога первой задачи: ссылки ведут на восстановленные файлы"""
+    server = start_stub_server(StubOCREngine(seed=1))
+    try:
+        ocr_app.app.config['MISTRAL_API_KEY'] = 'test-key'
+        ocr_app.app.config['MISTRAL_SERVER_URL'] = f"http://127.0.0.1:{server.server_address[1]}"
+        ocr_app.mistral_client_manager = MistralClientManager(server_url=ocr_app.app.config['MISTRAL_SERVER_URL'])
+        pdf_path = os.path.join(TEST_DIR, 'cached.pdf')
+        make_pdf(pdf_path, pages=2, images_per_page=2, seed=7)
+
+        first_workspace, first = run_job(pdf_path)
+        assert not first['from_cache']
+        assert set(IMAGE_URL_RE.findall(first['pages'][0]['markdown'])) == {first_workspace.id}
+        first_workspace.remove()
+
+        second_workspace, second = run_job(pdf_path)
+        assert second['from_cache']
+        assert second_workspace.id != first_workspace.id
+
+        urls = [m.group(0) for page in second['pages'] for m in IMAGE_URL_RE.finditer(page['markdown'])]
+        assert urls
+        assert {IMAGE_URL_RE.match(url).group(1) for url in urls} == {second_workspace.id}
+        client = ocr_app.app.test_client()
+        for url in urls:
+            response = client.get(url)
+            assert response.status_code == 200
+            assert response.mimetype != 'image/svg+xml', url  # Не заглушка "Изображение не найдено"
+
+        markdown_path = ocr_app.workspace_manager.resolve(second['markdown_file'])
+        with open(markdown_path, encoding='utf-8') as f:
+            markdown = f.read()
+        assert set(IMAGE_URL_RE.findall(markdown)) == {second_workspace.id}
+    finally:
+        server.shutdown()
+
+
+def main():
+    """Основная функция тестирования"""
+    test_cache_hit_after_source_workspace_removed()
+    print("✅ test_cache_hit_after_source_workspace_removed")
+
+
+if __name__ == "__main__":
+    main()
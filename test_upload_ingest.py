@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Тест приема загружаемых файлов через /jobs (app.test_client)
+Файл multipart пишется сразу в каталог приема: превышение лимита дает 413 (и по
+Content-Length, и при приеме без него), несовпадение содержимого с расширением - 400,
+в каталоге приема после запроса не остается файлов, принятый файл переносится в каталог задачи
+и передается задаче открытым вместе с SHA-256
+"""
+
+import hashlib
+import io
+import os
+import sys
+import tempfile
+
+TEST_DIR = tempfile.mkdtemp(prefix="mistral_ocr_ingest_test_")
+os.environ.setdefault("UPLOAD_FOLDER", TEST_DIR)
+os.environ.setdefault("SETTINGS_DB_PATH", os.path.join(TEST_DIR, "settings.db"))
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app as ocr_app  # noqa: E402
+
+MAX_BYTES = 64 * 1024
+PDF = b'%PDF-1.4\n% ingest test\n' + b'0' * 1024
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 1024
+BOUNDARY = 'ingest-test-boundary'
+
+
+class IngestConfig:
+    """Отдельный каталог приема и малый лимит размера на время теста"""
+
+    def __enter__(self):
+        self.saved = {key: ocr_app.app.config[key] for key in ('UPLOAD_SPOOL_DIR', 'MAX_CONTENT_LENGTH')}
+        self.spool_dir = tempfile.mkdtemp(dir=TEST_DIR)
+        ocr_app.app.config['UPLOAD_SPOOL_DIR'] = self.spool_dir
+        ocr_app.app.config['MAX_CONTENT_LENGTH'] = MAX_BYTES
+        return self
+
+    def __exit__(self, *exc):
+        ocr_app.app.config.update(self.saved)
+
+    def spooled(self):
+        return os.listdir(self.spool_dir)
+
+
+def multipart_body(filename, content):
+    return (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="processing_type"\r\n\r\nfile\r\n'
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="document"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode() + content + f'\r\n--{BOUNDARY}--\r\n'.encode()
+
+
+def post_document(filename, content):
+    return ocr_app.app.test_client().post('/jobs', data={
+        'processing_type': 'file',
+        'document': (io.BytesIO(content), filename),
+    }, content_type='multipart/form-data')
+
+
+def test_too_large_by_content_length():
+    """Content-Length больше лимита: 413 до приема файла"""
+    with IngestConfig() as config:
+        response = post_document('big.pdf', PDF + b'0' * MAX_BYTES)
+        assert response.status_code == 413
+        assert response.get_json()['status'] == 'error'
+        assert config.spooled() == []
+
+
+def test_too_large_without_content_length():
+    """Прием без Content-Length (chunked): прерывается на лимите, частичный файл удаляется"""
+    with IngestConfig() as config:
+        body = multipart_body('big.pdf', PDF + b'0' * (2 * MAX_BYTES))
+        response = ocr_app.app.test_client().post(
+            '/jobs', input_stream=io.BytesIO(body),
+            content_type=f'multipart/form-data; boundary={BOUNDARY}',
+            headers={'Transfer-Encoding': 'chunked'},
+            environ_overrides={'wsgi.input_terminated': True},
+        )
+        assert response.status_code == 413
+        assert config.spooled() == []
+
+
+def test_magic_bytes_mismatch():
+    """PNG под именем .pdf: 400, каталог задачи не создается, принятый файл удален"""
+    with IngestConfig() as config:
+        workspaces_before = set(os.listdir(ocr_app.app.config['JOB_WORKSPACE_DIR']))
+        response = post_document('fake.pdf', PNG)
+        assert response.status_code == 400
+        assert 'расширению' in response.get_json()['message']
+        assert config.spooled() == []
+        assert set(os.listdir(ocr_app.app.config['JOB_WORKSPACE_DIR'])) == workspaces_before
+
+
+def test_accepted_file_is_claimed():
+    """Допустимый файл переносится в каталог задачи, SHA-256 посчитан при приеме, файл передан открытым"""
+    captured = {}
+    original_submit = ocr_app.job_manager.submit
+
+    def capture_submit(func, *args, **kwargs):
+        captured.update(args=args, kwargs=kwargs)
+        raise ocr_app.JobQueueFullError("тест: задача не выполняется")
+
+    with IngestConfig() as config:
+        ocr_app.job_manager.submit = capture_submit
+        try:
+            response = post_document('doc.pdf', PDF)
+        finally:
+            ocr_app.job_manager.submit = original_submit
+        assert response.status_code == 503
+        assert config.spooled() == []
+    workspace, filepath = captured['args'][0], captured['args'][1]
+    assert os.path.basename(filepath) == 'doc.pdf'
+    assert os.path.dirname(filepath) == workspace.path
+    assert captured['kwargs']['document_hash'] == hashlib.sha256(PDF).hexdigest()
+    assert not os.path.exists(workspace.path)  # Задача не поставлена - каталог удален
+    assert captured['kwargs']['source_file'].closed  # Открытый файл закрыт хуком очистки
+
+
+def test_claimed_file_stays_open():
+    """claim() переносит файл и отдает его открытым с начала - данные читаются без повторного открытия"""
+    spool_dir = tempfile.mkdtemp(dir=TEST_DIR)
+    ingested = ocr_app.IngestedFile(spool_dir, MAX_BYTES)
+    ingested.write(PDF)
+    target = os.path.join(tempfile.mkdtemp(dir=TEST_DIR), 'doc.pdf')
+    source_file = ingested.claim(target)
+    ingested.close()  # Закрытие запроса не затрагивает переданный файл
+    try:
+        assert isinstance(source_file, io.BufferedReader)  # Тип содержимого, который принимает files.upload
+        assert source_file.read() == PDF
+        assert os.path.exists(target)
+        assert os.listdir(spool_dir) == []
+    finally:
+        source_file.close()
+
+
+def main():
+    """Основная функция тестирования"""
+    for test in (test_too_large_by_content_length,
+                 test_too_large_without_content_length,
+                 test_magic_bytes_mismatch,
+                 test_accepted_file_is_claimed,
+                 test_claimed_file_stays_open):
+        test()
+        print(f"✅ {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Тест сессий возобновляемой загрузки между процессами
+Два UploadSessionManager над одним корнем каталогов задач играют роль двух воркеров
+(у каждого своя память): части одной загрузки принимают оба, завершение проверяет
+SHA-256 даже без хэша, посчитанного по мере приема, без хэша от клиента - размер,
+завершение видно обоим
+"""
+
+import hashlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+
+TEST_DIR = tempfile.mkdtemp(prefix="mistral_ocr_upload_test_")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from services.upload_sessions import UploadHashMismatchError, UploadOffsetError, UploadSessionManager  # noqa: E402
+from services.workspace import WorkspaceManager  # noqa: E402
+
+DOCUMENT = b'%PDF-1.4\n' + os.urandom(3 * 1024 * 1024)
+CHUNK = 1024 * 1024
+
+
+def make_workers():
+    root = tempfile.mkdtemp(dir=TEST_DIR)
+    return tuple(UploadSessionManager(WorkspaceManager(root, root), max_bytes=64 * 1024 * 1024)
+                 for _ in range(2))
+
+
+def put(manager, upload_id, offset):
+    session = manager.get(upload_id)
+    assert session is not None
+    return session.write_chunk(offset, io.BytesIO(DOCUMENT[offset:offset + CHUNK]))
+
+
+def test_chunks_across_workers():
+    """Части принимают разные воркеры; завершение на другом воркере хэширует файл заново"""
+    worker_a, worker_b = make_workers()
+    sha256 = hashlib.sha256(DOCUMENT).hexdigest()
+    session = worker_a.create('big.pdf', len(DOCUMENT), sha256, options={'export_format': 'links'})
+    upload_id = session.id
+
+    assert worker_b.is_active(upload_id)
+    assert put(worker_a, upload_id, 0) == CHUNK
+    assert put(worker_b, upload_id, CHUNK) == 2 * CHUNK
+    # Воркер A видит смещение, записанное B, и не принимает устаревшую часть
+    try:
+        put(worker_a, upload_id, CHUNK)
+        raise AssertionError("ожидалась UploadOffsetError")
+    except UploadOffsetError as e:
+        assert e.offset == 2 * CHUNK
+    offset = 2 * CHUNK
+    while offset < len(DOCUMENT):
+        offset = put(worker_a, upload_id, offset)
+
+    remote = worker_b.get(upload_id)
+    assert remote.options == {'export_format': 'links'}
+    path = remote.finalize()
+    assert remote.sha256 == sha256
+    with open(path, 'rb') as f:
+        assert f.read() == DOCUMENT
+
+    worker_b.finish(upload_id)
+    assert worker_a.get(upload_id) is None
+    assert not worker_a.is_active(upload_id)
+    assert os.path.exists(path)  # Каталог передан задаче, файл на месте
+
+
+def test_hash_mismatch_detected_without_local_digest():
+    """Поврежденные данные обнаруживаются и тогда, когда хэш считается по файлу"""
+    worker_a, worker_b = make_workers()
+    session = worker_a.create('bad.pdf', 2 * CHUNK, hashlib.sha256(DOCUMENT[:2 * CHUNK]).hexdigest())
+    session.write_chunk(0, io.BytesIO(DOCUMENT[:CHUNK]))
+    worker_b.get(session.id).write_chunk(CHUNK, io.BytesIO(b'\x00' * CHUNK))
+    try:
+        worker_a.get(session.id).finalize()
+        raise AssertionError("ожидалась UploadHashMismatchError")
+    except UploadHashMismatchError:
+        pass
+
+
+def test_finalize_without_client_hash():
+    """Без хэша от клиента завершение проверяет размер, а SHA-256 считает сервер"""
+    worker_a, worker_b = make_workers()
+    session = worker_a.create('nohash.pdf', 2 * CHUNK)
+    session.write_chunk(0, io.BytesIO(DOCUMENT[:CHUNK]))
+    try:
+        worker_b.get(session.id).finalize()
+        raise AssertionError("ожидалась ValueError")
+    except ValueError:
+        pass
+    worker_b.get(session.id).write_chunk(CHUNK, io.BytesIO(DOCUMENT[CHUNK:2 * CHUNK]))
+    remote = worker_b.get(session.id)
+    remote.finalize()
+    assert remote.sha256 == hashlib.sha256(DOCUMENT[:2 * CHUNK]).hexdigest()
+
+
+def test_expired_session_is_discarded():
+    """Сессия без активности дольше TTL не находится и не считается активной"""
+    worker_a, worker_b = make_workers()
+    session = worker_a.create('old.pdf', CHUNK)
+    past = session.updated_at - 7200
+    os.utime(session.part_path, (past, past))
+    worker_b.ttl_seconds = 3600
+    assert not worker_b.is_active(session.id)
+    assert worker_b.get(session.id) is None
+    assert not os.path.exists(session.workspace.path)
+
+
+def main():
+    """Основная функция тестирования"""
+    try:
+        for test in (test_chunks_across_workers,
+                     test_hash_mismatch_detected_without_local_digest,
+                     test_finalize_without_client_hash,
+                     test_expired_session_is_discarded):
+            test()
+            print(f"✅ {test.__name__}")
+    finally:
+        shutil.rmtree(TEST_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()